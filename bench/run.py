@@ -0,0 +1,449 @@
+#------------------------------------------
+#
+#  DL32 end-to-end benchmarks
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Runs the firmware under the host simulator and measures:
+#   scan_to_unlock  Wiegand frame end -> lock relay energized, per key store size
+#   http            /, /api/metrics and /metrics throughput and latency under concurrent clients,
+#                   one request per connection vs keep-alive
+#   mqtt_unlock     'unlock' command published -> 'Unlocked' status received
+#   doorbell        bell button pressed -> first tone on the buzzer
+#   key_sync        key list delta sync over MQTT: bytes and time per change, projected to a fleet
+#   boot            reset -> web server started, firmware compiled from source vs precompiled bytecode
+#   files           key store download, ETag revalidation, resumed download and upload over /files
+#   events          key swipe start -> access event on a WebUI event stream, event size vs page reload
+#   remote_auth     Wiegand frame end -> lock relay energized for keys granted by a remote authorization
+#                   service, first scan (looked up) vs repeat scans (cached), and cache hit rate
+#   clock           reset -> first NTP sync against a local server, clock error after it, and the cost
+#                   of stamping an event vs formatting the date and time as text
+# Results are written as JSON, named after the firmware _VERSION by default.
+#
+#   python bench/run.py [--only NAME ...] [--out FILE] [--quick]
+
+import argparse, http.client, json, os, platform, socket, sys, threading, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sim import board
+from sim.broker import Broker
+from sim.keyserver import KeyServer
+from sim.ntpserver import NtpServer
+from sim.device import Device, BELL_BUTTON, BUZZER, LOCK_RELAY, WIEGAND_0, WIEGAND_1
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Unused local TCP port for the simulated web server
+def free_port():
+  sock = socket.socket()
+  sock.bind(('127.0.0.1', 0))
+  port = sock.getsockname()[1]
+  sock.close()
+  return port
+
+# Summary statistics of a list of latencies in ms
+def summarize(samples):
+  samples = sorted(samples)
+  if not samples:
+    return {'n': 0}
+  def pct(p):
+    return round(samples[min(len(samples) - 1, int(p / 100 * len(samples)))], 3)
+  return {
+    'n': len(samples),
+    'min_ms': round(samples[0], 3),
+    'mean_ms': round(sum(samples) / len(samples), 3),
+    'p50_ms': pct(50),
+    'p95_ms': pct(95),
+    'p99_ms': pct(99),
+    'max_ms': round(samples[-1], 3)
+  }
+
+def boot(**kwargs):
+  return Device(web_port=free_port(), **kwargs).boot()
+
+# Shorten hold times so repeated triggers do not wait out the full unlock
+def fast_durations(device):
+  def apply():
+    for name in ('key_dur', 'mqtt_dur', 'http_dur', 'exitBut_dur'):
+      device.ns[name] = 20
+    device.ns['silent_mode'] = True
+  device.call(apply)
+
+# Swipe a card and return the time from the end of its Wiegand frame to the lock relay closing (ms)
+def swipe_to_relay(device, card):
+  after = len(board.events)
+  device.swipe(card)
+  relay_index, relay = device.wait_event('pin', LOCK_RELAY, 1, after=after)
+  # Frame ends at the last rising edge on either data line before the relay closes
+  frame_end = None
+  for event in board.events[after:relay_index]:
+    if event[1] == 'pin' and event[2] in (WIEGAND_0, WIEGAND_1) and event[3] == 1:
+      frame_end = event[0]
+  device.wait_event('pin', LOCK_RELAY, 0, after=relay_index)
+  return relay[0] - frame_end
+
+def bench_scan_to_unlock(sizes, repeats):
+  results = {}
+  for size in sizes:
+    keys = {}
+    for i in range(size):
+      keys[str(10000 + i)] = 'user' + str(i)
+    device = boot(keys=keys)
+    try:
+      fast_durations(device)
+      card = 10000 + size - 1
+      samples = []
+      for i in range(repeats):
+        samples.append(swipe_to_relay(device, card))
+        time.sleep(0.1)
+      results[str(size)] = summarize(samples)
+    finally:
+      device.stop()
+  return results
+
+def _http_worker(port, path, count, keepalive, samples, errors):
+  headers = {} if keepalive else {'Connection': 'close'}
+  conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+  for i in range(count):
+    start = time.perf_counter()
+    try:
+      conn.request('GET', path, headers=headers)
+      response = conn.getresponse()
+      response.read()
+    except Exception:
+      errors.append('error')
+      conn.close()
+      conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+      continue
+    if response.status == 503:
+      errors.append('rejected')
+      continue
+    samples.append((time.perf_counter() - start) * 1000)
+  conn.close()
+
+def bench_http(paths, clients, requests_per_client):
+  device = boot(keys={'1234': 'bench'})
+  results = {}
+  try:
+    for path in paths:
+      for keepalive in (False, True):
+        for client_count in clients:
+          samples = []
+          errors = []
+          threads = [threading.Thread(target=_http_worker, args=(device.web_port, path, requests_per_client, keepalive, samples, errors)) for i in range(client_count)]
+          start = time.perf_counter()
+          for thread in threads:
+            thread.start()
+          for thread in threads:
+            thread.join()
+          elapsed = time.perf_counter() - start
+          result = summarize(samples)
+          result['clients'] = client_count
+          result['errors'] = errors.count('error')
+          result['rejected'] = errors.count('rejected')
+          result['requests_per_s'] = round(len(samples) / elapsed, 1)
+          results[path + ' x' + str(client_count) + (' keep-alive' if keepalive else ' close')] = result
+    results['server'] = device.call(device.ns['webserver'].to_dict)
+  finally:
+    device.stop()
+  return results
+
+def bench_mqtt_unlock(repeats):
+  device = boot()
+  try:
+    fast_durations(device)
+    cmd_topic = device.config['mqtt_cmd_top']
+    sta_topic = device.config['mqtt_sta_top']
+    samples = []
+    for i in range(repeats):
+      after = len(device.broker.messages)
+      start = time.monotonic()
+      device.broker.publish(cmd_topic, 'unlock')
+      index, stamp, msg = device.broker.expect(sta_topic, 'Unlocked', after=after)
+      samples.append((stamp - start) * 1000)
+      device.broker.expect(sta_topic, 'Locked', after=index)
+      time.sleep(0.05)
+    return summarize(samples)
+  finally:
+    device.stop()
+
+def bench_doorbell(repeats):
+  device = boot(config={'doorbell': 'zip'})
+  try:
+    samples = []
+    for i in range(repeats):
+      after = len(board.events)
+      device.press(BELL_BUTTON, 100)
+      press_index, press = device.wait_event('pin', BELL_BUTTON, 0, after=after)
+      tone_index, tone = device.wait_event('pwm_duty', BUZZER, None, after=press_index)
+      while tone[3] == 0:
+        tone_index, tone = device.wait_event('pwm_duty', BUZZER, None, after=tone_index + 1)
+      samples.append(tone[0] - press[0])
+      while device.ns['bell_ringing']:
+        time.sleep(0.05)
+      time.sleep(0.1)
+    return summarize(samples)
+  finally:
+    device.stop()
+
+def bench_key_sync(size, changes, doors):
+  keys = {}
+  for i in range(size):
+    keys[str(100000 + i)] = 'user' + str(i)
+  with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dl32.cfg')) as cfg_file:
+    config = json.load(cfg_file)
+  broker = Broker(config['mqtt_brok'], config['mqtt_port'])
+  server = KeyServer(keys, broker=broker)
+  # Initial sync is measured from power-on, it completes during boot
+  start = time.monotonic()
+  device = boot(broker=broker)
+  try:
+    sta_topic = device.config['mqtt_sta_top']
+    index, stamp, msg = broker.expect(sta_topic, 'Key list synced to revision 1', timeout=60)
+    initial_ms = (stamp - start) * 1000
+    initial_bytes = server.bytes_sent['mqtt']
+    samples = []
+    sent = server.bytes_sent['mqtt']
+    for i in range(changes):
+      start = time.monotonic()
+      if i % 2:
+        rev = server.update({str(100000 + i): None})
+      else:
+        rev = server.update({str(200000 + i): 'new' + str(i)})
+      index, stamp, msg = broker.expect(sta_topic, 'Key list synced to revision ' + str(rev), after=index, timeout=10)
+      samples.append((stamp - start) * 1000)
+    per_change = (server.bytes_sent['mqtt'] - sent) / changes
+    result = summarize(samples)
+    result['keys'] = size
+    result['initial_sync_ms'] = round(initial_ms, 1)
+    result['initial_sync_bytes'] = initial_bytes
+    result['bytes_per_change_per_door'] = round(per_change, 1)
+    result['doors'] = doors
+    result['fleet_bytes_per_change'] = round(per_change * doors)
+    result['full_push_bytes_per_change'] = len(json.dumps(server.keys)) * doors
+    return result
+  finally:
+    device.stop()
+
+# Boot time as reported by the firmware, loading it from source and from bytecode compiled ahead of time
+def bench_boot(repeats):
+  result = {}
+  for mode in ('source', 'precompiled'):
+    samples = []
+    for i in range(repeats):
+      device = boot(precompiled=(mode == 'precompiled'))
+      try:
+        samples.append(device.ns['boot_ms'])
+      finally:
+        device.stop()
+    result[mode] = summarize(samples)
+  result['saved_ms'] = round(result['source']['p50_ms'] - result['precompiled']['p50_ms'], 3)
+  return result
+
+# Key store backup and restore over /files: full download, revalidation, resumed download and upload
+def bench_files(size, repeats):
+  keys = {}
+  for i in range(size):
+    keys[str(10000 + i)] = 'user' + str(i)
+  device = boot(keys=keys)
+  try:
+    conn = http.client.HTTPConnection('127.0.0.1', device.web_port, timeout=10)
+    def timed(method, path, body=None, headers={}):
+      start = time.perf_counter()
+      conn.request(method, path, body=body, headers=headers)
+      response = conn.getresponse()
+      data = response.read()
+      return (time.perf_counter() - start) * 1000, response, data
+    samples = {'download': [], 'revalidate': [], 'resume': [], 'upload': []}
+    for i in range(repeats):
+      ms, response, data = timed('GET', '/files/keys.cfg')
+      samples['download'].append(ms)
+      tag = response.getheader('ETag')
+      ms, response, unused = timed('GET', '/files/keys.cfg', headers={'If-None-Match': tag})
+      assert response.status == 304
+      samples['revalidate'].append(ms)
+      ms, response, unused = timed('GET', '/files/keys.cfg', headers={'Range': 'bytes=' + str(len(data) // 2) + '-', 'If-Range': tag})
+      assert response.status == 206
+      samples['resume'].append(ms)
+      ms, response, unused = timed('PUT', '/files/sd_backup.cfg', body=data)
+      assert response.status == 200
+      samples['upload'].append(ms)
+    conn.close()
+    result = {'bytes': len(data)}
+    for name in samples:
+      result[name] = summarize(samples[name])
+    result['download_kb_per_s'] = round(len(data) / result['download']['p50_ms'], 1)
+    result['upload_kb_per_s'] = round(len(data) / result['upload']['p50_ms'], 1)
+    return result
+  finally:
+    device.stop()
+
+# Key scan -> access event received by a WebUI event stream client, and bytes per event vs reloading the page
+def bench_events(repeats):
+  device = boot(keys={'1234': 'bench'})
+  try:
+    fast_durations(device)
+    conn = http.client.HTTPConnection('127.0.0.1', device.web_port, timeout=10)
+    conn.request('GET', '/')
+    page_bytes = len(conn.getresponse().read())
+    conn.close()
+    sock = socket.create_connection(('127.0.0.1', device.web_port), timeout=10)
+    sock.sendall(b'GET /events HTTP/1.1\r\nHost: dl32\r\n\r\n')
+    stream = sock.makefile('rb')
+    while stream.readline() not in (b'\r\n', b''):
+      pass
+    samples = []
+    event_bytes = []
+    for i in range(repeats):
+      start = time.perf_counter()
+      device.swipe(1234)
+      received = 0
+      while True:
+        line = stream.readline()
+        received += len(line)
+        if line.startswith(b'event: access'):
+          break
+      samples.append((time.perf_counter() - start) * 1000)
+      event_bytes.append(received)
+      time.sleep(0.2)
+    sock.close()
+    result = summarize(samples)
+    result['page_bytes'] = page_bytes
+    result['event_bytes'] = max(event_bytes)
+    return result
+  finally:
+    device.stop()
+
+# Keys only known to a remote authorization service answering after network_ms; each key is scanned scans times
+def bench_remote_auth(directory, repeats, scans, network_ms):
+  keys = {}
+  for i in range(directory):
+    keys[str(10000 + i)] = 'user' + str(i)
+  server = KeyServer(keys, http_port=free_port())
+  server.auth_delay = network_ms / 1000
+  device = boot(keys={}, config={'auth_url': server.auth_url})
+  try:
+    fast_durations(device)
+    uncached = []
+    cached = []
+    for i in range(repeats):
+      card = 10000 + i
+      uncached.append(swipe_to_relay(device, card))
+      time.sleep(0.1)
+      for j in range(scans - 1):
+        cached.append(swipe_to_relay(device, card))
+        time.sleep(0.1)
+    # A key the service does not know is denied once remotely, then from the cache
+    after = server.auth_requests
+    for i in range(scans):
+      device.swipe(99999)
+      time.sleep(0.3)
+    conn = http.client.HTTPConnection('127.0.0.1', device.web_port, timeout=10)
+    conn.request('GET', '/api/metrics')
+    auth = json.load(conn.getresponse())['auth']
+    conn.close()
+    lookups = auth['hits'] + auth['misses']
+    return {
+      'uncached': summarize(uncached),
+      'cached': summarize(cached),
+      'network_ms': network_ms,
+      'hit_rate': round(auth['hits'] / lookups, 3) if lookups else 0,
+      'service_requests': server.auth_requests,
+      'denied_key_requests': server.auth_requests - after,
+      'firmware': auth
+    }
+  finally:
+    device.stop()
+    server.close()
+
+# Boot repeats times against an NTP server answering after network_ms; time stamps calls to each time function
+def bench_clock(repeats, stamps, network_ms):
+  server = NtpServer(offset=86400, delay=network_ms / 1000)
+  sync_ms = []
+  errors = []
+  try:
+    for i in range(repeats):
+      # Board event times count from simulator start, so measure from this reset
+      reset_ms = board.now_us() / 1000
+      device = boot(config={'ntp_server': server.address})
+      try:
+        synced = device.wait_event('rtc', 'set')[1]
+        sync_ms.append(synced[0] - reset_ms)
+        clock = device.ns['clock']
+        errors.append(abs(device.call(lambda: clock.unix(clock.now())) - (time.time() + server.offset)))
+        if i == repeats - 1:
+          def measure():
+            costs = {}
+            for name, fn in (('stamp', clock.now), ('text', clock.text)):
+              start = time.perf_counter()
+              for j in range(stamps):
+                fn()
+              costs[name + '_us'] = round((time.perf_counter() - start) * 1000000 / stamps, 3)
+            return costs
+          costs = device.call(measure)
+      finally:
+        device.stop()
+  finally:
+    server.close()
+  result = {'reset_to_sync': summarize(sync_ms), 'max_error_s': round(max(errors), 3), 'network_ms': network_ms, 'requests': server.requests}
+  result.update(costs)
+  return result
+
+def firmware_version():
+  with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')) as main_file:
+    for line in main_file:
+      if line.startswith('_VERSION'):
+        return line.split("'")[1]
+  return 'unknown'
+
+def main():
+  parser = argparse.ArgumentParser(description='Run DL32 benchmarks against the host simulator')
+  parser.add_argument('--only', nargs='*', choices=('scan_to_unlock', 'http', 'mqtt_unlock', 'doorbell', 'key_sync', 'boot', 'files', 'events', 'remote_auth', 'clock'), help='benchmarks to run (default: all)')
+  parser.add_argument('--out', help='output JSON file (default: bench/results/<version>.json)')
+  parser.add_argument('--quick', action='store_true', help='fewer iterations, for smoke testing')
+  args = parser.parse_args()
+  selected = args.only or ('scan_to_unlock', 'http', 'mqtt_unlock', 'doorbell', 'key_sync', 'boot', 'files', 'events', 'remote_auth', 'clock')
+  repeats = 3 if args.quick else 20
+  results = {}
+  if 'scan_to_unlock' in selected:
+    sizes = (10, 1000) if args.quick else (10, 100, 1000, 10000)
+    results['scan_to_unlock'] = bench_scan_to_unlock(sizes, repeats)
+  if 'http' in selected:
+    clients = (1, 4) if args.quick else (1, 4, 16)
+    results['http'] = bench_http(('/', '/api/metrics', '/metrics'), clients, 5 if args.quick else 50)
+  if 'mqtt_unlock' in selected:
+    results['mqtt_unlock'] = bench_mqtt_unlock(repeats)
+  if 'doorbell' in selected:
+    results['doorbell'] = bench_doorbell(repeats)
+  if 'key_sync' in selected:
+    results['key_sync'] = bench_key_sync(1000 if args.quick else 10000, repeats, 50)
+  if 'boot' in selected:
+    results['boot'] = bench_boot(3 if args.quick else 10)
+  if 'files' in selected:
+    results['files'] = bench_files(1000 if args.quick else 10000, repeats)
+  if 'events' in selected:
+    results['events'] = bench_events(repeats)
+  if 'remote_auth' in selected:
+    results['remote_auth'] = bench_remote_auth(1000 if args.quick else 10000, repeats, 5, 20)
+  if 'clock' in selected:
+    results['clock'] = bench_clock(repeats, 10000 if args.quick else 100000, 20)
+  version = firmware_version()
+  report = {
+    'version': version,
+    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    'host': {'python': platform.python_version(), 'machine': platform.machine()},
+    'results': results
+  }
+  out = args.out
+  if out is None:
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out = os.path.join(RESULTS_DIR, version + '.json')
+  with open(out, 'w') as out_file:
+    json.dump(report, out_file, indent=2)
+  print(json.dumps(report, indent=2))
+  print('Results written to ' + out)
+
+if __name__ == '__main__':
+  main()
@@ -1,7 +1,14 @@
 import network, json, esp, gc
 import webrepl
+import ota
 
 gc.collect()
 esp.osdebug(None)
 
+# Install a staged OTA update, or roll back one that did not start cleanly
+try:
+  ota.boot()
+except Exception as e:
+  print('OTA: ' + str(e))
+
 webrepl.start()
\ No newline at end of file
@@ -0,0 +1,136 @@
+#------------------------------------------
+#
+#  DL32 internal event bus
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Decouples what happened (a key scanned, a button pressed, a command
+# received) from what is done about it. Producers call emit(), which only
+# copies the event into the queue of each consumer subscribed to its type
+# and wakes it, so it is cheap enough for the Wiegand callback. Consumers
+# are tasks awaiting get() on their own queue. Queues are preallocated
+# rings of fixed size; when one is full the new event is dropped for that
+# consumer alone and counted, so a slow consumer such as MQTT never holds
+# up the reader or the other consumers.
+#
+# An event is (type, obj, a, b, reader, stamp): obj carries a key number or
+# message, a and b are small integers whose meaning depends on the type,
+# and reader is the Wiegand reader it came from. Events about a door carry
+# the reader that has that door to itself, or 0 for the main door, and
+# events not tied to a reader carry 0. stamp is the clock.now() stamp of
+# the emit, which consumers format only when they show or export it.
+
+from micropython import const
+from array import array
+import uasyncio, clock
+
+# Event types
+KEY_GRANTED = const(0)  # obj key, a scan start ticks_us
+KEY_DENIED = const(1)   # obj key, a DENY_* reason, b facility code
+KEY_ADD = const(2)      # obj key scanned in add mode, a 1 if already authorized
+UNLOCK = const(3)       # a SRC_* source of the request
+GARAGE = const(4)       # a garage.CMD_* command
+PULSE = const(5)        # a garage relay pulsed
+BELL = const(6)
+PROG = const(7)
+COMMAND = const(8)      # obj MQTT command text
+KEY_DELTA = const(9)    # obj key list delta message
+UNLOCKED = const(10)    # door relay energized
+LOCKED = const(11)      # door relay released
+DOOR = const(12)        # a door.* state after a door sensor change or alarm
+KEY_LOOKUP = const(13)  # obj key missing from the key list, a scan start ticks_us, b facility code
+TYPES = const(14)
+
+TYPE_NAMES = ('key_granted', 'key_denied', 'key_add', 'unlock', 'garage', 'pulse', 'bell', 'prog', 'command', 'key_delta', 'unlocked', 'locked', 'door', 'key_lookup')
+
+# KEY_DENIED reasons
+DENY_UNKNOWN = const(0)
+DENY_SCHEDULE = const(1)
+DENY_EXPIRED = const(2)
+DENY_PASSBACK = const(3)
+DENY_UNAVAILABLE = const(4)
+
+# UNLOCK sources
+SRC_EXIT = const(0)
+SRC_HTTP = const(1)
+SRC_MQTT = const(2)
+
+emitted = array('L', [0] * TYPES)
+
+# Per consumer: name, type mask, ring slots with stamps, read and write positions, wake flag, drop count
+_names = []
+_masks = []
+_types = []
+_objs = []
+_a = []
+_b = []
+_readers = []
+_stamps = []
+_read = []
+_write = []
+_flags = []
+_dropped = []
+
+# Register a consumer for the given event types, returns its queue id
+def subscribe(name, types, size=8):
+  mask = 0
+  for event_type in types:
+    mask |= 1 << event_type
+  _names.append(name)
+  _masks.append(mask)
+  _types.append(array('B', [0] * size))
+  _objs.append([None] * size)
+  _a.append(array('l', [0] * size))
+  _b.append(array('l', [0] * size))
+  _readers.append(array('B', [0] * size))
+  _stamps.append(array('l', [0] * size))
+  _read.append(0)
+  _write.append(0)
+  _flags.append(uasyncio.ThreadSafeFlag())
+  _dropped.append(0)
+  return len(_names) - 1
+
+# Queue an event for every consumer subscribed to its type
+def emit(event_type, obj=None, a=0, b=0, reader=0):
+  emitted[event_type] += 1
+  bit = 1 << event_type
+  stamp = clock.now()
+  for q in range(len(_masks)):
+    if not _masks[q] & bit:
+      continue
+    size = len(_types[q])
+    pos = _write[q]
+    if pos - _read[q] >= size:
+      _dropped[q] += 1
+      continue
+    i = pos % size
+    _types[q][i] = event_type
+    _objs[q][i] = obj
+    _a[q][i] = a
+    _b[q][i] = b
+    _readers[q][i] = reader
+    _stamps[q][i] = stamp
+    _write[q] = pos + 1
+    _flags[q].set()
+
+# True if a queue has no room for another event
+def full(q):
+  return _write[q] - _read[q] >= len(_types[q])
+
+# Next event on a queue as (type, obj, a, b, reader, stamp), waiting for one if it is empty
+async def get(q):
+  while _read[q] == _write[q]:
+    await _flags[q].wait()
+  pos = _read[q]
+  i = pos % len(_types[q])
+  event = (_types[q][i], _objs[q][i], _a[q][i], _b[q][i], _readers[q][i], _stamps[q][i])
+  _objs[q][i] = None
+  _read[q] = pos + 1
+  return event
+
+def to_dict():
+  queues = {}
+  for q in range(len(_names)):
+    queues[_names[q]] = {'queued': _write[q] - _read[q], 'dropped': _dropped[q]}
+  return {'emitted': dict(zip(TYPE_NAMES, emitted)), 'queues': queues}
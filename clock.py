@@ -0,0 +1,178 @@
+#------------------------------------------
+#
+#  DL32 time service
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Keeps wall clock time synced over NTP and hands out compact timestamps.
+# A stamp is an integer count of seconds since 2000-01-01 UTC. Until about
+# 2034 that is a small int, so taking one never allocates, and it is cheap
+# enough for the Wiegand callback. Stamps are only turned into text by
+# text() and iso() when they are displayed or exported, and into Unix time
+# by unix() for JSON.
+#
+# The clock is anchored to ticks_ms: a sync records the NTP time and the
+# ticks it was received at, adjusted for half the round trip, and now() adds
+# the ticks elapsed since. The anchor is moved forward as time passes, so
+# the ticks difference stays well within the ticks_ms period. Each sync
+# also sets the RTC, so file times and time.localtime() are right as well.
+# Until the first sync, stamps come from the RTC.
+#
+# NTP requests go out over a non-blocking UDP socket that is polled while
+# the task sleeps, so a slow or missing server never holds up the event
+# loop. server may be 'host' or 'host:port'. Its address is looked up by
+# resolve(), which blocks while DNS answers, so main.py only calls it when
+# the server is configured and when WiFi connects; sync() uses the cached
+# address and fails until there is one.
+
+import socket, struct, time, uasyncio
+
+# Tunables, set by main.py
+server = 'pool.ntp.org'
+timeout = 1000
+interval = 3600000
+retry = 60000
+# Seconds added to UTC for local time
+utc_offset = 0
+
+# Seconds from 1900 (NTP) and from 1970 (Unix) to 2000
+NTP_2000 = 3155673600
+UNIX_2000 = 946684800
+# Seconds from the epoch of time.time() to 2000
+_EPOCH_2000 = 0 if time.gmtime(0)[0] == 2000 else UNIX_2000
+
+# Stamp at anchor ticks
+_anchor = 0
+_ticks = 0
+synced = False
+syncs = 0
+failures = 0
+last_sync = None
+# Correction made by the last sync, in seconds
+last_step = 0
+rtt_ms = 0
+
+_wake = None
+# (host, port) address of server, None until resolve() succeeds
+_addr = None
+
+# Current stamp
+def now():
+  global _anchor, _ticks
+  if not synced:
+    return int(time.time()) - _EPOCH_2000
+  elapsed = time.ticks_diff(time.ticks_ms(), _ticks) // 1000
+  # Keep the anchor within a day of now
+  if elapsed > 86400:
+    _anchor += elapsed
+    _ticks = time.ticks_add(_ticks, elapsed * 1000)
+    elapsed = 0
+  return _anchor + elapsed
+
+def unix(stamp):
+  return stamp + UNIX_2000
+
+# time.localtime() tuple of a stamp, or of now, in local time
+def localtime(stamp=None):
+  if stamp is None:
+    stamp = now()
+  return time.localtime(stamp + _EPOCH_2000 + utc_offset)
+
+# Stamp as YYYYMMDD_HHMMSS, for file names
+def text(stamp=None):
+  t = localtime(stamp)
+  return '{}{:02d}{:02d}_{:02d}{:02d}{:02d}'.format(t[0], t[1], t[2], t[3], t[4], t[5])
+
+# Stamp as YYYY-MM-DD HH:MM:SS, for display
+def iso(stamp=None):
+  t = localtime(stamp)
+  return '{}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}'.format(t[0], t[1], t[2], t[3], t[4], t[5])
+
+def _set_rtc(stamp):
+  try:
+    import machine
+    t = time.localtime(stamp + _EPOCH_2000)
+    machine.RTC().datetime((t[0], t[1], t[2], t[6], t[3], t[4], t[5], 0))
+  except:
+    pass
+
+# Look up and cache the address of server, returns True if it was found
+def resolve():
+  global _addr
+  _addr = None
+  if not server:
+    return False
+  host, _, port = server.partition(':')
+  try:
+    _addr = socket.getaddrinfo(host, int(port) if port else 123)[0][-1]
+  except Exception:
+    return False
+  return True
+
+# Ask the NTP server for the time once, returns True if the clock was set
+async def sync():
+  global _anchor, _ticks, synced, syncs, failures, last_sync, last_step, rtt_ms
+  if _addr is None:
+    failures += 1
+    return False
+  sock = None
+  try:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    request = bytearray(48)
+    request[0] = 0x1B
+    sent = time.ticks_ms()
+    sock.sendto(request, _addr)
+    while True:
+      try:
+        msg = sock.recv(48)
+        break
+      except OSError:
+        if time.ticks_diff(time.ticks_ms(), sent) >= timeout:
+          raise
+        await uasyncio.sleep_ms(10)
+    received = time.ticks_ms()
+    seconds, fraction = struct.unpack('!II', msg[40:48])
+    if not seconds:
+      raise ValueError()
+  except Exception:
+    failures += 1
+    return False
+  finally:
+    if sock is not None:
+      sock.close()
+  rtt_ms = time.ticks_diff(received, sent)
+  stamp = seconds - NTP_2000
+  # Ticks at which the server's second began, assuming the reply took half the round trip
+  ticks = time.ticks_add(received, -(rtt_ms // 2) - (fraction >> 22) * 1000 // 1024)
+  if synced:
+    last_step = stamp - (_anchor + (time.ticks_diff(ticks, _ticks) + 500) // 1000)
+  _anchor = stamp
+  _ticks = ticks
+  synced = True
+  syncs += 1
+  last_sync = stamp
+  _set_rtc(stamp)
+  return True
+
+# Sync again now rather than at the next interval
+def resync():
+  if _wake is not None:
+    _wake.set()
+
+# Sync every interval ms, or every retry ms until a sync succeeds
+async def task():
+  global _wake
+  _wake = uasyncio.Event()
+  while True:
+    if server:
+      await sync()
+    _wake.clear()
+    try:
+      await uasyncio.wait_for_ms(_wake.wait(), interval if synced else retry)
+    except uasyncio.TimeoutError:
+      pass
+
+def to_dict():
+  return {'time': unix(now()), 'synced': synced, 'server': server, 'resolved': _addr is not None, 'syncs': syncs, 'failures': failures, 'last_sync': None if last_sync is None else unix(last_sync), 'last_step_s': last_step, 'rtt_ms': rtt_ms}
@@ -0,0 +1,130 @@
+#------------------------------------------
+#
+#  DL32 configuration registry
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Typed, validated view of dl32.cfg. Every known key has a kind, a default
+# and the component group it belongs to. load() takes the file contents
+# at boot; update() validates a set of changes as a whole, applies them
+# only if all are valid, and then calls the subscribers of each group
+# that actually changed, so components re-apply their own settings live
+# instead of the board resetting. values is the dictionary saved back to
+# dl32.cfg.
+
+from micropython import const
+
+# Component groups
+WIFI = const(1)
+MQTT = const(2)
+WEB = const(4)
+DOORBELL = const(8)
+SYNC = const(16)
+
+# Value kinds
+TEXT = const(0)
+PORT = const(1)
+URL = const(2)
+
+MAX_TEXT = 64
+
+# name -> (kind, default, group)
+SCHEMA = {
+  'wifi_ssid': (TEXT, '', WIFI),
+  'wifi_pass': (TEXT, '', WIFI),
+  'mqtt_brok': (TEXT, '', MQTT),
+  'mqtt_port': (PORT, 1883, MQTT),
+  'mqtt_clid': (TEXT, 'DL32', MQTT),
+  'mqtt_user': (TEXT, '', MQTT),
+  'mqtt_pass': (TEXT, '', MQTT),
+  'mqtt_sta_top': (TEXT, 'dl32/sta', MQTT),
+  'mqtt_cmd_top': (TEXT, 'dl32/cmd', MQTT),
+  'mqtt_keys_top': (TEXT, 'dl32/keys', MQTT),
+  'web_port': (PORT, 80, WEB),
+  'doorbell': (TEXT, 'mking', DOORBELL),
+  'key_sync_url': (URL, '', SYNC),
+  'auth_url': (URL, '', SYNC),
+  'ntp_server': (TEXT, 'pool.ntp.org', SYNC),
+  'ota_url': (URL, 'https://raw.githubusercontent.com/Mark-Roly/DL32_mpy/main/', SYNC)
+}
+
+# Keys never reported back by to_dict()
+SECRETS = ('wifi_pass', 'mqtt_pass')
+
+values = {}
+# Extra checks for a key beyond its kind: name -> function returning True if the value is acceptable
+checks = {}
+# (group mask, function called with the mask of changed groups)
+_subscribers = []
+
+reloads = 0
+
+# Value converted to the kind of key name, raises ValueError if invalid
+def convert(name, value):
+  kind = SCHEMA[name][0]
+  if kind == PORT:
+    value = int(value)
+    if value < 1 or value > 65535:
+      raise ValueError(name)
+  else:
+    value = str(value)
+    if len(value) > (MAX_TEXT if kind == TEXT else 4 * MAX_TEXT):
+      raise ValueError(name)
+    if kind == URL and value != '' and not (value.startswith('http://') or value.startswith('https://')):
+      raise ValueError(name)
+  check = checks.get(name)
+  if check is not None and not check(value):
+    raise ValueError(name)
+  return value
+
+# Take values from a configuration file, keeping the default for missing or invalid keys; returns the invalid names
+def load(raw):
+  invalid = []
+  values.clear()
+  for name in SCHEMA:
+    value = SCHEMA[name][1]
+    if name in raw:
+      try:
+        value = convert(name, raw[name])
+      except (ValueError, TypeError):
+        invalid.append(name)
+    values[name] = value
+  return invalid
+
+# Call fn(changed) after an update changes any key of the given groups
+def subscribe(groups, fn):
+  _subscribers.append((groups, fn))
+
+# Validate and apply changes, returns a dictionary of invalid names (nothing is applied unless it is empty)
+def update(changes):
+  global reloads
+  converted = {}
+  errors = {}
+  for name in changes:
+    if name not in SCHEMA:
+      errors[name] = 'unknown'
+      continue
+    try:
+      converted[name] = convert(name, changes[name])
+    except (ValueError, TypeError):
+      errors[name] = 'invalid'
+  if errors:
+    return errors
+  changed = 0
+  for name in converted:
+    if values.get(name) != converted[name]:
+      values[name] = converted[name]
+      changed |= SCHEMA[name][2]
+  if changed:
+    reloads += 1
+    for groups, fn in _subscribers:
+      if groups & changed:
+        fn(changed)
+  return errors
+
+def to_dict():
+  result = {}
+  for name in values:
+    result[name] = '' if name in SECRETS else values[name]
+  return result
@@ -0,0 +1,173 @@
+#------------------------------------------
+#
+#  DL32 event bus consumers
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# The tasks acting on bus events, each awaiting its own queue: access
+# drives the lock relay and garage door and changes the key list, auth asks
+# the remote authorization service about unknown keys, feedback beeps and
+# lights, report logs and publishes to MQTT, metrics counts and events
+# feeds the WebUI. main.py spawns them under the supervisor. They reach
+# the firmware's functions, tunables and state through dl32, the
+# namespace.Namespace over main.py's globals that it sets before the
+# event loop starts.
+
+import json, bus, clock, counters, door, events, garage, led, loopmon, readers, remoteauth
+
+# Firmware namespace, set by main.py
+dl32 = None
+
+# Event bus queues of the consumer tasks
+ACCESS_Q = bus.subscribe('access', (bus.KEY_GRANTED, bus.KEY_ADD, bus.UNLOCK, bus.GARAGE, bus.KEY_DELTA, bus.COMMAND))
+FEEDBACK_Q = bus.subscribe('feedback', (bus.KEY_DENIED, bus.UNLOCKED, bus.PULSE, bus.BELL))
+REPORT_Q = bus.subscribe('report', (bus.KEY_GRANTED, bus.KEY_DENIED, bus.KEY_ADD, bus.UNLOCK, bus.PULSE, bus.BELL, bus.PROG, bus.COMMAND, bus.UNLOCKED, bus.LOCKED), 16)
+METRICS_Q = bus.subscribe('metrics', (bus.KEY_GRANTED, bus.KEY_DENIED, bus.UNLOCK))
+EVENTS_Q = bus.subscribe('events', (bus.KEY_GRANTED, bus.KEY_DENIED, bus.BELL, bus.UNLOCKED, bus.LOCKED, bus.DOOR))
+AUTH_Q = bus.subscribe('auth', (bus.KEY_LOOKUP,), 4)
+
+DENY_REASONS = ('unknown', 'outside schedule', 'expired', 'anti-passback', 'authorization unavailable')
+DENY_COUNTERS = (counters.SCAN_UNAUTHORIZED, counters.SCAN_OUT_OF_SCHEDULE, counters.SCAN_EXPIRED, counters.SCAN_PASSBACK, counters.SCAN_UNAVAILABLE)
+UNLOCK_COUNTERS = (counters.UNLOCK_EXIT, counters.UNLOCK_HTTP, counters.UNLOCK_MQTT)
+
+# Drive the lock relay and garage door and change the key list
+async def access_task():
+  while True:
+    event, obj, a, b, reader, stamp = await bus.get(ACCESS_Q)
+    if event == bus.KEY_GRANTED:
+      dl32.unlock(dl32.key_dur, a, obj, reader)
+    elif event == bus.UNLOCK:
+      dl32.unlock((dl32.exitBut_dur, dl32.http_dur, dl32.mqtt_dur)[a])
+      if a == bus.SRC_HTTP and dl32.garage_mode:
+        dl32.gar_command(garage.CMD_TOGGLE)
+    elif event == bus.GARAGE:
+      dl32.gar_command(a)
+    elif event == bus.KEY_ADD and not a:
+      dl32.add_key(obj, stamp)
+    elif event == bus.KEY_DELTA:
+      try:
+        delta = json.loads(obj)
+      except:
+        print('ERROR: Invalid key list delta')
+        continue
+      dl32.apply_key_delta(delta)
+    elif event == bus.COMMAND and obj == 'sync_keys':
+      dl32.request_key_sync()
+
+# Ask the remote authorization service about keys missing from the key list, one at a time
+async def auth_task():
+  while True:
+    event, obj, a, b, reader, stamp = await bus.get(AUTH_Q)
+    known = await remoteauth.lookup(obj, reader)
+    if known:
+      dl32.grant(obj, a, b, reader)
+    else:
+      bus.emit(bus.KEY_DENIED, obj, bus.DENY_UNAVAILABLE if known is None else bus.DENY_UNKNOWN, b, reader)
+
+# Beeps and lights for people at the door
+async def feedback_task():
+  while True:
+    event, obj, a, b, reader, stamp = await bus.get(FEEDBACK_Q)
+    if event == bus.UNLOCKED or event == bus.PULSE:
+      await dl32.stop_beep()
+      await dl32.beep(dl32.UNLOCK_BEEP)
+    elif event == bus.KEY_DENIED:
+      led.post(led.DENIED, dl32.np_invalid, dl32.led_denied_dur)
+      await dl32.stop_beep()
+      dl32.start_beep(dl32.INVALID_BEEP)
+    elif event == bus.BELL:
+      loopmon.spawn(dl32.ring_bell(dl32.current))
+
+# Name of a key holder, from the key list or the remote authorization service
+def key_name(key):
+  if key in dl32.KEYS_DICT:
+    return dl32.KEYS_DICT[key]
+  return remoteauth.name(key)
+
+# Where a scan happened, named only once the board has more than one reader
+def reader_text(reader):
+  if readers.count() == 1:
+    return ''
+  return ' at reader ' + str(reader)
+
+# Console log, MQTT status messages and MQTT command replies
+async def report_task():
+  while True:
+    event, obj, a, b, reader, stamp = await bus.get(REPORT_Q)
+    if event == bus.KEY_GRANTED:
+      print('  Authorized key ' + obj + ' (' + key_name(obj) + ')' + reader_text(reader))
+      dl32.publish_status('Authorized key ' + obj + ' (' + key_name(obj) + ') scanned' + reader_text(reader))
+    elif event == bus.KEY_DENIED and a == bus.DENY_UNKNOWN:
+      print('  Unauthorized key ' + obj + ', facility code ' + str(b) + reader_text(reader))
+      dl32.publish_status('Unauthorized key ' + obj + ' scanned' + reader_text(reader))
+    elif event == bus.KEY_DENIED:
+      print('  Denied key ' + obj + ' (' + dl32.KEYS_DICT.get(obj, '') + '): ' + DENY_REASONS[a] + reader_text(reader))
+      dl32.publish_status('Denied key ' + obj + ' (' + dl32.KEYS_DICT.get(obj, '') + ') scanned' + reader_text(reader) + ': ' + DENY_REASONS[a])
+    elif event == bus.KEY_ADD and a:
+      print('  key #' + obj + ' is already authorized.')
+    elif event == bus.UNLOCK and a == bus.SRC_EXIT:
+      print('Exit button pressed')
+      dl32.publish_status('Exit button pressed')
+    elif event == bus.UNLOCK and a == bus.SRC_MQTT:
+      print('Unlock command received over MQTT')
+    elif event == bus.UNLOCKED and reader:
+      print('  Door of reader ' + str(reader) + ' unlocked')
+      dl32.publish_status('Unlocked door of reader ' + str(reader))
+    elif event == bus.UNLOCKED:
+      print('  Unlocked2')
+      dl32.publish_status('Unlocked')
+    elif event == bus.LOCKED and reader:
+      print('  Door of reader ' + str(reader) + ' locked')
+      dl32.publish_status('Locked door of reader ' + str(reader))
+    elif event == bus.LOCKED:
+      print('  Locked2')
+      dl32.publish_status('Locked')
+    elif event == bus.PULSE:
+      print('  ' + dl32.GAR_MESSAGES[a])
+      dl32.publish_status(dl32.GAR_MESSAGES[a])
+    elif event == bus.BELL:
+      print('bell button pushed')
+    elif event == bus.PROG:
+      print('prog button pressed')
+      dl32.publish_status('Prog button pressed')
+    elif event == bus.COMMAND:
+      print('MQTT command: ' + obj)
+      if obj == 'ping':
+        dl32.publish_status('pong')
+      elif obj == 'metrics':
+        dl32.publish_metrics()
+      elif obj != 'sync_keys':
+        print('Command not recognized!')
+
+# Scan and unlock counters
+async def metrics_task():
+  while True:
+    event, obj, a, b, reader, stamp = await bus.get(METRICS_Q)
+    if event == bus.KEY_GRANTED:
+      counters.inc(counters.SCAN_AUTHORIZED)
+      counters.inc(counters.UNLOCK_KEY)
+    elif event == bus.KEY_DENIED:
+      counters.inc(DENY_COUNTERS[a])
+    elif event == bus.UNLOCK:
+      counters.inc(UNLOCK_COUNTERS[a])
+
+# Door and lock state as event stream JSON, as of the given stamp
+def door_json(stamp):
+  return '{"state":"' + door.STATE_NAMES[door.state] + '","open":' + ('true' if door.door_open else 'false') + ',"t":' + str(clock.unix(stamp)) + '}'
+
+# Live events for WebUI pages, with the Unix time they happened at as "t"
+async def events_task():
+  while True:
+    event, obj, a, b, reader, stamp = await bus.get(EVENTS_Q)
+    t = str(clock.unix(stamp))
+    if event == bus.KEY_GRANTED:
+      events.publish('access', '{"key":"' + obj + '","result":"granted","reader":' + str(reader) + ',"t":' + t + '}')
+    elif event == bus.KEY_DENIED:
+      events.publish('access', '{"key":"' + obj + '","result":"' + DENY_REASONS[a] + '","reader":' + str(reader) + ',"t":' + t + '}')
+    elif event == bus.BELL:
+      events.publish('bell', '{"t":' + t + '}')
+    elif reader:
+      events.publish('door', '{"state":"' + ('unlocked' if event == bus.UNLOCKED else 'locked') + '","reader":' + str(reader) + ',"t":' + t + '}')
+    else:
+      events.publish('door', door_json(stamp))
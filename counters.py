@@ -0,0 +1,97 @@
+#------------------------------------------
+#
+#  DL32 access path counters
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Fixed-size, preallocated counters and scan-to-relay latency histogram,
+# rendered in Prometheus text exposition format. Incrementing never
+# allocates, so counting is safe on the access path.
+
+from micropython import const
+from array import array
+
+# Counter indices
+SCAN_AUTHORIZED = const(0)
+SCAN_UNAUTHORIZED = const(1)
+SCAN_OUT_OF_SCHEDULE = const(2)
+SCAN_EXPIRED = const(3)
+SCAN_PASSBACK = const(4)
+SCAN_UNAVAILABLE = const(5)
+UNLOCK_KEY = const(6)
+UNLOCK_EXIT = const(7)
+UNLOCK_HTTP = const(8)
+UNLOCK_MQTT = const(9)
+BELL_RING = const(10)
+MQTT_RECONNECT = const(11)
+MQTT_PUBLISH_FAIL = const(12)
+DOOR_FORCED = const(13)
+DOOR_HELD = const(14)
+
+# Metric name, label and help text of each counter, in index order
+COUNTERS = (
+  ('dl32_scans_total', 'result="authorized"', 'Key scans by result'),
+  ('dl32_scans_total', 'result="unauthorized"', None),
+  ('dl32_scans_total', 'result="out_of_schedule"', None),
+  ('dl32_scans_total', 'result="expired"', None),
+  ('dl32_scans_total', 'result="passback"', None),
+  ('dl32_scans_total', 'result="auth_unavailable"', None),
+  ('dl32_unlocks_total', 'source="key"', 'Unlocks by source'),
+  ('dl32_unlocks_total', 'source="exit"', None),
+  ('dl32_unlocks_total', 'source="http"', None),
+  ('dl32_unlocks_total', 'source="mqtt"', None),
+  ('dl32_doorbell_rings_total', None, 'Doorbell rings'),
+  ('dl32_mqtt_reconnects_total', None, 'MQTT reconnect attempts'),
+  ('dl32_mqtt_publish_failures_total', None, 'Failed MQTT publishes'),
+  ('dl32_door_alarms_total', 'type="forced"', 'Door alarms by type'),
+  ('dl32_door_alarms_total', 'type="held"', None)
+)
+
+counts = array('L', [0] * len(COUNTERS))
+
+# Upper bounds (us) of scan-to-relay latency histogram buckets, the last bucket catches the rest
+LATENCY_BOUNDS = (1000, 2000, 5000, 10000, 25000, 50000, 100000, 250000, 500000)
+LATENCY_LABELS = ('0.001', '0.002', '0.005', '0.01', '0.025', '0.05', '0.1', '0.25', '0.5', '+Inf')
+
+latency_hist = array('L', [0] * (len(LATENCY_BOUNDS) + 1))
+latency_sum_us = 0
+
+# Increment a counter
+def inc(index):
+  counts[index] += 1
+
+# Record a scan-to-relay latency in microseconds
+def observe_latency(us):
+  global latency_sum_us
+  i = 0
+  while i < len(LATENCY_BOUNDS) and us > LATENCY_BOUNDS[i]:
+    i += 1
+  latency_hist[i] += 1
+  latency_sum_us += us
+
+# Yield counters and latency histogram as Prometheus text lines
+def render():
+  for i in range(len(COUNTERS)):
+    name, labels, help_text = COUNTERS[i]
+    if help_text is not None:
+      yield '# HELP ' + name + ' ' + help_text + '\n# TYPE ' + name + ' counter\n'
+    if labels is None:
+      yield name + ' ' + str(counts[i]) + '\n'
+    else:
+      yield name + '{' + labels + '} ' + str(counts[i]) + '\n'
+  yield '# HELP dl32_scan_to_relay_seconds Time from key scan to lock relay energized\n# TYPE dl32_scan_to_relay_seconds histogram\n'
+  total = 0
+  for i in range(len(latency_hist)):
+    total += latency_hist[i]
+    yield 'dl32_scan_to_relay_seconds_bucket{le="' + LATENCY_LABELS[i] + '"} ' + str(total) + '\n'
+  yield 'dl32_scan_to_relay_seconds_sum ' + str(latency_sum_us / 1000000) + '\n'
+  yield 'dl32_scan_to_relay_seconds_count ' + str(total) + '\n'
+
+# Yield a gauge as Prometheus text lines
+def gauge(name, help_text, value):
+  yield '# HELP ' + name + ' ' + help_text + '\n# TYPE ' + name + ' gauge\n' + name + ' ' + str(value) + '\n'
+
+# Yield a counter kept outside COUNTERS as Prometheus text lines, name ending in _total
+def counter(name, help_text, value):
+  yield '# HELP ' + name + ' ' + help_text + '\n# TYPE ' + name + ' counter\n' + name + ' ' + str(value) + '\n'
@@ -0,0 +1,128 @@
+#------------------------------------------
+#
+#  DL32 door state machine
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Tracks the lock relay and door position together so the relay can be
+# released as soon as an authorized opening is over, and raises alarms for
+# doors opened without an unlock or left open. Hardware agnostic: main.py
+# feeds sensor readings into poll() and acts on the returned event flags.
+#
+#   LOCKED    door closed, relay off
+#   UNLOCKED  door closed, relay on, waiting to be opened
+#   OPEN      door opened after an unlock, relay on until closed or timed out
+#   HELD      door left open longer than held_dur
+#   FORCED    door opened while locked
+
+from micropython import const
+import time
+
+# States
+LOCKED = const(0)
+UNLOCKED = const(1)
+OPEN = const(2)
+HELD = const(3)
+FORCED = const(4)
+
+STATE_NAMES = ('locked', 'unlocked', 'open', 'held', 'forced')
+
+# poll() event flags
+EV_OPENED = const(1)
+EV_CLOSED = const(2)
+EV_FORCED = const(4)
+EV_HELD = const(8)
+EV_RELOCK = const(16)
+
+# Milliseconds the door may stay open before EV_HELD (0 = disabled)
+held_dur = 0
+# Milliseconds a key is refused after it was last used to open the door (0 = disabled)
+passback_dur = 0
+# Only count a key as used once the door has actually been opened, needs a door sensor
+confirm_entry = True
+
+state = LOCKED
+door_open = False
+relay = False
+relay_since = 0
+relay_until = 0
+opened_at = 0
+# Total milliseconds the relay has been energized
+relay_ms = 0
+
+pending_key = None
+passback_key = None
+passback_at = 0
+
+# Set the initial door position at boot
+def init(is_open, now):
+  global state, door_open, opened_at
+  door_open = is_open
+  opened_at = now
+  state = OPEN if is_open else LOCKED
+
+# Energize the relay for up to dur ms, key is the badge that was granted access if any
+def unlock(dur, now, key=None):
+  global state, relay, relay_since, relay_until, pending_key, passback_key, passback_at
+  if not relay:
+    relay = True
+    relay_since = now
+  relay_until = time.ticks_add(now, dur)
+  if state == LOCKED:
+    state = UNLOCKED
+  if key is not None:
+    if confirm_entry:
+      pending_key = key
+    else:
+      passback_key = key
+      passback_at = now
+
+# True if key was used to open the door less than passback_dur ms ago
+def passback(key, now):
+  return passback_dur > 0 and key == passback_key and time.ticks_diff(now, passback_at) < passback_dur
+
+def _release(now):
+  global relay, relay_ms
+  relay = False
+  relay_ms += time.ticks_diff(now, relay_since)
+
+# Advance the state machine with the current door position, returns EV_* flags
+def poll(is_open, now):
+  global state, door_open, opened_at, pending_key, passback_key, passback_at
+  events = 0
+  if is_open != door_open:
+    door_open = is_open
+    if is_open:
+      opened_at = now
+      events |= EV_OPENED
+      if state == UNLOCKED:
+        state = OPEN
+        if pending_key is not None:
+          passback_key = pending_key
+          passback_at = now
+          pending_key = None
+      else:
+        state = FORCED
+        events |= EV_FORCED
+    else:
+      events |= EV_CLOSED
+      state = LOCKED
+      if relay:
+        # Closing after an opening re-secures the door straight away
+        _release(now)
+        events |= EV_RELOCK
+  if relay and time.ticks_diff(now, relay_until) >= 0:
+    _release(now)
+    events |= EV_RELOCK
+    pending_key = None
+    if state == UNLOCKED:
+      state = LOCKED
+  if held_dur > 0 and (state == OPEN or state == FORCED) and time.ticks_diff(now, opened_at) >= held_dur:
+    state = HELD
+    events |= EV_HELD
+  return events
+
+# Return state as a dictionary for JSON serialisation
+def to_dict():
+  return {'state': STATE_NAMES[state], 'open': door_open, 'relay': relay, 'relay_ms': relay_ms}
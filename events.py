@@ -0,0 +1,103 @@
+#------------------------------------------
+#
+#  DL32 live event stream
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Server-Sent Events for the WebUI. Each connected browser gets a Stream
+# as the body of its /events response; publish() formats an event once and
+# queues the same bytes on every stream, and the web server writes each
+# event out as soon as it is queued. Every stream has a small ring of
+# backlog events; if a browser falls that far behind, its oldest events
+# are dropped and counted. Streams are capped at max_clients so idle tabs
+# cannot use up the heap or the web server's connection slots. A comment
+# line is sent after heartbeat ms without events, which keeps proxies from
+# timing out and finds browsers that went away without closing.
+
+import uasyncio
+
+max_clients = 2
+heartbeat = 15000
+backlog = 8
+
+HEARTBEAT = b': \n\n'
+
+clients = []
+published = 0
+dropped = 0
+refused = 0
+
+# Event stream of one client, iterated by the web server as a response body
+class Stream:
+  # Flush each event to the client as soon as it is produced
+  live = True
+
+  def __init__(self):
+    self._ring = [None] * backlog
+    self._read = 0
+    self._write = 0
+    self._event = uasyncio.Event()
+    self.closed = False
+
+  def push(self, data):
+    global dropped
+    if self._write - self._read >= len(self._ring):
+      self._read += 1
+      dropped += 1
+    self._ring[self._write % len(self._ring)] = data
+    self._write += 1
+    self._event.set()
+
+  def __aiter__(self):
+    return self
+
+  async def __anext__(self):
+    if self.closed:
+      raise StopAsyncIteration
+    if self._read == self._write:
+      self._event.clear()
+      try:
+        await uasyncio.wait_for_ms(self._event.wait(), heartbeat)
+      except uasyncio.TimeoutError:
+        return HEARTBEAT
+      if self.closed:
+        raise StopAsyncIteration
+    i = self._read % len(self._ring)
+    data = self._ring[i]
+    self._ring[i] = None
+    self._read += 1
+    return data
+
+  def close(self):
+    self.closed = True
+    self._event.set()
+    if self in clients:
+      clients.remove(self)
+
+# Server-Sent Events message for an event name and JSON text
+def message(name, data):
+  return ('event: ' + name + '\ndata: ' + data + '\n\n').encode()
+
+# New client stream, or None when max_clients are already connected
+def connect():
+  global refused
+  if len(clients) >= max_clients:
+    refused += 1
+    return None
+  stream = Stream()
+  clients.append(stream)
+  return stream
+
+# Queue an event on every connected stream
+def publish(name, data):
+  global published
+  if not clients:
+    return
+  data = message(name, data)
+  for stream in clients:
+    stream.push(data)
+  published += 1
+
+def to_dict():
+  return {'clients': len(clients), 'published': published, 'dropped': dropped, 'refused': refused}
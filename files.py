@@ -0,0 +1,211 @@
+#------------------------------------------
+#
+#  DL32 file transfer
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Downloads, uploads and directory listings for files on flash and on the
+# SD card under /sd. Downloads honour single byte ranges, so an interrupted
+# transfer can resume, and ETag revalidation, so an unchanged file is not
+# sent again. The response body reads the file with readinto(), and the
+# web server reads it straight into its connection buffer. Uploads stream
+# the request body through one preallocated buffer into a temporary file,
+# which then replaces the target, so a dropped upload leaves the old file
+# in place. Callers that must check a file before it replaces the old one,
+# such as dl32.cfg, have it left in the temporary file instead. The buffer is only used between awaits, so it can be shared.
+# Listings walk the directory with os.ilistdir() and return one page.
+
+import os
+
+BUFFER_SIZE = 1024
+
+# Files that may be replaced by upload: configuration, key stores and doorbell tunes
+UPLOAD_SUFFIXES = ('.cfg', '.csv')
+UPLOAD_FILES = ('/doorbells.py',)
+
+CONTENT_TYPES = {'cfg': 'application/json', 'json': 'application/json', 'csv': 'text/csv', 'py': 'text/plain', 'txt': 'text/plain', 'log': 'text/plain', 'html': 'text/html', 'css': 'text/css'}
+
+_buf = bytearray(BUFFER_SIZE)
+_mv = memoryview(_buf)
+
+uploaded = 0
+downloads = 0
+ranges = 0
+not_modified = 0
+
+# File body limited to length bytes, read with readinto() by the web server
+class Part:
+  def __init__(self, f, length):
+    self.f = f
+    self.left = length
+
+  def readinto(self, buf):
+    if self.left <= 0:
+      return 0
+    if len(buf) > self.left:
+      buf = buf[:self.left]
+    n = self.f.readinto(buf) or 0
+    self.left -= n
+    if not n:
+      self.left = 0
+    return n
+
+  def read(self, size):
+    data = self.f.read(min(size, self.left))
+    self.left -= len(data)
+    return data
+
+  def close(self):
+    self.f.close()
+
+# Absolute firmware path with . and empty components removed, or None if it climbs out with ..
+def clean(path):
+  parts = []
+  for part in path.split('/'):
+    if part == '..':
+      return None
+    if part and part != '.':
+      parts.append(part)
+  return '/' + '/'.join(parts)
+
+def uploadable(path):
+  if path in UPLOAD_FILES:
+    return True
+  for suffix in UPLOAD_SUFFIXES:
+    if path.endswith(suffix):
+      return True
+  return False
+
+# Entity tag from a file's size and modification time
+def etag(st):
+  return '"' + '{:x}-{:x}'.format(st[6], st[8]) + '"'
+
+# (start, end) of a single byte range header, None to send the whole file, False if unsatisfiable
+def byte_range(header, size):
+  if not header.startswith('bytes=') or ',' in header:
+    return None
+  first, _, last = header[6:].partition('-')
+  try:
+    if first:
+      start = int(first)
+      end = int(last) + 1 if last else size
+    else:
+      start = max(0, size - int(last))
+      end = size
+  except ValueError:
+    return None
+  if start >= size or end <= start:
+    return False
+  return (start, min(end, size))
+
+# Response tuple for a download, None if there is no such file
+def download(request, path):
+  global downloads, ranges, not_modified
+  path = clean(path)
+  if path is None:
+    return None
+  try:
+    st = os.stat(path)
+  except OSError:
+    return None
+  if st[0] & 0x4000:
+    return None
+  tag = etag(st)
+  if request.headers.get('If-None-Match') == tag:
+    not_modified += 1
+    return '', 304, {'ETag': tag}
+  size = st[6]
+  start, end, status = 0, size, 200
+  headers = {'ETag': tag, 'Accept-Ranges': 'bytes', 'Content-Type': CONTENT_TYPES.get(path.rsplit('.', 1)[-1], 'application/octet-stream')}
+  header = request.headers.get('Range')
+  # A Range with If-Range is only honoured while the file is unchanged
+  if header and request.headers.get('If-Range', tag) == tag:
+    span = byte_range(header, size)
+    if span is False:
+      return '', 416, {'Content-Range': 'bytes */' + str(size)}
+    if span:
+      start, end = span
+      status = 206
+      ranges += 1
+      headers['Content-Range'] = 'bytes ' + str(start) + '-' + str(end - 1) + '/' + str(size)
+  f = open(path, 'rb')
+  if start:
+    f.seek(start)
+  headers['Content-Length'] = str(end - start)
+  downloads += 1
+  return Part(f, end - start), status, headers
+
+async def _read_into(stream, buf):
+  if hasattr(stream, 'readinto'):
+    return await stream.readinto(buf)
+  data = await stream.read(len(buf))
+  buf[:len(data)] = data
+  return len(data)
+
+# Write a request body to path, returns the number of bytes written or None if it was cut short.
+# With install false the body is left in path + '.part' for the caller to check and remove.
+async def upload(request, path, install=True):
+  global uploaded
+  length = request.content_length
+  part = path + '.part'
+  try:
+    with open(part, 'wb') as f:
+      if len(request.body) == length:
+        f.write(request.body)
+      else:
+        stream = request.stream
+        left = length
+        while left > 0:
+          n = await _read_into(stream, _mv[:min(left, BUFFER_SIZE)])
+          if not n:
+            raise OSError()
+          f.write(_mv[:n])
+          left -= n
+  except OSError:
+    try:
+      os.remove(part)
+    except OSError:
+      pass
+    return None
+  uploaded += length
+  if not install:
+    return length
+  # FAT on the SD card will not rename over an existing file
+  try:
+    os.remove(path)
+  except OSError:
+    pass
+  os.rename(part, path)
+  return length
+
+# Copy a file through the shared buffer, into target or a directory of that name
+def copy(source, target):
+  try:
+    if os.stat(target)[0] & 0x4000:
+      target = target.rstrip('/') + '/' + source.rsplit('/', 1)[-1]
+  except OSError:
+    pass
+  with open(source, 'rb') as source_file:
+    with open(target, 'wb') as target_file:
+      while True:
+        n = source_file.readinto(_mv)
+        if not n:
+          break
+        target_file.write(_mv[:n])
+
+# One page of a directory listing: up to count entries from index start, and the index of the next page or None
+def listing(path, start=0, count=20):
+  entries = []
+  i = 0
+  for entry in os.ilistdir(path):
+    if i >= start:
+      if len(entries) == count:
+        return entries, i
+      is_dir = entry[1] & 0x4000 != 0
+      entries.append({'name': entry[0], 'dir': is_dir, 'size': entry[3] if len(entry) > 3 and not is_dir else 0})
+    i += 1
+  return entries, None
+
+def to_dict():
+  return {'downloads': downloads, 'ranges': ranges, 'not_modified': not_modified, 'uploaded': uploaded}
@@ -0,0 +1,182 @@
+#------------------------------------------
+#
+#  DL32 garage door controller
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Tracks garage door state and estimated position from the closed-position
+# sensor and the door travel time, so relay pulses are only sent when they
+# change something. Commands arriving while a pulse is in progress are
+# queued, with later commands replacing earlier ones and two toggles
+# cancelling out. Hardware agnostic: main.py feeds sensor readings into
+# poll(), passes commands to command() and acts on the returned flags.
+
+from micropython import const
+import time
+
+# States
+CLOSED = const(0)
+OPENING = const(1)
+OPEN = const(2)
+CLOSING = const(3)
+STOPPED = const(4)
+
+STATE_NAMES = ('closed', 'opening', 'open', 'closing', 'stopped')
+
+# Commands, also the index of the relay each one pulses
+CMD_TOGGLE = const(0)
+CMD_OPEN = const(1)
+CMD_CLOSE = const(2)
+CMD_STOP = const(3)
+
+COMMAND_NAMES = ('toggle', 'open', 'close', 'stop')
+
+# command()/poll() event flags
+EV_PULSE_ON = const(1)
+EV_PULSE_OFF = const(2)
+EV_STATE = const(4)
+EV_IGNORED = const(8)
+EV_QUEUED = const(16)
+EV_FAULT = const(32)
+
+# Milliseconds for the door to travel fully open or closed
+travel_dur = 15000
+# Milliseconds a relay is held for each command
+pulse_dur = 500
+# Minimum milliseconds between the end of one pulse and the next
+gap_dur = 500
+# Extra milliseconds allowed for the closed sensor to trip after the estimated travel time
+margin_dur = 3000
+# Closed-position sensor fitted, otherwise the state is estimated from travel time alone
+sensor_present = True
+
+state = CLOSED
+# Travel direction of the last movement, OPENING or CLOSING
+direction = CLOSING
+# Estimated position in ms of travel from fully closed
+position = 0
+moved_at = 0
+# Command being pulsed (-1 = none), when the pulse ends and when the next may start
+pulse = -1
+pulse_until = 0
+busy_until = 0
+# Queued command (-1 = none)
+pending = -1
+
+# Set the initial state at boot
+def init(closed, now):
+  global state, position, moved_at, busy_until
+  moved_at = now
+  busy_until = now
+  if closed or not sensor_present:
+    state = CLOSED
+    position = 0
+  else:
+    state = OPEN
+    position = travel_dur
+
+def _update_position(now):
+  global position, moved_at
+  elapsed = time.ticks_diff(now, moved_at)
+  moved_at = now
+  if state == OPENING:
+    position = min(travel_dur, position + elapsed)
+  elif state == CLOSING:
+    position = max(-margin_dur if sensor_present else 0, position - elapsed)
+
+def _set_state(new_state):
+  global state, direction, position
+  if new_state == OPENING or new_state == CLOSING:
+    direction = new_state
+  elif new_state == CLOSED:
+    position = 0
+  elif new_state == OPEN:
+    position = travel_dur
+  state = new_state
+
+# State a command would move the door to, -1 if it would change nothing
+def _target(cmd):
+  if cmd == CMD_OPEN:
+    return -1 if state == OPEN or state == OPENING else OPENING
+  if cmd == CMD_CLOSE:
+    return -1 if state == CLOSED or state == CLOSING else CLOSING
+  if cmd == CMD_STOP:
+    return STOPPED if state == OPENING or state == CLOSING else -1
+  if state == CLOSED:
+    return OPENING
+  if state == OPEN:
+    return CLOSING
+  if state == STOPPED:
+    return OPENING if direction == CLOSING else CLOSING
+  return STOPPED
+
+def _start(cmd, now):
+  global pulse, pulse_until, busy_until
+  _update_position(now)
+  target = _target(cmd)
+  if target < 0:
+    return EV_IGNORED
+  pulse = cmd
+  pulse_until = time.ticks_add(now, pulse_dur)
+  busy_until = time.ticks_add(pulse_until, gap_dur)
+  _set_state(target)
+  return EV_PULSE_ON | EV_STATE
+
+# Request a command, returns event flags
+def command(cmd, now):
+  global pending
+  if pulse >= 0 or time.ticks_diff(now, busy_until) < 0:
+    if cmd == CMD_TOGGLE and pending == CMD_TOGGLE:
+      pending = -1
+    else:
+      pending = cmd
+    return EV_QUEUED
+  return _start(cmd, now)
+
+# Advance the controller, closed is the closed-position sensor reading. Returns event flags
+def poll(closed, now):
+  global pulse, pending, position
+  events = 0
+  _update_position(now)
+  if pulse >= 0 and time.ticks_diff(now, pulse_until) >= 0:
+    pulse = -1
+    events |= EV_PULSE_OFF
+  if sensor_present:
+    if closed and (state == CLOSING or state == OPEN or state == STOPPED):
+      _set_state(CLOSED)
+      events |= EV_STATE
+    elif not closed and state == CLOSED:
+      # Opened by a remote or by hand
+      _set_state(OPENING)
+      events |= EV_STATE
+  if state == OPENING and position >= travel_dur:
+    if sensor_present and closed:
+      # Door never left the closed position
+      _set_state(CLOSED)
+      events |= EV_STATE | EV_FAULT
+    else:
+      _set_state(OPEN)
+      events |= EV_STATE
+  elif state == CLOSING and position <= (-margin_dur if sensor_present else 0):
+    if sensor_present:
+      # Closed sensor never tripped, door is obstructed or stopped short
+      position = 0
+      _set_state(STOPPED)
+      events |= EV_STATE | EV_FAULT
+    else:
+      _set_state(CLOSED)
+      events |= EV_STATE
+  if pending >= 0 and pulse < 0 and time.ticks_diff(now, busy_until) >= 0:
+    cmd = pending
+    pending = -1
+    events |= _start(cmd, now)
+  return events
+
+# Estimated position in percent open
+def percent():
+  return max(0, min(100, position * 100 // travel_dur))
+
+# Return state as a dictionary for JSON serialisation
+def to_dict():
+  return {'state': STATE_NAMES[state], 'position': percent()}
@@ -0,0 +1,78 @@
+#------------------------------------------
+#
+#  DL32 asynchronous HTTP GET
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# HTTP/1.0 GET requests over uasyncio streams, for servers the firmware
+# polls while it keeps serving the reader and web pages. urequests would
+# block the event loop until the server answers. Callers bound the time a
+# request may take with uasyncio.wait_for_ms(). get() returns a small body
+# whole; request() returns once the headers have arrived, and the caller
+# reads the body in pieces, bounding each read, for downloads too large to
+# hold in memory.
+
+import uasyncio
+
+# Response of request(): status code, headers with lowercase names, and the body left to read()
+class Response:
+  def __init__(self, reader, writer, status, headers):
+    self._reader = reader
+    self._writer = writer
+    self.status = status
+    self.headers = headers
+
+  # Up to size bytes of body, b'' at its end
+  async def read(self, size):
+    return await self._reader.read(size)
+
+  async def close(self):
+    self._writer.close()
+    await self._writer.wait_closed()
+
+# Send a GET request to url with extra headers, returns its Response once the headers have arrived
+async def request(url, headers=None):
+  scheme, _, host, path = (url + '/').split('/', 3)
+  port = 443 if scheme == 'https:' else 80
+  if ':' in host:
+    host, port = host.split(':', 1)
+    port = int(port)
+  path = '/' + path.rstrip('/')
+  reader, writer = await uasyncio.open_connection(host, port, ssl=True if scheme == 'https:' else None)
+  try:
+    lines = ['GET ' + path + ' HTTP/1.0', 'Host: ' + host]
+    if headers:
+      for name in headers:
+        lines.append(name + ': ' + headers[name])
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    fields = {}
+    while True:
+      line = await reader.readline()
+      if line == b'\r\n' or not line:
+        break
+      name, _, value = line.decode().partition(':')
+      fields[name.strip().lower()] = value.strip()
+  except:
+    writer.close()
+    await writer.wait_closed()
+    raise
+  return Response(reader, writer, status, fields)
+
+# Status code and body of a GET request to url, reading at most limit bytes of body
+async def get(url, limit=512):
+  response = await request(url)
+  try:
+    chunks = []
+    size = 0
+    while size < limit:
+      data = await response.read(min(512, limit - size))
+      if not data:
+        break
+      chunks.append(data)
+      size += len(data)
+    return response.status, b''.join(chunks)
+  finally:
+    await response.close()
@@ -0,0 +1,235 @@
+#------------------------------------------
+#
+#  DL32 streaming key store files
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Reads and writes key files one record at a time, so loading or saving the
+# key list never needs the whole file in memory at once. Two formats, chosen
+# by file extension:
+#   .csv  one "key,name" record per line, after a "key,name" header line
+#   other a flat JSON object {"key": "name", ...} (the original keys.cfg)
+# A JSON name that is a number, true or false is read as the text it is
+# written as, and null as an empty name. An entry whose name is an object
+# or array is skipped and counted in skipped, and the rest still load.
+# Files are written to a temporary file and renamed into place, so an
+# interrupted save leaves the previous file intact.
+
+from micropython import const
+import os
+
+CHUNK_SIZE = const(512)
+CSV_HEADER = 'key,name'
+
+# Entries skipped by the last read() of a JSON key file
+skipped = 0
+
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+# Incremental parser for a flat JSON object of names
+class _JsonReader:
+  def __init__(self, stream):
+    self.stream = stream
+    self.buf = ''
+    self.pos = 0
+    self.skipped = 0
+
+  def _fill(self):
+    self.buf = self.stream.read(CHUNK_SIZE)
+    self.pos = 0
+    return len(self.buf) > 0
+
+  # Next non-whitespace character, '' at end of file
+  def _next(self):
+    while True:
+      if self.pos >= len(self.buf) and not self._fill():
+        return ''
+      c = self.buf[self.pos]
+      self.pos += 1
+      if c not in ' \t\r\n':
+        return c
+
+  def _char(self):
+    if self.pos >= len(self.buf) and not self._fill():
+      raise ValueError('unterminated string')
+    c = self.buf[self.pos]
+    self.pos += 1
+    return c
+
+  # Rest of a string after its opening quote
+  def _string(self):
+    parts = []
+    while True:
+      if self.pos >= len(self.buf) and not self._fill():
+        raise ValueError('unterminated string')
+      end = self.pos
+      while end < len(self.buf) and self.buf[end] != '"' and self.buf[end] != '\\':
+        end += 1
+      parts.append(self.buf[self.pos:end])
+      self.pos = end
+      if end == len(self.buf):
+        continue
+      self.pos += 1
+      if self.buf[end] == '"':
+        return ''.join(parts)
+      c = self._char()
+      if c == 'u':
+        parts.append(chr(int(self._char() + self._char() + self._char() + self._char(), 16)))
+      elif c in _ESCAPES:
+        parts.append(_ESCAPES[c])
+      else:
+        raise ValueError('invalid escape')
+
+  # Rest of an object or array after its opening bracket
+  def _skip(self):
+    depth = 1
+    while depth:
+      c = self._char()
+      if c == '"':
+        self._string()
+      elif c == '{' or c == '[':
+        depth += 1
+      elif c == '}' or c == ']':
+        depth -= 1
+
+  # Rest of a value starting with c as a name, None for an object or array
+  def _value(self, c):
+    if c == '"':
+      return self._string()
+    if c == '{' or c == '[':
+      self._skip()
+      return None
+    parts = [c]
+    while True:
+      if self.pos >= len(self.buf) and not self._fill():
+        break
+      c = self.buf[self.pos]
+      if c in ',} \t\r\n':
+        break
+      parts.append(c)
+      self.pos += 1
+    text = ''.join(parts)
+    if text == 'null':
+      return ''
+    if text == 'true' or text == 'false':
+      return text
+    for c in text:
+      if c not in '0123456789+-.eE':
+        raise ValueError('invalid value')
+    return text
+
+  def records(self):
+    if self._next() != '{':
+      raise ValueError('expected object')
+    c = self._next()
+    if c == '}':
+      return
+    while True:
+      if c != '"':
+        raise ValueError('expected key')
+      key = self._string()
+      if self._next() != ':':
+        raise ValueError('expected colon')
+      name = self._value(self._next())
+      if name is None:
+        self.skipped += 1
+      else:
+        yield key, name
+      c = self._next()
+      if c == '}':
+        return
+      if c != ',':
+        raise ValueError('expected comma')
+      c = self._next()
+
+def _csv_records(stream):
+  for line in stream:
+    line = line.rstrip('\r\n')
+    if line == '' or line == CSV_HEADER or line[0] == '#':
+      continue
+    comma = line.find(',')
+    if comma < 0:
+      yield line.strip(), ''
+    else:
+      yield line[:comma].strip(), line[comma + 1:]
+
+def is_csv(path):
+  return path.endswith('.csv')
+
+# Finish a save that was interrupted between removing the old file and renaming the new one
+def _recover(path):
+  try:
+    os.stat(path)
+  except OSError:
+    try:
+      os.rename(path + '.tmp', path)
+    except OSError:
+      pass
+
+# First of the given key files that exists, or None
+def find(*paths):
+  for path in paths:
+    _recover(path)
+    try:
+      os.stat(path)
+      return path
+    except OSError:
+      pass
+  return None
+
+# Yield (key, name) records from a key file
+def read(path):
+  global skipped
+  skipped = 0
+  _recover(path)
+  with open(path) as stream:
+    if is_csv(path):
+      yield from _csv_records(stream)
+    else:
+      reader = _JsonReader(stream)
+      yield from reader.records()
+      skipped = reader.skipped
+
+# Load a key file into a dictionary, returns the number of records read
+def load(path, keys):
+  count = 0
+  for key, name in read(path):
+    keys[key] = name
+    count += 1
+  return count
+
+def _json_string(text):
+  out = ['"']
+  for c in text:
+    if c == '"' or c == '\\':
+      out.append('\\' + c)
+    elif c < ' ':
+      out.append('\\u{:04x}'.format(ord(c)))
+    else:
+      out.append(c)
+  out.append('"')
+  return ''.join(out)
+
+# Write a dictionary to a key file one record at a time
+def save(path, keys):
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'w') as stream:
+    if is_csv(path):
+      stream.write(CSV_HEADER + '\n')
+      for key in keys:
+        stream.write(key + ',' + keys[key].replace('\n', ' ') + '\n')
+    else:
+      stream.write('{')
+      first = True
+      for key in keys:
+        if not first:
+          stream.write(', ')
+        first = False
+        stream.write(_json_string(key) + ': ' + _json_string(keys[key]))
+      stream.write('}')
+  try:
+    os.remove(path)
+  except OSError:
+    pass
+  os.rename(tmp_path, path)
@@ -0,0 +1,101 @@
+#------------------------------------------
+#
+#  DL32 key list sync
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Versioned key list updates from a central server. The server numbers every
+# change to its key list and sends deltas holding the net changes between
+# two revisions:
+#   {"from": 41, "rev": 42, "set": {"12345": "alice"}, "del": ["23456"]}
+# A delta applies to any local revision from "from" up to (not including)
+# "rev". A snapshot replaces the whole list whatever the local revision:
+#   {"rev": 42, "full": true, "set": {"12345": "alice", ...}}
+# The device asks for what it is missing by sending its current revision,
+# see request().
+
+from micropython import const
+import json, time
+
+REV_FILE = 'keys.rev'
+
+# apply() results
+APPLIED = const(0)
+CURRENT = const(1)
+GAP = const(2)
+INVALID = const(3)
+
+# Revision of the local key list, 0 if never synced
+rev = 0
+
+# Milliseconds to wait for an answer before asking again for the same revision
+retry_dur = 10000
+requested_rev = -1
+requested_at = 0
+
+# Load local revision from flash
+def load():
+  global rev
+  try:
+    with open(REV_FILE) as rev_file:
+      rev = int(rev_file.read())
+  except:
+    rev = 0
+
+# Save local revision to flash
+def save():
+  with open(REV_FILE, 'w') as rev_file:
+    rev_file.write(str(rev))
+
+# True if changes maps key numbers to names and removed lists key numbers
+def _valid(changes, removed):
+  if not isinstance(changes, dict) or not isinstance(removed, (list, tuple)):
+    return False
+  for key in changes:
+    if not isinstance(changes[key], str):
+      return False
+  for key in removed:
+    if not isinstance(key, str):
+      return False
+  return True
+
+# Apply a delta or snapshot to the keys dictionary in place, returns one of the results above.
+# The delta is checked in full first, so an invalid one leaves keys unchanged.
+def apply(keys, delta):
+  global rev
+  try:
+    new_rev = int(delta['rev'])
+    full = delta.get('full')
+    from_rev = 0 if full else int(delta['from'])
+    changes = delta.get('set', {})
+    removed = delta.get('del', ())
+  except:
+    return INVALID
+  if not _valid(changes, removed):
+    return INVALID
+  if full:
+    if new_rev == rev:
+      return CURRENT
+    keys.clear()
+  else:
+    if new_rev <= rev:
+      return CURRENT
+    if from_rev > rev:
+      return GAP
+    for key in removed:
+      if key in keys:
+        del keys[key]
+  keys.update(changes)
+  rev = new_rev
+  return APPLIED
+
+# Request payload asking the server for everything after the local revision,
+# None if the same request is already waiting for an answer
+def request(client_id, now):
+  global requested_rev, requested_at
+  if requested_rev == rev and time.ticks_diff(now, requested_at) < retry_dur:
+    return None
+  requested_rev = rev
+  requested_at = now
+  return json.dumps({'client': client_id, 'rev': rev})
@@ -0,0 +1,124 @@
+#------------------------------------------
+#
+#  DL32 status light manager
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Owns the status NeoPixel. Callers post a colour on one of the priority
+# layers below with post() and take it down with clear(); both only update
+# preallocated per-layer slots, so they are safe to call from the Wiegand
+# callback. task() shows the highest priority active layer, at most once
+# per frame_ms, and only writes to the pixel when the colour changes.
+# A layer can hold its colour until cleared or for a duration, solid or
+# animated (BLINK on/off, FADE in and out over period ms). Before work
+# that blocks the event loop, show() puts the new colour up right away.
+
+from micropython import const
+from array import array
+import time, uasyncio
+
+# Layers, highest priority first
+BOOT = const(0)
+ALARM = const(1)
+UNLOCKED = const(2)
+DENIED = const(3)
+ADD = const(4)
+DOORBELL = const(5)
+STANDBY = const(6)
+LAYERS = const(7)
+
+LAYER_NAMES = ('boot', 'alarm', 'unlocked', 'denied', 'add', 'doorbell', 'standby')
+
+# Animations
+SOLID = const(0)
+BLINK = const(1)
+FADE = const(2)
+
+OFF = (0, 0, 0)
+
+# Minimum milliseconds between frames
+frame_ms = 20
+
+_colour = [OFF] * LAYERS
+_mode = array('B', [SOLID] * LAYERS)
+_active = array('B', [0] * LAYERS)
+_period = array('H', [0] * LAYERS)
+_since = array('l', [0] * LAYERS)
+# Expiry in ticks_ms for layers set with a duration
+_until = array('l', [0] * LAYERS)
+_timed = array('B', [0] * LAYERS)
+
+_np = None
+_shown = None
+writes = 0
+skipped = 0
+
+# Attach the NeoPixel to drive
+def init(np):
+  global _np
+  _np = np
+
+# Show colour on a layer, for dur ms or until cleared (dur 0), animated over period ms
+def post(layer, colour, dur=0, mode=SOLID, period=1000):
+  now = time.ticks_ms()
+  _colour[layer] = colour
+  _mode[layer] = mode
+  _period[layer] = period
+  _since[layer] = now
+  _timed[layer] = 1 if dur > 0 else 0
+  _until[layer] = time.ticks_add(now, dur)
+  _active[layer] = 1
+
+def clear(layer):
+  _active[layer] = 0
+
+# Layer currently shown, or None
+def top():
+  for layer in range(LAYERS):
+    if _active[layer]:
+      return layer
+  return None
+
+# Colour to show at time now, expiring timed layers
+def frame(now):
+  for layer in range(LAYERS):
+    if not _active[layer]:
+      continue
+    if _timed[layer] and time.ticks_diff(now, _until[layer]) >= 0:
+      _active[layer] = 0
+      continue
+    colour = _colour[layer]
+    mode = _mode[layer]
+    if mode == SOLID:
+      return colour
+    phase = time.ticks_diff(now, _since[layer]) % _period[layer]
+    half = _period[layer] // 2
+    if mode == BLINK:
+      return colour if phase < half else OFF
+    # FADE: brightness rises to full at half the period and falls back
+    level = phase if phase < half else _period[layer] - phase
+    return (colour[0] * level // half, colour[1] * level // half, colour[2] * level // half)
+  return OFF
+
+# Write the current frame to the pixel if it changed
+def show(now):
+  global _shown, writes, skipped
+  colour = frame(now)
+  if colour == _shown:
+    skipped += 1
+    return
+  _np[0] = colour
+  _np.write()
+  _shown = colour
+  writes += 1
+
+# Frame loop, run as a task once the event loop starts
+async def task():
+  while True:
+    show(time.ticks_ms())
+    await uasyncio.sleep_ms(frame_ms)
+
+def to_dict():
+  layer = top()
+  return {'layer': None if layer is None else LAYER_NAMES[layer], 'writes': writes, 'skipped': skipped}
@@ -0,0 +1,100 @@
+#------------------------------------------
+#
+#  DL32 event loop instrumentation
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Measures main loop overrun (time beyond the intended loop interval spent
+# in handlers or waiting on the scheduler), per-handler run time and the
+# number of live tasks started through spawn().
+
+import time, uasyncio
+from array import array
+
+# Upper bounds (ms) of loop overrun histogram buckets, the last bucket catches the rest
+LAG_BOUNDS = (5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+lag_hist = array('L', [0] * (len(LAG_BOUNDS) + 1))
+lag_max = 0
+lag_total = 0
+iterations = 0
+_last_tick = None
+
+# Per-handler timing: name -> [calls, total us, max us]
+HANDLERS = {}
+
+tasks_live = 0
+tasks_started = 0
+
+# Call at the start of each loop iteration with the intended loop interval
+def tick(interval_ms):
+  global _last_tick, lag_max, lag_total, iterations
+  now = time.ticks_ms()
+  if _last_tick is not None:
+    lag = time.ticks_diff(now, _last_tick) - interval_ms
+    if lag < 0:
+      lag = 0
+    i = 0
+    while i < len(LAG_BOUNDS) and lag > LAG_BOUNDS[i]:
+      i += 1
+    lag_hist[i] += 1
+    lag_total += lag
+    if lag > lag_max:
+      lag_max = lag
+    iterations += 1
+  _last_tick = now
+
+# Run a handler and record how long it took
+def timed(name, handler):
+  start = time.ticks_us()
+  handler()
+  elapsed = time.ticks_diff(time.ticks_us(), start)
+  stat = HANDLERS.get(name)
+  if stat is None:
+    stat = HANDLERS[name] = [0, 0, 0]
+  stat[0] += 1
+  stat[1] += elapsed
+  if elapsed > stat[2]:
+    stat[2] = elapsed
+
+async def _run(coro):
+  global tasks_live
+  try:
+    await coro
+  finally:
+    tasks_live -= 1
+
+# Create a uasyncio task and count it while it is alive
+def spawn(coro):
+  global tasks_live, tasks_started
+  tasks_live += 1
+  tasks_started += 1
+  return uasyncio.create_task(_run(coro))
+
+# Reset loop and handler stats
+def reset():
+  global lag_max, lag_total, iterations
+  for i in range(len(lag_hist)):
+    lag_hist[i] = 0
+  lag_max = 0
+  lag_total = 0
+  iterations = 0
+  HANDLERS.clear()
+
+# Return stats as a dictionary for JSON serialisation
+def to_dict():
+  handlers = {}
+  for name in HANDLERS:
+    stat = HANDLERS[name]
+    handlers[name] = {'calls': stat[0], 'avg_us': stat[1] // stat[0], 'max_us': stat[2]}
+  return {
+    'iterations': iterations,
+    'lag_max_ms': lag_max,
+    'lag_avg_ms': lag_total // iterations if iterations else 0,
+    'lag_bounds_ms': LAG_BOUNDS,
+    'lag_hist': list(lag_hist),
+    'handlers': handlers,
+    'tasks_live': tasks_live,
+    'tasks_started': tasks_started
+  }
@@ -5,32 +5,41 @@
 #
 #------------------------------------------
 
-from microdot_asyncio import Microdot, send_file
 from umqtt.simple import MQTTClient
 from wiegand import Wiegand
 from buzzer_music import music
 from doorbells import Doorbells
-import ugit
-import sdcard, machine, neopixel, time, uasyncio, os
+import ota, tpl, memstat, loopmon, counters, rules, door, garage, keysync, keystore, led, bus, webserver, files, events, config, readers, remoteauth, supervisor, clock, httpget, namespace, consumers, routes
+import sdcard, machine, neopixel, network, time, uasyncio, os, gc, json
 
 gc.collect()
 
-# Watchdog timeout set @ 10min
-wdt = machine.WDT(timeout = 600000)
+# Watchdog timeout set @ 10min for the boot, or to the OTA grace period while a new update is on trial.
+# Once the event loop runs, the supervisor shortens it to wdt_timeout and feeds it while every critical task is healthy.
+wdt = machine.WDT(timeout = ota.grace_dur if ota.in_trial() else 600000)
 
 _VERSION = const('20240125')
 
-year, month, day, hour, mins, secs, weekday, yearday = time.localtime()
+boot_time = time.time()
+# Milliseconds from reset until the web server starts, including loading or compiling the firmware
+boot_ms = 0
 
 # State default values
 bell_ringing = False
 add_mode = False
 sd_present = False
 mqtt_online = False
+# Incremented on each MQTT connection, so tasks of an older connection stop
+mqtt_session = 0
+key_sync_running = False
+key_fetch_running = False
+ota_running = False
+ota_task = None
+web_restart = False
 
 print('DL32 - MicroPython Edition')
 print('Version: ' + _VERSION)
-print('Current Date/Time: ' + '{}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}'.format(year, month, day, hour, mins, secs))
+print('Current Date/Time: ' + clock.iso())
 
 # 1.1 SD card Pins
 # CD DAT3 CS 5
@@ -84,6 +93,9 @@ bellButton_pin = machine.Pin(17, machine.Pin.IN, machine.Pin.PULL_UP)
 magSensor = machine.Pin(15, machine.Pin.IN, machine.Pin.PULL_UP)
 wiegand_0 = 16
 wiegand_1 = 18
+# Further Wiegand readers as (D0 pin, D1 pin, relay Pin or None to open the main door, LED Pin or None),
+# e.g. ((39, 40, None, None),) for an exit reader on the main door
+extra_readers = ()
 DS01 = machine.Pin(33, machine.Pin.IN, machine.Pin.PULL_UP)
 DS02 = machine.Pin(37, machine.Pin.IN, machine.Pin.PULL_UP)
 DS03 = machine.Pin(5, machine.Pin.IN, machine.Pin.PULL_UP)
@@ -102,6 +114,10 @@ GH04.value(1)
 GH05.value(1)
 GH06.value(1)
 
+# Garage door relays, indexed by garage.CMD_*
+GAR_RELAYS = (GH01, GH02, GH03, GH04)
+GAR_MESSAGES = ('GD_Toggled', 'GD_Open', 'GD_Close', 'GD_Stop')
+
 try:
   sd = sdcard.SDCard(machine.SPI(1, sck=machine.Pin(38), mosi=machine.Pin(36), miso=machine.Pin(35)), machine.Pin(34))
   os.mount(sd, '/sd')
@@ -124,6 +140,8 @@ http_dur = 10000
 key_dur = 5000
 mqtt_dur = 10000
 gar_dur = 500
+gar_travel_dur = 15000 # Time for the garage door to fully open or close (ms)
+loop_dur = 50
 addKey_dur = 15000
 add_hold_time = 2000
 sd_boot_hold_time = 3000
@@ -134,11 +152,68 @@ ota_mode = False
 add_mode_intervals = 10
 opening_type = 'door'
 rgb_brightness = 10 #(1-255)
+page_cache_min_free = 32768 # Evict cached WebUI pages below this much free heap (bytes)
+mem_collect_threshold = 65536 # Run gc.collect() when free heap drops below this (bytes, 0 = disabled)
+metrics_interval = 300 # Seconds between metrics publications to MQTT
+key_sync_interval = 3600 # Seconds between key list sync checks against key_sync_url (0 = disabled)
+key_sync_timeout = 10000 # Time to wait for key list changes from key_sync_url (ms)
+key_sync_max_size = 262144 # Largest key list change fetched from key_sync_url (bytes)
+door_held_dur = 60000 # Door open longer than this raises a held-open alarm (ms, 0 = disabled)
+anti_passback_dur = 0 # Refuse a key for this long after it was used to open the door (ms, 0 = disabled)
+led_denied_dur = 3000 # Time the status light shows a denied key (ms)
+web_max_conns = 4 # Web server connections served at once
+web_max_waiting = 4 # Further connections queued for a free slot, more are refused with 503
+web_read_timeout = 5000 # Time a client has to send a request (ms)
+web_keepalive_timeout = 5000 # Time an idle connection is kept open for another request (ms)
+web_max_upload = 262144 # Largest file accepted by upload (bytes)
+wifi_connect_timeout = 15000 # Time to wait for WiFi after its settings change (ms)
+events_max_clients = 2 # WebUI pages receiving live events at once
+auth_timeout = 1500 # Time to wait for the remote authorization service at auth_url (ms)
+auth_grant_ttl = 600000 # Time a key granted by the remote authorization service is remembered (ms)
+auth_deny_ttl = 60000 # Time a key denied by the remote authorization service is remembered (ms)
+auth_cache_size = 64 # Remote authorization answers remembered
+wdt_timeout = 60000 # Hardware watchdog timeout once the supervisor runs (ms)
+main_loop_deadline = 5000 # Main loop is restarted if it has not run for this long (ms)
+mqtt_deadline = 180000 # MQTT connection is restarted if no ping has succeeded for this long (ms)
+web_handler_deadline = 15000 # Web requests whose handler has run this long are dropped (ms)
+wifi_deadline = 60000 # WiFi is reconnected after being down for this long (ms)
+ota_deadline = 60000 # OTA update is abandoned if no data has arrived for this long (ms)
+ota_timeout = 15000 # Time to wait for the OTA update source to answer or send more data (ms)
+ntp_timeout = 1000 # Time to wait for the NTP server at ntp_server (ms)
+ntp_interval = 3600000 # Time between NTP syncs (ms)
+ntp_retry = 60000 # Time between NTP syncs until one succeeds (ms)
+utc_offset = 0 # Local time zone for file names and access rules (seconds ahead of UTC)
 
 # Global parameters
 add_mode_counter = 0
 mag_state = 0
 ip_address = '0.0.0.0'
+memstat.collect_threshold = mem_collect_threshold
+door.held_dur = door_held_dur
+door.passback_dur = anti_passback_dur
+webserver.max_conns = web_max_conns
+webserver.max_waiting = web_max_waiting
+webserver.read_timeout = web_read_timeout
+webserver.keepalive_timeout = web_keepalive_timeout
+webserver.max_upload = web_max_upload
+events.max_clients = events_max_clients
+remoteauth.timeout = auth_timeout
+remoteauth.grant_ttl = auth_grant_ttl
+remoteauth.deny_ttl = auth_deny_ttl
+remoteauth.size = auth_cache_size
+ota.timeout = ota_timeout
+clock.timeout = ntp_timeout
+clock.interval = ntp_interval
+clock.retry = ntp_retry
+clock.utc_offset = utc_offset
+# This firmware's functions, tunables and state, for the bus consumer tasks and web routes
+dl32 = namespace.Namespace(globals())
+consumers.dl32 = dl32
+routes.dl32 = dl32
+door.confirm_entry = magnetic_sensor_present
+if magnetic_sensor_present:
+  mag_state = int(magSensor.value())
+door.init(mag_state == 1, time.ticks_ms())
 
 # Set initial pin states
 buzzer_pin.value(0)
@@ -155,105 +230,168 @@ np_doorbell = (rgb_brightness, rgb_brightness, rgb_brightness)
 
 # Set staring colour (Standby)
 np = neopixel.NeoPixel(neopix_pin, 1)	
-np[0] = np_boot	
-np.write()
+led.init(np)
+led.post(led.BOOT, np_boot)
+led.show(time.ticks_ms())
 
 # Define dictionaries to store configuration and authorized keys
-CONFIG_DICT = {}
+CONFIG_DICT = config.values
 KEYS_DICT = {}
 
-# Function for copying files (Not currently in-use)
-def copy(source, target):
-  try: 
-    if os.stat(target)[0] & 0x4000:  # is a directory
-      target = target.rstrip("/") + "/" + source
-  except OSError:
-    pass
-  with open(source, "rb") as source:
-    with open(target, "wb") as target:
-      while True:
-        l = source.read(512)
-        if not l: break
-        target.write(l)
-
-# Wipe config dictionary from memory
-def wipe_config():
-  global CONFIG_DICT
-  CONFIG_DICT = {}
+# Rendered WebUI pages, keyed by page name. Pages are rendered on first request
+# and dropped from the cache whenever state they depend on changes.
+PAGE_CACHE = {}
+
+# WebUI page dependency flags
+DEP_KEYS = const(1)
+DEP_CONFIG = const(2)
+DEP_NETWORK = const(4)
+DEP_MODE = const(8)
 
 # Wipe key dictionary from memory
 def wipe_keys():
   global KEYS_DICT
   KEYS_DICT = {}
 
-# Load config file from ESP32
+# Doorbell tones are checked against the installed tunes
+def valid_tone(tone):
+  return tone in Doorbells
+
+config.checks['doorbell'] = valid_tone
+
+# Load config file from ESP32, using defaults for missing or invalid values
 def load_esp_config():
-  global CONFIG_DICT
+  raw = {}
   try:
     with open('dl32.cfg') as json_file:
-      CONFIG_DICT = json.load(json_file)
+      raw = json.load(json_file)
   except:
     print('ERROR: Could not load dl32.cfg into config dictionary')
+  for name in config.load(raw):
+    print('ERROR: Invalid ' + name + ' in dl32.cfg, using default')
     
 load_esp_config()
 
-# Load keys file from ESP32
+# Key store file on ESP32, keys.csv if present and otherwise keys.cfg (JSON)
+keys_file = 'keys.cfg'
+
+# Load keys file from ESP32, one record at a time
 def load_esp_keys():
   global KEYS_DICT
+  global keys_file
+  keys_file = keystore.find('keys.csv', 'keys.cfg') or 'keys.cfg'
   try:
-    with open('keys.cfg') as json_file:
-      KEYS_DICT = json.load(json_file)
+    mem_start = memstat.begin()
+    keys = {}
+    keystore.load(keys_file, keys)
+    if keystore.skipped:
+      print('WARNING: Skipped ' + str(keystore.skipped) + ' entries of ' + keys_file + ' without a valid name')
+    KEYS_DICT = keys
+    memstat.end('load_keys', mem_start)
   except:
-    print('ERROR: Could not load keys.cfg into keys dictionary')
+    print('ERROR: Could not load ' + keys_file + ' into keys dictionary')
     
 load_esp_keys()
 
-# Load config file from SD card
+# Load access rules file from ESP32
+def load_esp_rules():
+  try:
+    with open('rules.cfg') as json_file:
+      rules.compile(json.load(json_file))
+  except:
+    print('ERROR: Could not load rules.cfg into access rules')
+
+load_esp_rules()
+keysync.load()
+
+# Load config file from SD card and apply it live, returns True if it was valid
 def load_sd_config():
-  global CONFIG_DICT
   global sd_present
   if (sd_present == False):
     print ('SD Card not present')
-    return
+    return False
   try:
     with open('sd/dl32.cfg') as json_file:
-      wipe_config()
-      CONFIG_DICT = json.load(json_file)
-      resync_html_content()
+      raw = json.load(json_file)
   except:
     print('ERROR: Could not load sd/dl32.cfg into config dictionary')
+    return False
+  errors = config.update(raw)
+  if errors:
+    print('ERROR: Invalid ' + ', '.join(errors) + ' in sd/dl32.cfg')
+    return False
+  return True
 
-# Load keys file from SD card
+# Load keys file from SD card (sd/keys.csv or sd/keys.cfg), one record at a time
 def load_sd_keys():
   global KEYS_DICT
   global sd_present
   if (sd_present == False):
     print ('SD Card not present')
     return
+  path = keystore.find('sd/keys.csv', 'sd/keys.cfg')
   try:
-    with open('sd/keys.cfg') as json_file:
-      wipe_keys()
-      KEYS_DICT = json.load(json_file)
-      resync_html_content()
+    mem_start = memstat.begin()
+    keys = {}
+    keystore.load(path, keys)
+    if keystore.skipped:
+      print('WARNING: Skipped ' + str(keystore.skipped) + ' entries of ' + str(path) + ' without a valid name')
+    wipe_keys()
+    KEYS_DICT = keys
+    memstat.end('load_keys', mem_start)
+    invalidate_pages(DEP_KEYS)
   except:
-    print('ERROR: Could not load sd/keys.cfg into keys dictionary')
-
-# Load SD config values into Configuration Dictionary
-wifi_ssid = (CONFIG_DICT['wifi_ssid'])
-wifi_pass = (CONFIG_DICT['wifi_pass'])
-mqtt_clid = (CONFIG_DICT['mqtt_clid'])
-mqtt_brok = (CONFIG_DICT['mqtt_brok'])
-mqtt_port = (CONFIG_DICT['mqtt_port'])
-mqtt_user = (CONFIG_DICT['mqtt_user']).encode('utf_8')
-mqtt_pass = (CONFIG_DICT['mqtt_pass']).encode('utf_8')
-mqtt_cmd_top = (CONFIG_DICT['mqtt_cmd_top']).encode('utf_8')
-mqtt_sta_top = (CONFIG_DICT['mqtt_sta_top']).encode('utf_8')
-web_port = (CONFIG_DICT['web_port'])
+    print('ERROR: Could not load ' + str(path) + ' into keys dictionary')
+
+# Take WiFi settings from the configuration
+def read_wifi_config():
+  global wifi_ssid, wifi_pass
+  wifi_ssid = CONFIG_DICT['wifi_ssid']
+  wifi_pass = CONFIG_DICT['wifi_pass']
+
+# Take MQTT settings and topics from the configuration
+def read_mqtt_config():
+  global mqtt_clid, mqtt_brok, mqtt_port, mqtt_user, mqtt_pass, mqtt_cmd_top, mqtt_sta_top, mqtt_met_top, mqtt_gar_top, mqtt_keys_top, mqtt_keys_dev_top
+  mqtt_clid = CONFIG_DICT['mqtt_clid']
+  mqtt_brok = CONFIG_DICT['mqtt_brok']
+  mqtt_port = CONFIG_DICT['mqtt_port']
+  mqtt_user = CONFIG_DICT['mqtt_user'].encode('utf_8')
+  mqtt_pass = CONFIG_DICT['mqtt_pass'].encode('utf_8')
+  mqtt_cmd_top = CONFIG_DICT['mqtt_cmd_top'].encode('utf_8')
+  mqtt_sta_top = CONFIG_DICT['mqtt_sta_top'].encode('utf_8')
+  mqtt_met_top = mqtt_sta_top + b'/metrics'
+  mqtt_gar_top = mqtt_sta_top + b'/garage'
+  mqtt_keys_top = CONFIG_DICT['mqtt_keys_top'].encode('utf_8')
+  mqtt_keys_dev_top = mqtt_keys_top + b'/dev/' + mqtt_clid.encode('utf_8')
+
+# Take key sync, remote authorization, NTP and OTA sources from the configuration
+def read_sync_config():
+  global key_sync_url, ota_url
+  key_sync_url = CONFIG_DICT['key_sync_url']
+  ota_url = CONFIG_DICT['ota_url']
+  if remoteauth.url != CONFIG_DICT['auth_url']:
+    # Answers from another service no longer hold
+    remoteauth.clear()
+    remoteauth.url = CONFIG_DICT['auth_url']
+  if clock.server != CONFIG_DICT['ntp_server']:
+    clock.server = CONFIG_DICT['ntp_server']
+    resolve_ntp()
+
+# Look up the NTP server, as sync does not, and sync with it if found
+def resolve_ntp():
+  if clock.resolve():
+    clock.resync()
+
+read_wifi_config()
+read_mqtt_config()
+read_sync_config()
+web_port = CONFIG_DICT['web_port']
 current = Doorbells[CONFIG_DICT['doorbell']]
-key_NUMS = KEYS_DICT.keys()
 
 #Initialize doorbell object
+mem_start = memstat.begin()
 doorbell = music(current['music'], pins=[buzzer_pin])
+memstat.end('music', mem_start)
 doorbell.stop()
 
 # Check if a file exists
@@ -276,12 +414,8 @@ def connect_wifi():
   ip_address = sta_if.ifconfig()[0]
   print('IP address: ' + ip_address)
   print('Connected to wifi SSID ' + wifi_ssid)
-  resync_html_content()
-
-# Refresh the date and time
-def refresh_time():
-  global year, month, day, hour, mins, secs, weekday, yearday
-  year, month, day, hour, mins, secs, weekday, yearday = time.localtime()
+  invalidate_pages(DEP_NETWORK)
+  resolve_ntp()
 
 # Save key dictionary to SD card
 def save_keys_to_sd():
@@ -289,12 +423,11 @@ def save_keys_to_sd():
   if (sd_present == False):
     print ('SD Card not present')
     return
-  if file_exists('sd/keys.cfg'):
+  ext = keys_file[keys_file.index('.'):]
+  if file_exists('sd/' + keys_file):
     #rename old file
-    refresh_time()
-    os.rename('sd/keys.cfg', ('sd/keys_' + str('{}{:02d}{:02d}_{:02d}{:02d}{:02d}'.format(year, month, day, hour, mins, secs) + '.cfg')))
-  with open('sd/keys.cfg', 'w') as json_file:
-    json.dump(KEYS_DICT, json_file)
+    os.rename('sd/' + keys_file, 'sd/keys_' + clock.text() + ext)
+  keystore.save('sd/' + keys_file, KEYS_DICT)
 
 # Save configuration dictionary to SD card
 def save_config_to_sd():
@@ -304,17 +437,21 @@ def save_config_to_sd():
     return
   if file_exists('sd/dl32.cfg'):
     #rename old file
-    refresh_time()
-    print('renaming sd/dl32.cfg to sd/dl32' + str('{}{:02d}{:02d}_{:02d}{:02d}{:02d}'.format(year, month, day, hour, mins, secs) + '.cfg'))
-    os.rename('sd/dl32.cfg', ('sd/dl32_' + str('{}{:02d}{:02d}_{:02d}{:02d}{:02d}'.format(year, month, day, hour, mins, secs) + '.cfg')))
+    stamp = clock.text()
+    print('renaming sd/dl32.cfg to sd/dl32_' + stamp + '.cfg')
+    os.rename('sd/dl32.cfg', 'sd/dl32_' + stamp + '.cfg')
   with open('sd/dl32.cfg', 'w') as json_file:
     print('Saving updated config to sd/dl32.cfg')
     json.dump(CONFIG_DICT, json_file)
 
 # Save key dictionary to ESP32
 def save_keys_to_esp():
-  with open('keys.cfg', 'w') as json_file:
-    json.dump(KEYS_DICT, json_file)
+  keystore.save(keys_file, KEYS_DICT)
+
+# Save access rules to ESP32
+def save_rules_to_esp():
+  with open('rules.cfg', 'w') as json_file:
+    json.dump(rules.RULES, json_file)
 
 # Save configuration dictionary to ESP32
 def save_config_to_esp():
@@ -328,32 +465,239 @@ def publish_status(message):
     try:
       mqtt.publish(mqtt_sta_top, message, retain=False, qos=0)
     except:
+      counters.inc(counters.MQTT_PUBLISH_FAIL)
       print('error publishing to MQTT topic')
 
+# Re-establish a dropped MQTT connection and resubscribe to command topic
+def mqtt_reconnect():
+  counters.inc(counters.MQTT_RECONNECT)
+  try:
+    mqtt.connect()
+    mqtt.subscribe(mqtt_cmd_top)
+    mqtt.subscribe(mqtt_keys_top)
+    mqtt.subscribe(mqtt_keys_dev_top)
+    print('Reconnected to MQTT broker ' + mqtt_brok)
+  except:
+    print('ERROR: Could not reconnect to MQTT broker')
+
+# Apply a key list delta or snapshot received from the sync server
+def apply_key_delta(delta):
+  mem_start = memstat.begin()
+  result = keysync.apply(KEYS_DICT, delta)
+  memstat.end('key_sync', mem_start)
+  if result == keysync.APPLIED:
+    save_keys_to_esp()
+    keysync.save()
+    if delta.get('full'):
+      # A snapshot removes every key it does not list, and their rules with them
+      if rules.keep_keys(KEYS_DICT):
+        save_rules_to_esp()
+    else:
+      for key in delta.get('del', ()):
+        if key in rules.RULES['keys']:
+          rules.remove_key(key)
+          save_rules_to_esp()
+    invalidate_pages(DEP_KEYS)
+    print('Key list synced to revision ' + str(keysync.rev))
+    publish_status('Key list synced to revision ' + str(keysync.rev))
+  elif result == keysync.GAP:
+    print('Key list revision ' + str(keysync.rev) + ' is behind, requesting sync')
+    request_key_sync()
+  elif result == keysync.INVALID:
+    print('ERROR: Invalid key list delta')
+
+# Ask the sync server for key list changes since the local revision, over HTTP if configured or else MQTT
+def request_key_sync():
+  global mqtt_online
+  if key_sync_url != '':
+    if not key_fetch_running:
+      loopmon.spawn(fetch_key_delta())
+  elif mqtt_online:
+    payload = keysync.request(mqtt_clid, time.ticks_ms())
+    if payload is None:
+      return
+    try:
+      mqtt.publish(mqtt_keys_top + b'/req', payload, retain=False, qos=0)
+    except:
+      counters.inc(counters.MQTT_PUBLISH_FAIL)
+      print('error publishing key sync request')
+
+# Fetch key list changes since the local revision from key_sync_url, waiting at most key_sync_timeout
+async def fetch_key_delta():
+  global key_fetch_running
+  key_fetch_running = True
+  try:
+    status, body = await uasyncio.wait_for_ms(httpget.get(key_sync_url + '?since=' + str(keysync.rev), key_sync_max_size), key_sync_timeout)
+  except Exception:
+    print('ERROR: Could not fetch key list changes from ' + key_sync_url)
+    return
+  finally:
+    key_fetch_running = False
+  if status != 200:
+    print('ERROR: Key sync server returned ' + str(status))
+    return
+  if len(body) >= key_sync_max_size:
+    print('ERROR: Key list changes from ' + key_sync_url + ' exceed ' + str(key_sync_max_size) + ' bytes')
+    return
+  try:
+    delta = json.loads(body)
+  except:
+    print('ERROR: Invalid key list delta')
+    return
+  apply_key_delta(delta)
+
+# Collect device metrics into a dictionary
+def get_metrics():
+  return {'version': _VERSION, 'boot_ms': boot_ms, 'mem': memstat.to_dict(), 'loop': loopmon.to_dict(), 'door': door.to_dict(), 'led': led.to_dict(), 'bus': bus.to_dict(), 'web': webserver.to_dict(), 'files': files.to_dict(), 'events': events.to_dict(), 'readers': readers.to_dict(), 'auth': remoteauth.to_dict(), 'supervisor': supervisor.to_dict(), 'clock': clock.to_dict()}
+
+# Yield counters and gauges in Prometheus text format
+def prometheus_metrics():
+  yield from counters.render()
+  yield from counters.gauge('dl32_heap_free_bytes', 'Free heap', gc.mem_free())
+  yield from counters.gauge('dl32_heap_alloc_bytes', 'Allocated heap', gc.mem_alloc())
+  yield from counters.gauge('dl32_uptime_seconds', 'Time since boot', time.time() - boot_time)
+  yield from counters.gauge('dl32_boot_seconds', 'Time from reset until the web server started', boot_ms / 1000)
+  yield from counters.gauge('dl32_loop_lag_max_ms', 'Largest main loop overrun', loopmon.lag_max)
+  yield from counters.gauge('dl32_loop_lag_avg_ms', 'Average main loop overrun', loopmon.lag_total // loopmon.iterations if loopmon.iterations else 0)
+  yield from counters.gauge('dl32_relay_energized_seconds', 'Total time the lock relay has been energized', door.relay_ms / 1000)
+  yield from counters.gauge('dl32_http_connections_active', 'Web server connections being served', webserver.active)
+  yield from counters.counter('dl32_task_restarts_total', 'Tasks restarted by the supervisor', sum(supervisor.restarts))
+  yield from counters.gauge('dl32_door_state', 'Door state (0 locked, 1 unlocked, 2 open, 3 held open, 4 forced open)', door.state)
+
+# Publish metrics as JSON to MQTT metrics topic
+def publish_metrics():
+  global mqtt_online
+  if mqtt_online:
+    try:
+      mqtt.publish(mqtt_met_top, json.dumps(get_metrics()), retain=False, qos=0)
+    except:
+      counters.inc(counters.MQTT_PUBLISH_FAIL)
+      print('error publishing to MQTT metrics topic')
+
+# Serve the WebUI, listening again whenever web_port changes
+async def serve_web():
+  global web_restart
+  while True:
+    web_restart = False
+    await web_server.start_server(port = web_port)
+    if not web_restart:
+      return
+    print('Web server moved to port ' + str(web_port))
+    publish_status('Web server moved to port ' + str(web_port))
+
 # Start Microdot Async web server
 def start_server():
+  global boot_ms
+  boot_ms = time.ticks_ms()
+  print('Boot completed in ' + str(boot_ms) + ' ms')
   print('Starting web server on port ' + str(web_port))
   publish_status('Starting web server on port ' + str(web_port))
   try:
-    web_server.run(port = web_port)
+    uasyncio.run(serve_web())
   except:
     web_server.shutdown()
     print('Failed to start web server')
 
-# Import keys from SD card into keys dictionary and overwrite keys.cfg on ESP32
+# Apply changed configuration, called by the config registry
+
+# Rejoin WiFi with the new network settings
+def apply_wifi_config(changed):
+  read_wifi_config()
+  print('WiFi settings changed, connecting to ' + wifi_ssid)
+  loopmon.spawn(wifi_reconnect())
+
+async def wifi_reconnect():
+  global ip_address
+  sta_if = network.WLAN(network.STA_IF)
+  sta_if.disconnect()
+  sta_if.connect(wifi_ssid, wifi_pass)
+  waited = 0
+  while not sta_if.isconnected():
+    if waited >= wifi_connect_timeout:
+      print('ERROR: Could not connect to WiFi SSID ' + wifi_ssid)
+      return
+    await uasyncio.sleep_ms(100)
+    waited += 100
+  ip_address = sta_if.ifconfig()[0]
+  print('Connected to wifi SSID ' + wifi_ssid + ', IP address: ' + ip_address)
+  invalidate_pages(DEP_NETWORK)
+  resolve_ntp()
+  publish_status('Connected to wifi SSID ' + wifi_ssid)
+
+# Drop the MQTT connection and the tasks of its session, then connect again
+def restart_mqtt():
+  global mqtt_online
+  if mqtt_online:
+    try:
+      mqtt.disconnect()
+    except:
+      pass
+    mqtt_online = False
+  connect_mqtt()
+  if mqtt_online:
+    start_mqtt_tasks()
+
+# Reconnect to the MQTT broker with the new settings and topics
+def apply_mqtt_config(changed):
+  read_mqtt_config()
+  restart_mqtt()
+  if mqtt_online:
+    publish_status('MQTT settings changed, connected as ' + mqtt_clid)
+
+# Move the web server to the new port once the current request has been answered
+def apply_web_config(changed):
+  global web_port, web_restart
+  web_port = CONFIG_DICT['web_port']
+  web_restart = True
+  web_server.shutdown()
+
+def apply_doorbell_config(changed):
+  global current
+  current = Doorbells[CONFIG_DICT['doorbell']]
+
+# Start checking in with a newly configured key sync server
+def apply_sync_config(changed):
+  read_sync_config()
+  if key_sync_url != '' and not key_sync_running:
+    loopmon.spawn(key_sync())
+
+def config_changed(changed):
+  invalidate_pages(DEP_CONFIG)
+
+config.subscribe(config.WIFI, apply_wifi_config)
+config.subscribe(config.MQTT, apply_mqtt_config)
+config.subscribe(config.WEB, apply_web_config)
+config.subscribe(config.DOORBELL, apply_doorbell_config)
+config.subscribe(config.SYNC, apply_sync_config)
+config.subscribe(config.WIFI | config.MQTT | config.WEB | config.DOORBELL | config.SYNC, config_changed)
+
+# Validate and apply configuration changes live, saving them to dl32.cfg; returns the invalid names
+def update_config(changes):
+  errors = config.update(changes)
+  if not errors:
+    save_config_to_esp()
+  return errors
+
+# Import keys from SD card into keys dictionary and overwrite the key store on ESP32
 def import_keys_from_sd():
   global sd_present
   if (sd_present == False):
     print ('SD Card not present')
     return
-  if file_exists('sd/keys.cfg'):
+  if keystore.find('sd/keys.csv', 'sd/keys.cfg') is not None:
     load_sd_keys()
-    if file_exists('keys.cfg'):
-      refresh_time()
-      os.rename('keys.cfg', 'keys_' + (str('{}{:02d}{:02d}_{:02d}{:02d}{:02d}'.format(year, month, day, hour, mins, secs))))
+    if file_exists(keys_file):
+      os.rename(keys_file, 'keys_' + clock.text())
       save_keys_to_esp()
+    if file_exists('sd/rules.cfg'):
+      try:
+        with open('sd/rules.cfg') as json_file:
+          rules.compile(json.load(json_file))
+        save_rules_to_esp()
+      except:
+        print('ERROR: Could not load sd/rules.cfg into access rules')
   else:
-    print('No file sd/keys.cfg on SD card')
+    print('No file sd/keys.csv or sd/keys.cfg on SD card')
 
 # Import config from SD card into config dictionary and overwrite dl32.cfg on ESP32
 def import_config_from_sd():
@@ -362,10 +706,9 @@ def import_config_from_sd():
     print ('SD Card not present')
     return
   if file_exists('sd/dl32.cfg'):
-    load_sd_config()
-    if file_exists('dl32.cfg'):
-      refresh_time()
-      os.rename('dl32.cfg', 'dl32' + (str('{}{:02d}{:02d}_{:02d}{:02d}{:02d}'.format(year, month, day, hour, mins, secs))))
+    if load_sd_config():
+      if file_exists('dl32.cfg'):
+        os.rename('dl32.cfg', 'dl32' + clock.text())
       save_config_to_esp()
   else:
     print('No file sd/dl32.cfg on SD card')
@@ -382,17 +725,16 @@ def check_boot():
       if time_held > add_hold_time:
         print('Loading configuration + keys from SD card')
 
-# Add a new key to the autorized keys dictionary
-def add_key(key_number):
+# Add a new key to the autorized keys dictionary, named after the time it was scanned (default now)
+def add_key(key_number, stamp=None):
   if (len(str(key_number)) > 1 and len(str(key_number)) < 7):
     print ('  Adding key ' + str(key_number))
-    refresh_time()
-    date_time = ('{}{:02d}{:02d}_{:02d}{:02d}{:02d}'.format(year, month, day, hour, mins, secs))
+    date_time = clock.text(stamp)
     KEYS_DICT[str(key_number)] = date_time
     save_keys_to_esp()
     print('  Key ' + str(key_number) + ' added to authorized list as: ' + date_time)
     publish_status('Key ' + str(key_number) + ' added to authorized list as ' + date_time)
-    resync_html_content()
+    invalidate_pages(DEP_KEYS)
   else:
     print('  Unable to add key ' + key_number)
     print('  Invalid key!')
@@ -403,9 +745,12 @@ def rem_key(key_number):
     print ('  Removing key ' + str(key_number))
     del KEYS_DICT[str(key_number)]
     save_keys_to_esp()
+    if str(key_number) in rules.RULES['keys']:
+      rules.remove_key(str(key_number))
+      save_rules_to_esp()
     print('  Key '+ str(key_number) +' removed!')
     publish_status('Key ' + str(key_number) + ' removed from authorized list')
-    resync_html_content()
+    invalidate_pages(DEP_KEYS)
   else:
     print('  Unable to remove key ' + key_number)
     print('  Invalid key format - key not removed')
@@ -418,373 +763,166 @@ def ren_key(key, name):
     save_keys_to_esp()
     print('  Key '+ str(key) +' renamed to ' + name)
     publish_status('Key ' + str(key) + ' renamed to ' + name)
-    resync_html_content()
+    invalidate_pages(DEP_KEYS)
   else:
     print('  Unable to rename key ' + key)
 
-# RFID key listener function
-def on_key(key_number, facility_code, keys_read):
+# RFID key listener function: decides on access and emits the outcome for the consumer tasks to act on
+def on_key(key_number, facility_code, keys_read, reader=0):
   global add_mode
   global add_mode_counter
   global add_mode_intervals
-  print('key detected')
-  if (str(key_number) in key_NUMS):
-    if add_mode == False:
-      print ('  Authorized key: ')
-      print ('  key #: ' + str(key_number))
-      print ('  key belongs to ' + KEYS_DICT[str(key_number)])
-      publish_status('Authorized key ' + str(key_number) + ' (' + KEYS_DICT[str(key_number)] + ') scanned')
-      unlock(key_dur)
-    else:
-      add_mode = False
-      print ('  key #' + str(key_number) + ' is already authorized.')
-      add_mode_counter = add_mode_intervals
+  scan_start = time.ticks_us()
+  key = str(key_number)
+  readers.scanned(reader)
+  if add_mode:
+    add_mode = False
+    add_mode_counter = add_mode_intervals
+    bus.emit(bus.KEY_ADD, key, 1 if key in KEYS_DICT else 0, 0, reader)
+  elif key in KEYS_DICT:
+    grant(key, scan_start, facility_code, reader)
+  elif remoteauth.url == '':
+    bus.emit(bus.KEY_DENIED, key, bus.DENY_UNKNOWN, facility_code, reader)
   else:
-    if add_mode == False:
-      np[0] = np_invalid	
-      np.write()
-      print ('  Unauthorized key: ')
-      print ('  key #: ' + str(key_number))
-      print ('  Facility code: ' + str(facility_code))
-      publish_status('Unauthorized key ' + str(key_number) + ' scanned')
-      invalidBeep()
-      np[0] = np_standby
-      np.write()
+    # Keys missing from the key list are asked about remotely, unless the answer is cached
+    known = remoteauth.cached(key, time.ticks_ms())
+    if known is None and bus.full(consumers.AUTH_Q):
+      # Too many lookups waiting: refuse now rather than leave the badge without an answer
+      bus.emit(bus.KEY_DENIED, key, bus.DENY_UNAVAILABLE, facility_code, reader)
+    elif known is None:
+      bus.emit(bus.KEY_LOOKUP, key, scan_start, facility_code, reader)
+    elif known:
+      grant(key, scan_start, facility_code, reader)
     else:
-      add_key(key_number)
-      add_mode = False
-      add_mode_counter = add_mode_intervals
+      bus.emit(bus.KEY_DENIED, key, bus.DENY_UNKNOWN, facility_code, reader)
+
+# Grant access to an authorized key unless its access rules or anti-passback refuse it
+def grant(key, scan_start, facility_code, reader):
+  result = rules.check(key, clock.localtime())
+  if result == rules.DENY_EXPIRED:
+    bus.emit(bus.KEY_DENIED, key, bus.DENY_EXPIRED, facility_code, reader)
+  elif result == rules.DENY_SCHEDULE:
+    bus.emit(bus.KEY_DENIED, key, bus.DENY_SCHEDULE, facility_code, reader)
+  elif readers.main_door(reader) and door.passback(key, time.ticks_ms()):
+    bus.emit(bus.KEY_DENIED, key, bus.DENY_PASSBACK, facility_code, reader)
+  else:
+    bus.emit(bus.KEY_GRANTED, key, scan_start, 0, reader)
 
-Wiegand(wiegand_0, wiegand_1, on_key)
+# Wiegand callback for one reader
+def reader_callback(reader):
+  def callback(key_number, facility_code, keys_read):
+    on_key(key_number, facility_code, keys_read, reader)
+  return callback
+
+# All readers share the key list and access rules
+WIEGAND_READERS = [Wiegand(wiegand_0, wiegand_1, reader_callback(readers.add()))]
+for pin0, pin1, relay, reader_led in extra_readers:
+  reader = readers.add(relay, reader_led)
+  # Each further reader times its frames with its own hardware timer
+  WIEGAND_READERS.append(Wiegand(pin0, pin1, reader_callback(reader), reader))
 
 # MQTT callback function
 def sub_cb(topic, msg):
-  print('Message arrived on topic ' + topic.decode('utf-8') + ': ' + msg.decode('utf-8'))
-  if topic == mqtt_cmd_top:
-    if (msg.decode('utf-8') == 'ping'):
-      publish_status('pong')
-    elif ((msg.decode('utf-8') == 'unlock') and garage_mode == False):
-      unlock(mqtt_dur)
-    elif ((msg.decode('utf-8') == 'toggle') and garage_mode == True):
-      gar_toggle(gar_dur)
-    elif ((msg.decode('utf-8') == 'open') and garage_mode == True):
-      gar_open(gar_dur)
-    elif ((msg.decode('utf-8') == 'close') and garage_mode == True):
-      gar_close(gar_dur)
-    elif ((msg.decode('utf-8') == 'stop') and garage_mode == True):
-      gar_stop(gar_dur)
+  if topic == mqtt_keys_top or topic == mqtt_keys_dev_top:
+    bus.emit(bus.KEY_DELTA, msg)
+  elif topic == mqtt_cmd_top:
+    command = msg.decode('utf-8')
+    if command == 'unlock' and garage_mode == False:
+      bus.emit(bus.UNLOCK, None, bus.SRC_MQTT)
+    elif command in garage.COMMAND_NAMES and garage_mode == True:
+      bus.emit(bus.GARAGE, None, garage.COMMAND_NAMES.index(command))
     else:
-      print ('Command not recognized!')
-
-# CSS styles for WebUI pages
-css = "div {width: 400px; margin: 20px auto; text-align: center; border: 3px solid #32e1e1; background-color: #555555; left: auto; right: auto;} hr {border-bottom: 1px solid #32e1e1} .header {font-family: Arial, Helvetica, sans-serif; font-size: 20px; color: #32e1e1} .statusText {font-size: 12px} button {width: 395px; background-color: #32e1e1; border: none; text-decoration: none} .backNav {width: 50px; float: left;} .saveConf{width: 150px; } .config_input{width: 150px;} button.rem {background-color: #C12200; width: 30px; padding-left: 2px;} button.rem:hover {background-color: red} button.ren {background-color: #ff9900; width: 55px; padding-left: 1px} button.ren:hover {background-color: #ffcc00} input {width: 296px; border: none; text-decoration: none;} button:hover {background-color: #12c1c1; border: none; text-decoration: none;} input.renInput{width: 75px} .addKey {width: 193px;} .main_heading {font-family: Arial, Helvetica, sans-serif; color: #32e1e1; font-size: 30px;} h5 {font-family: Arial, Helvetica, sans-serif; color: #32e1e1} label {font-family: Arial, Helvetica, sans-serif; font-size: 10px; color: #32e1e1;} a {font-family: Arial, Helvetica, sans-serif; font-size: 10px; color: #32e1e1;} textarea {background-color: #303030; font-size: 11px; width: 394px; height: 75px; resize: vertical; color: #32e1e1;} body {background-color: #303030; text-align: center;} "
-
-# Resync contents of static HTML webpage to take into account changes
-def resync_html_content():
-  global main_html
-  global ip_address
-
-  rem_buttons = '<table style="width: 380px; text-align: left; border: 0px solid black; border-collapse: collapse; margin-left: auto; margin-right: auto;">'
-  for key in KEYS_DICT:
-      rem_buttons += '<tr> <td style="width: 200px;"> <a style="font-size: 15px;"> &bull; ' + key + ' (' + KEYS_DICT[key] + ')</a></td><td><input id="renKeyInput_' + key + '" class="renInput" value="" maxlength="16" placeholder="New name"> <a> <button onClick="renKey('+key+')" class="ren">Rename</button></a></td><td><a href="/rem_key/'+key+'"><button class="rem">DEL</button></a></td></tr>'
-  rem_buttons += "</table>"
+      bus.emit(bus.COMMAND, command)
 
-  if garage_mode == True:
-    modeText = '<a class="statusText"><b>Mode:</b> Garage</a>'
-    mainButtonText = 'HTTP Open/Close'
+# Render main WebUI page
+def render_main_page():
+  if garage_mode or magnetic_sensor_present:
+    button_text = 'HTTP Open/Close'
   else:
-    modeText = '<a class="statusText"><b>Mode:</b> Lock</a>'
-    mainButtonText = 'HTTP Unlock'
-
-  if magnetic_sensor_present:
-    mainButtonText = 'HTTP Open/Close'
-    if mag_state == 1:
-      doorStateText = '<a class="statusText"><b>Door State:</b> Open </a>'
-    else:
-      doorStateText = '<a class="statusText"><b>Door State:</b> Closed </a>'
-  else:
-    doorStateText = ''
-
-  if sd_present:
-    sdPresentText = '<a class="statusText"><b>SD Card Present:</b> Yes </a>'
-  else:
-    sdPresentText = '<a class="statusText"><b>SD Card Present:</b> No </a>'
-   
-  
-  main_html = """<!DOCTYPE html>
-  <html>
-    <head>
-      <style>
-      """ + css + """
-      </style>
-      <script>
-      window.addKey = function(){
-        var input = document.getElementById("addKeyInput").value;
-        window.location.href = "/add_key/" + input;
-      }
-      </script>
-      <script>
-      window.renKey = function(key){
-        var inputid = "renKeyInput_" + key.toString()
-        console.log(inputid)
-        var input = document.getElementById(inputid).value;
-        window.location.href = "/ren_key/" + key + "/" + input;
-      }
-      </script>
-    </head>
-    <body>
-      <div>
-        <br/>
-        <a class='main_heading'>DL32 MENU</a>
-        </br/>
-        <a style="font-size: 15px">--- MicroPython Edition ---</a>
-        <br/>
-        <a>by Mark Booth - </a><a href='https://github.com/Mark-Roly/DL32_mpy'>github.com/Mark-Roly/DL32_mpy</a>
-        <br/>
-        <hr>
-        """ + modeText + """
-        <br/>
-        """ + doorStateText + """
-        <br/>
-        """ + sdPresentText + """
-        <hr>
-        <a class='header'>Device Control</a>
-        <br/>
-        <a href='/unlock'><button> """ + mainButtonText + """ </button></a>
-        <br/>
-        <a href='/bell'><button>Ring bell</button></a>
-        <br/>
-        <a href='/reset'><button>Reset board</button></a>
-        <hr>
-        <a class='header'>File Download</a>
-        <br/>
-        <a href='/download/main.py'><button>Download main.py</button></a>
-        <br/>
-        <a href='/download/boot.py'><button>Download boot.py</button></a>
-        <br/>
-        <a href='/download/doorbells.py'><button>Download doorbells.py</button></a>
-        <br/>
-        <a href='/download/dl32.cfg'><button>Download dl32.cfg</button></a>
-        <br/>
-        <a href='/download/keys.cfg'><button>Download keys.cfg</button></a>
-        <hr>
-        <a class='header'>Configuration</a>
-        <a href='/config_network'><button>Configure Network</button></a>
-        <br/>
-        <a href='/config_mqtt'><button>Configure MQTT</button></a>
-        <br/>
-        <a href='/config_doorbell'><button>Configure Doorbell tones</button></a>
-        <br/>
-        <a href='/firmware_update'><button>Firmware update</button></a>
-        <hr>
-        <a class='header'>Key Management</a>
-        <br/>
-        <a style="color:#ffcc00; font-size: 15px; font-weight: bold;">***This cannot be undone!***</a>
-        <br/>
-        <a href='/add_mode'><button>scan-to-add</button></a>
-        <input type="text" placeholder="Enter key number" id="addKeyInput" value="" maxlength="8" class="addKey">
-        <button onClick="addKey()" class="addKey">Add Key</button>
-        <br/>
-        """ + rem_buttons + """
-        <a href='/purge_keys'><button>Purge all keys</button></a>
-
-        <hr>
-        <a>Version """ + _VERSION + """ IP Address """ + str(ip_address) + """</a>
-        <br/>
-        <br/>
-      </div>
-    </body>
-  </html>"""
-
-resync_html_content()
-
-# Resync contents of static HTML webpage to take into account changes
-def resync_config_network_content():
-  global config_network_html
-  global ip_address
-  
-  config_network_html = """<!DOCTYPE html>
-  <html>
-    <head>
-      <style>
-      """ + css + """
-      </style>
-      <script>
-      window.saveConf = function(){
-        var wifi_ssid = document.getElementById("wifi_ssid").value;
-        var wifi_pass = document.getElementById("wifi_pass").value;
-        var web_port = document.getElementById("web_port").value;
-        window.location.href = "/config_network/update/";
-      }
-      </script>
-    </head>
-    <body>
-      <div>
-        <a href="/"><button class="backNav">Back</button></a><br/>
-        <a class='main_heading'>DL32 MENU</a></br/>
-        <a style="font-size: 15px">--- MicroPython Edition ---</a><br/>
-        <a>by Mark Booth - </a><a href='https://github.com/Mark-Roly/DL32_mpy'>github.com/Mark-Roly/DL32_mpy</a><br/><br/>
-        <a class='header'>Network Configuration</a>
-        <br/> <br/>
-        <form action="" method="GET">
-          <table style="width: 300px; text-align: left; border: 0px solid black; border-collapse: collapse; margin-left: auto; margin-right: auto;">
-            <tr> <td> <a>Wifi SSID:</a> </td> <td> <input id="wifi_ssid" name="wifi_ssid" class="config_input" value=""" + str(wifi_ssid) + """> </td> </tr>
-            <tr> <td> <a>Wifi password:</a> </td> <td> <input type="password" id="wifi_pass" name="wifi_pass" class="config_input" value=""" + str(wifi_pass) + """> </td> </tr>
-            <tr> <td> <a>WebUI port:</a> </td> <td> <input id="web_port" name="web_port" class="config_input" value=""" + str(web_port) + """> </td> </tr>
-          </table>
-        <br/>
-        <button class="saveConf" type="submit">Save</button><br/>
-        <br/>
-        <a>Version """ + _VERSION + """ IP Address """ + str(ip_address) + """</a><br/>
-        <br/>
-      </div>
-    </body>
-  </html>"""
-  
-resync_config_network_content()
-
-# Resync contents of static HTML webpage to take into account changes
-def resync_config_mqtt_content():
-  global config_mqtt_html
-  global ip_address
-  
-  config_mqtt_html = """<!DOCTYPE html>
-  <html>
-    <head>
-      <style>
-      """ + css + """
-      </style>      <script>
-      window.saveConf = function(){
-        var mqtt_brok = document.getElementById("mqtt_brok").value;
-        var mqtt_port = document.getElementById("mqtt_port").value;
-        var mqtt_clid = document.getElementById("mqtt_clid").value;
-        var mqtt_user = document.getElementById("mqtt_user").value;
-        var mqtt_pass = document.getElementById("mqtt_pass").value;
-        var mqtt_sta_top = document.getElementById("mqtt_sta_top").value;
-        var mqtt_cmd_top = document.getElementById("mqtt_cmd_top").value;
-        window.location.href = "/config/";
-      }
-      </script>
-    </head>
-    <body>
-      <div>
-        <a href="/"><button class="backNav">Back</button></a><br/>
-        <a class='main_heading'>DL32 MENU</a></br/>
-        <a style="font-size: 15px">--- MicroPython Edition ---</a><br/>
-        <a>by Mark Booth - </a><a href='https://github.com/Mark-Roly/DL32_mpy'>github.com/Mark-Roly/DL32_mpy</a><br/><br/>
-        <a class='header'>MQTT Configuration</a>
-        <br/> <br/>
-        <form action="" method="GET">
-          <table style="width: 300px; text-align: left; border: 0px solid black; border-collapse: collapse; margin-left: auto; margin-right: auto;">
-            <tr> <td> <a>MQTT broker:</a> </td> <td> <input id="mqtt_brok" name="mqtt_brok" class="config_input" value=""" + str(mqtt_brok) + """> </td> </tr>
-            <tr> <td> <a>MQTT port:</a> </td> <td> <input id="mqtt_port" name="mqtt_port" class="config_input" value=""" + str(mqtt_port) + """> </td> </tr>
-            <tr> <td> <a>MQTT id:</a> </td> <td> <input id="mqtt_clid" name="mqtt_clid" class="config_input" value=""" + str(mqtt_clid) + """> </td> </tr>
-            <tr> <td> <a>MQTT user:</a> </td> <td> <input id="mqtt_user" name="mqtt_user" class="config_input" value=""" + CONFIG_DICT['mqtt_user'] + """> </td> </tr>
-            <tr> <td> <a>MQTT password:</a> </td> <td> <input type="password" id="mqtt_pass" name="mqtt_pass" class="config_input" value=""" + CONFIG_DICT['mqtt_pass'] + """> </td> </tr>
-            <tr> <td> <a>MQTT status topic:</a> </td> <td> <input id="mqtt_sta_top" name="mqtt_sta_top" class="config_input" value=""" + CONFIG_DICT['mqtt_sta_top'] + """> </td> </tr>
-            <tr> <td> <a>MQTT command topic:</a> </td> <td> <input id="mqtt_cmd_top" name="mqtt_cmd_top" class="config_input" value=""" + CONFIG_DICT['mqtt_cmd_top'] + """> </td> </tr>
-          </table>
-        <br/>
-        <button class="saveConf" type="submit">Save</button><br/>
-        <br/>
-        <a>Version """ + _VERSION + """ IP Address """ + str(ip_address) + """</a><br/>
-        <br/>
-      </div>
-    </body>
-  </html>"""
-  
-resync_config_mqtt_content()
-
-# Resync contents of static HTML webpage to take into account changes
-def resync_firmware_update_content():
-  global firmware_update_html
-  
-  firmware_update_html = """<!DOCTYPE html>
-  <html>
-    <head>
-      <style>
-      """ + css + """
-      </style>
-    </head>
-    <body>
-      <div>
-        <a href="/"><button class="backNav">Back</button></a><br/>
-        <a class='main_heading'>DL32 Menu</a></br/>
-        <a style="font-size: 15px">--- MicroPython Edition ---</a><br/>
-        <a>by Mark Booth - </a><a href='https://github.com/Mark-Roly/DL32_mpy'>github.com/Mark-Roly/DL32_mpy</a><br/><br/>
-        <a class='header'>Firmware Update</a>
-        <br/> <br/>
-        <a style="color:#ff0000; font-size: 15px; font-weight: bold;">***!!!WARNING!!!***</a>
-        <br/>
-        <a style="color:#ffcc00; font-size: 15px;">This will pull the latest main.py from the </a> <a style="font-size: 15px;", href="github.com/Mark-Roly/DL32_mpy">github.</a>
-        <br/>
-        <a style="color:#ffcc00; font-size: 15px;">Do not click this if you don't know what you are doing!</a>
-        <a href='/execute_update'><button style="background-color:#ff0000;">UPDATE THE FIRMWARE</button></a>
-        <br/><br/>
-        <a>Version """ + _VERSION + """ IP Address """ + str(ip_address) + """</a><br/>
-        <br/>
-      </div>
-    </body>
-  </html>"""
-  
-resync_firmware_update_content()
-
-# Resync contents of static HTML webpage to take into account changes
-def resync_config_doorbell_content():
-  global config_doorbell_html
-  global Doorbells
-  global ip_address
-  global current
-  
-  doorbell_options = ""
-  
-  for key in Doorbells:
-    if (current["title"] == Doorbells[key]["title"]):
-      doorbell_options += '<option value=' + key + ' selected>' + Doorbells[key]["title"] + '</option>'
-    else:
-      doorbell_options += '<option value=' + key + '>' + Doorbells[key]["title"] + '</option>'
-      
-  config_doorbell_html = """<!DOCTYPE html>
-  <html>
-    <head>
-      <style>div {width: 400px; margin: 20px auto; text-align: center; border: 3px solid #32e1e1; background-color: #555555; left: auto; right: auto;}.header {font-family: Arial, Helvetica, sans-serif; font-size: 20px; color: #32e1e1;} .backNav {width: 50px; float: left;} .saveConf{width: 150px; } .config_input{width: 150px;} button {width: 395px; background-color: #32e1e1; border: none; text-decoration: none; }button.rem {background-color: #C12200; width: 40px;}button.rem:hover {background-color: red}button.ren {background-color: #ff9900; width: 40px;}button.ren:hover {background-color: #ffcc00}input {width: 296px; border: none; text-decoration: none;}button:hover {background-color: #12c1c1; border: none; text-decoration: none;} input.renInput{width: 75px} .addKey {width: 60px;} .main_heading {font-family: Arial, Helvetica, sans-serif; color: #32e1e1; font-size: 30px;}h5 {font-family: Arial, Helvetica, sans-serif; color: #32e1e1;}label{font-family: Arial, Helvetica, sans-serif; font-size: 10px; color: #32e1e1;}a {font-family: Arial, Helvetica, sans-serif; font-size: 10px; color: #32e1e1;}textarea {background-color: #303030; font-size: 11px; width: 394px; height: 75px; resize: vertical; color: #32e1e1;}body {background-color: #303030; text-align: center;}</style>
-      <script>
-        window.setBell = function(){
-          var input = document.getElementById("doorbell").value;
-          window.location.href = "/set_bell/" + input;
-        }
-      </script>
-    </head>
-    <body>
-      <div>
-        <a href="/"><button class="backNav">Back</button></a><br/>
-        <a class='main_heading'>DL32 MENU</a></br/>
-        <a style="font-size: 15px">--- MicroPython Edition ---</a><br/>
-        <a>by Mark Booth - </a><a href='https://github.com/Mark-Roly/DL32_mpy'>github.com/Mark-Roly/DL32_mpy</a><br/><br/>
-        <a class='header'>Doorbell Configuration</a>
-        <br/> <br/>
-        <table style="width: 300px; text-align: left; border: 0px solid black; border-collapse: collapse; margin-left: auto; margin-right: auto;">
-          <tr> <td> <a>Bell Tune:</a> </td>
-            <td>
-              <select id="doorbell" name="doorbell" class="config_input">
-                """ + doorbell_options + """
-              </select>
-            </td>
-          </tr>
-        </table>
-        <br/>
-        <button class="saveConf" onClick="setBell()">Save</button>
-        <br/>
-        <a href='/config_doorbell/test'><button class="saveConf">Test current</button></a><br/>
-        <a href='/config_doorbell/stop'><button class="saveConf">Stop playing</button></a><br/>
-        <br/>
-        <a>Version """ + _VERSION + """ IP Address """ + str(ip_address) + """</a><br/>
-        <br/>
-      </div>
-    </body>
-  </html>"""
-  
-resync_config_doorbell_content()
+    button_text = 'HTTP Unlock'
+  return tpl.render('main', {
+    'garage_mode': garage_mode,
+    'magnetic_sensor_present': magnetic_sensor_present,
+    'door_open': mag_state == 1,
+    'sd_present': sd_present,
+    'button_text': button_text,
+    'keys': KEYS_DICT.items(),
+    'version': _VERSION,
+    'ip_address': ip_address
+  })
+
+# Render network configuration page
+def render_config_network_page():
+  return tpl.render('config_network', {
+    'wifi_ssid': wifi_ssid,
+    'wifi_pass': wifi_pass,
+    'web_port': web_port,
+    'version': _VERSION,
+    'ip_address': ip_address
+  })
+
+# Render MQTT configuration page
+def render_config_mqtt_page():
+  return tpl.render('config_mqtt', {
+    'mqtt_brok': mqtt_brok,
+    'mqtt_port': mqtt_port,
+    'mqtt_clid': mqtt_clid,
+    'mqtt_user': CONFIG_DICT['mqtt_user'],
+    'mqtt_pass': CONFIG_DICT['mqtt_pass'],
+    'mqtt_sta_top': CONFIG_DICT['mqtt_sta_top'],
+    'mqtt_cmd_top': CONFIG_DICT['mqtt_cmd_top'],
+    'version': _VERSION,
+    'ip_address': ip_address
+  })
+
+# Render firmware update page
+def render_firmware_update_page():
+  return tpl.render('firmware_update', {
+    'version': _VERSION,
+    'ip_address': ip_address
+  })
+
+# Render doorbell configuration page
+def render_config_doorbell_page():
+  return tpl.render('config_doorbell', {
+    'tones': ((tone, Doorbells[tone]['title'], Doorbells[tone] is current) for tone in Doorbells),
+    'version': _VERSION,
+    'ip_address': ip_address
+  })
+
+# WebUI pages: name -> (render function, dependency flags)
+PAGES = {
+  'main': (render_main_page, DEP_KEYS | DEP_NETWORK | DEP_MODE),
+  'config_network': (render_config_network_page, DEP_CONFIG | DEP_NETWORK),
+  'config_mqtt': (render_config_mqtt_page, DEP_CONFIG | DEP_NETWORK),
+  'firmware_update': (render_firmware_update_page, DEP_NETWORK),
+  'config_doorbell': (render_config_doorbell_page, DEP_CONFIG | DEP_NETWORK)
+}
+
+# Drop all cached pages and reclaim their memory
+def evict_pages():
+  PAGE_CACHE.clear()
+  gc.collect()
+
+# Mark cached pages that depend on any of the given flags as dirty
+def invalidate_pages(deps):
+  for name in list(PAGE_CACHE):
+    if PAGES[name][1] & deps:
+      del PAGE_CACHE[name]
+
+# Return page content, rendering it only if it is not cached or is dirty
+def get_page(name):
+  page = PAGE_CACHE.get(name)
+  if page is None:
+    if gc.mem_free() < page_cache_min_free:
+      # Stream straight from the template rather than caching when heap is low
+      evict_pages()
+      return PAGES[name][0]()
+    mem_start = memstat.begin()
+    page = b''.join(PAGES[name][0]())
+    memstat.end('page_' + name, mem_start)
+    PAGE_CACHE[name] = page
+  return page
 
 # Print allowed keys to serial
 def print_keys():
@@ -800,106 +938,131 @@ def purge_keys():
   global KEYS_DICT
   wipe_keys()
   save_keys_to_esp()
-  resync_html_content()
-
-# Unlock for duration specified as argument
-def unlock(dur):
-  np[0] = np_unlocked
-  np.write()
+  rules.clear_keys()
+  save_rules_to_esp()
+  invalidate_pages(DEP_KEYS)
+
+# Unlock the door of a reader for up to the duration specified as argument, recording latency if triggered by a key scan.
+# The door state machine relocks the main door once the duration has passed or the door has been opened and closed again.
+def unlock(dur, scan_start=None, key=None, reader=0):
+  if not readers.main_door(reader):
+    readers.unlock(reader, dur, time.ticks_ms())
+    if scan_start is not None:
+      counters.observe_latency(time.ticks_diff(time.ticks_us(), scan_start))
+    bus.emit(bus.UNLOCKED, None, 0, 0, reader)
+    return
   lockRelay_pin.value(1)
-  unlockBeep()
-  print('  Unlocked2')
-  publish_status('Unlocked')
+  if scan_start is not None:
+    counters.observe_latency(time.ticks_diff(time.ticks_us(), scan_start))
   buzzer2_pin.value(1)
-  time.sleep_ms(dur)
+  led.post(led.UNLOCKED, np_unlocked)
+  door.unlock(dur, time.ticks_ms(), key)
+  bus.emit(bus.UNLOCKED)
+
+# De-energize the lock relay, or the relay of a reader with its own door
+def relock(reader=0):
+  if not readers.main_door(reader):
+    readers.relock(reader)
+    bus.emit(bus.LOCKED, None, 0, 0, reader)
+    return
   lockRelay_pin.value(0)
   buzzer2_pin.value(0)
-  np[0] = np_standby
-  np.write()
-  print('  Locked2')
-  publish_status('Locked')
-
-# Activate toggle relay for duration specified as argument
-def gar_toggle(dur):
-  np[0] = np_unlocked
-  np.write()
-  GH01.value(0)
-  unlockBeep()
-  print('  GD_Toggled')
-  publish_status('GD_Toggled')
-  time.sleep_ms(dur)
-  GH01.value(1)
-  np[0] = np_standby
-  np.write()
-
-# Activate open for relay duration specified as argument
-def gar_open(dur):
-  np[0] = np_unlocked
-  np.write()
-  GH02.value(0)
-  unlockBeep()
-  print('  GD_Open')
-  publish_status('GD_Open')
-  time.sleep_ms(dur)
-  GH02.value(1)
-  np[0] = np_standby
-  np.write()
-  
-# Activate close relay for duration specified as argument
-def gar_close(dur):
-  np[0] = np_unlocked
-  np.write()
-  GH03.value(0)
-  unlockBeep()
-  print('  GD_Close')
-  publish_status('GD_Close')
-  time.sleep_ms(dur)
-  GH03.value(1)
-  np[0] = np_standby
-  np.write()
-
-# Activate stop relay for duration specified as argument
-def gar_stop(dur):
-  np[0] = np_unlocked
-  np.write()
-  GH04.value(0)
-  unlockBeep()
-  print('  GD_Stop')
-  publish_status('GD_Stop')
-  time.sleep_ms(dur)
-  GH04.value(1)
-  np[0] = np_standby
-  np.write()
+  led.clear(led.UNLOCKED)
+  bus.emit(bus.LOCKED)
+
+# Relock reader doors whose unlock duration has passed
+def mon_readers():
+  expired = readers.poll(time.ticks_ms())
+  reader = 0
+  while expired:
+    if expired & 1:
+      relock(reader)
+    expired >>= 1
+    reader += 1
+
+# Send a command to the garage door controller
+def gar_command(cmd):
+  gar_events(garage.command(cmd, time.ticks_ms()))
+
+# Act on garage door controller events
+def gar_events(events):
+  if events & garage.EV_PULSE_OFF:
+    for relay in GAR_RELAYS:
+      relay.value(1)
+    led.clear(led.UNLOCKED)
+  if events & garage.EV_PULSE_ON:
+    led.post(led.UNLOCKED, np_unlocked)
+    GAR_RELAYS[garage.pulse].value(0)
+    bus.emit(bus.PULSE, None, garage.pulse)
+  if events & garage.EV_IGNORED:
+    print('  Garage door already ' + garage.STATE_NAMES[garage.state] + ', command ignored')
+  if events & garage.EV_FAULT:
+    print('  Garage door did not reach expected position')
+    publish_status('GD_Fault')
+  if events & garage.EV_STATE:
+    publish_garage()
+
+# Publish garage door state and position to retained MQTT garage topic
+def publish_garage():
+  global mqtt_online
+  print('  Garage door ' + garage.STATE_NAMES[garage.state] + ' (' + str(garage.percent()) + '%)')
+  if mqtt_online:
+    try:
+      mqtt.publish(mqtt_gar_top, json.dumps(garage.to_dict()), retain=True, qos=0)
+    except:
+      counters.inc(counters.MQTT_PUBLISH_FAIL)
+      print('error publishing to MQTT garage topic')
+
+# Advance garage door controller
+def mon_garage():
+  if garage_mode == False:
+    return
+  gar_events(garage.poll(magnetic_sensor_present and int(magSensor.value()) == 0, time.ticks_ms()))
 
 # Monitor bell button
 def mon_bell_butt():
   global current
   if (int(bellButton_pin.value()) == 0) and (bell_ringing == False):
-    print('bell button pushed')
-    uasyncio.create_task(ring_bell(current))
+    bus.emit(bus.BELL)
 
-# Monitor magnetic sensor if attached
+# Monitor magnetic sensor if attached and drive the door state machine
 def mon_mag_sr():
   global mag_state
   global opening_type
   global magnetic_sensor_present
   global doorbell
-  
-  if magnetic_sensor_present == False:
+
+  is_open = magnetic_sensor_present and int(magSensor.value()) == 1
+  flags = door.poll(is_open, time.ticks_ms())
+  if flags == 0:
     return
-  
-  if (int(magSensor.value()) == 0) and (mag_state == 1):
-    print(opening_type + ' sensor closed')
-    publish_status(opening_type + ' sensor closed')
-    mag_state = 0
-  elif (int(magSensor.value()) == 1) and (mag_state == 0):
+  if flags & door.EV_OPENED:
     print(opening_type + ' sensor opened')
     doorbell.stop()
     publish_status(opening_type + ' sensor opened')
     mag_state = 1
-  else:
-    return
-    
+    invalidate_pages(DEP_MODE)
+  if (flags & door.EV_FORCED) and garage_mode == False:
+    counters.inc(counters.DOOR_FORCED)
+    print(opening_type + ' forced open!')
+    led.post(led.ALARM, np_invalid, 0, led.BLINK, 500)
+    publish_status(opening_type + ' forced open')
+  if flags & door.EV_HELD:
+    counters.inc(counters.DOOR_HELD)
+    print(opening_type + ' held open!')
+    led.post(led.ALARM, np_invalid, 0, led.BLINK, 500)
+    publish_status(opening_type + ' held open')
+  if flags & door.EV_CLOSED:
+    print(opening_type + ' sensor closed')
+    led.clear(led.ALARM)
+    publish_status(opening_type + ' sensor closed')
+    mag_state = 0
+    invalidate_pages(DEP_MODE)
+  if flags & door.EV_RELOCK:
+    relock()
+  if flags & (door.EV_OPENED | door.EV_CLOSED | door.EV_FORCED | door.EV_HELD):
+    bus.emit(bus.DOOR, None, door.state)
+
 # Function to listen for exit button presses
 def mon_exit_butt():
   global add_hold_time
@@ -914,11 +1077,9 @@ def mon_exit_butt():
       time.sleep_ms(10)
       time_held += 10
     if time_held > add_hold_time:
-      uasyncio.create_task(key_add_mode())
+      loopmon.spawn(key_add_mode())
     elif add_mode == False:
-      print('Exit button pressed')
-      publish_status('Exit button pressed')
-      unlock(exitBut_dur)
+      bus.emit(bus.UNLOCK, None, bus.SRC_EXIT)
 
 # Function to listen for proramming button presses
 def mon_prog_butt():
@@ -941,42 +1102,102 @@ def mon_prog_butt():
       try:
         import_keys_from_sd()
         import_config_from_sd()
-        print('Import from SD card completed, restarting...')
-        machine.reset()
+        print('Import from SD card completed')
+        publish_status('Keys and configuration imported from SD card')
       except:
         print('ERROR: Import from SD failed!')
     else:
-      publish_status('Prog button pressed')
-      print('prog button pressed')
-
-# Perform over-the-air update by mulling latest main.py from github repo
-def perform_OTA():
-  print('Pulling OTA update...')
-  ugit.pull('main.py', 'https://raw.githubusercontent.com/Mark-Roly/DL32_mpy/main/main.py')
-  print('OTA complete, resetting in 60 seconds...')
-  time.sleep_ms(60000)
+      bus.emit(bus.PROG)
+
+# Perform over-the-air update: stage and verify the changed release files from ota_url, then reset so boot.py installs them.
+# Each piece received beats the supervisor's OTA watch, the watchdog itself is only fed by the supervisor.
+async def perform_OTA():
+  global ota_running
+  print('Pulling OTA update from ' + ota_url)
+  publish_status('OTA update started')
+  try:
+    files = await ota.stage(ota_url, ota_beat)
+  except Exception as e:
+    print('ERROR: OTA update failed: ' + str(e))
+    publish_status('OTA update failed')
+    return
+  finally:
+    ota_running = False
+  if not files:
+    print('OTA: firmware is up to date')
+    publish_status('OTA firmware up to date')
+    return
+  print('OTA staged ' + str(len(files)) + ' changed files (' + str(ota.fetched) + ' bytes downloaded), resetting in 5 seconds...')
+  publish_status('OTA update staged, resetting')
+  await uasyncio.sleep(5)
   machine.reset()
 
+def ota_beat():
+  supervisor.beat(OTA_WATCH)
+
+# Start an OTA update unless one is running
+def start_OTA():
+  global ota_running, ota_task
+  if not ota_running:
+    ota_running = True
+    ota_task = loopmon.spawn(perform_OTA())
+
+# True while no OTA update is running
+def ota_idle():
+  return not ota_running
+
+# Abandon an OTA update that has stopped receiving data
+def cancel_OTA():
+  global ota_running
+  if ota_running:
+    ota_task.cancel()
+    ota_running = False
+
 # Function to listed for MQTT commands
 def mon_cmd_topic():
   global mqtt_online
   if mqtt_online:
     try:
+      mem_start = memstat.begin()
       mqtt.check_msg()
+      memstat.end('mqtt', mem_start)
     except:
       print('error checking MQTT topic')
 
 # Async function to send PingReq messages to MQTT broker
-async def mqtt_ping():
+async def mqtt_ping(session):
   global mqtt_online
-  while mqtt_online:
-    mqtt.ping()
+  while mqtt_online and session == mqtt_session:
+    try:
+      mqtt.ping()
+      supervisor.beat(MQTT_WATCH)
+    except:
+      mqtt_reconnect()
     await uasyncio.sleep(60)
 
+# Async function to periodically publish metrics to MQTT broker
+async def mqtt_metrics(session):
+  global mqtt_online
+  while mqtt_online and session == mqtt_session:
+    publish_metrics()
+    await uasyncio.sleep(metrics_interval)
+
+# Async function to periodically check the sync server for key list changes
+async def key_sync():
+  global key_sync_running
+  key_sync_running = True
+  try:
+    while key_sync_url != '' and key_sync_interval > 0:
+      await fetch_key_delta()
+      supervisor.beat(KEY_SYNC_WATCH)
+      await uasyncio.sleep(key_sync_interval)
+  finally:
+    key_sync_running = False
+
 # Async function to send heartbeat messages to MQTT broker
-async def mqtt_heartbeat():
+async def mqtt_heartbeat(session):
   global mqtt_online
-  while mqtt_online:
+  while mqtt_online and session == mqtt_session:
     publish_status('heartbeat')
     await uasyncio.sleep(300)
 
@@ -987,28 +1208,28 @@ async def ring_bell(tune):
   if (bell_ringing) or (silent_mode):
     return
   bell_ringing = True
-  np[0] = np_doorbell
-  np.write()
+  counters.inc(counters.BELL_RING)
+  led.post(led.DOORBELL, np_doorbell, 0, led.FADE, 1000)
   print ('  Ringing bell - melody: ' + tune['title'])
   publish_status('Ringing bell')
+  mem_start = memstat.begin()
   doorbell = music(tune['music'], pins=[buzzer_pin])
+  memstat.end('music', mem_start)
   while doorbell.tick():
     await uasyncio.sleep_ms(tune['speed'])
 
   doorbell.stop()
-  np[0] = np_standby
-  np.write()
+  led.clear(led.DOORBELL)
   bell_ringing = False
   print ('  Bell finished')
 
 # Enter mode to add new key
-def key_add_mode():
+async def key_add_mode():
   global add_mode
   global add_mode_intervals
   global add_mode_counter
   add_mode = True
-  np[0] = np_add
-  np.write()
+  led.post(led.ADD, np_add, 0, led.BLINK, 500)
   print('Key add mode')
   add_mode_counter = 0
   print('Waiting for new key',end=' ')
@@ -1021,48 +1242,48 @@ def key_add_mode():
   if add_mode == True:
     print('No key detected.')
     add_mode = False
-  np[0] = np_standby
-  np.write()
+  led.clear(led.ADD)
 
 # "Beep-Beep"
-def unlockBeep():
-  if silent_mode == True:
-    return
-  buzzer2_pin.value(1)
-  time.sleep_ms(75)
-  buzzer2_pin.value(0)
-  time.sleep_ms(100)
-  buzzer2_pin.value(1)
-  time.sleep_ms(75)
-  buzzer2_pin.value(0)
-
+UNLOCK_BEEP = (75, 100, 75)
 # "Beeeep-Beeeep"
-def invalidBeep():
+INVALID_BEEP = (750, 100, 750, 100, 750, 100, 750)
+
+# Play a beep pattern of alternating on and off times (ms) on buzzer 2, then leave it on while the door is unlocked
+async def beep(pattern):
   if silent_mode == True:
     return
-  buzzer2_pin.value(1)
-  time.sleep_ms(750)
-  buzzer2_pin.value(0)
-  time.sleep_ms(100)
-  buzzer2_pin.value(1)
-  time.sleep_ms(750)
-  buzzer2_pin.value(0)
-  time.sleep_ms(100)
-  buzzer2_pin.value(1)
-  time.sleep_ms(750)
-  buzzer2_pin.value(0)
-  time.sleep_ms(100)
-  buzzer2_pin.value(1)
-  time.sleep_ms(750)
-  buzzer2_pin.value(0)
+  try:
+    for i in range(len(pattern)):
+      buzzer2_pin.value(1 if i % 2 == 0 else 0)
+      await uasyncio.sleep_ms(pattern[i])
+  finally:
+    buzzer2_pin.value(1 if door.relay else 0)
+
+# Beep pattern playing in the background, or None
+beeping = None
+
+# Play a long beep pattern in the background, so feedback for the next event is not held up by it
+def start_beep(pattern):
+  global beeping
+  beeping = loopmon.spawn(beep(pattern))
+
+# Cut short a beep pattern playing in the background
+async def stop_beep():
+  global beeping
+  if beeping is not None:
+    beeping.cancel()
+    beeping = None
+    # Let it restore the buzzer before the next pattern starts
+    await uasyncio.sleep_ms(0)
 
 # "Bip"
 def lil_bip():
   if silent_mode == True:
     return
-  buzzer_pin2.value(1)
+  buzzer2_pin.value(1)
   time.sleep_ms(1)
-  buzzer_pin2.value(0)
+  buzzer2_pin.value(0)
 
 def prog_sd_beeps():
   if silent_mode == True:
@@ -1082,13 +1303,20 @@ def prog_sd_beeps():
 # --------- MAIN -----------
 async def main_loop():
   while True:
-    wdt.feed()
-    mon_exit_butt()
-    mon_prog_butt()
-    mon_bell_butt()
-    mon_cmd_topic()
-    mon_mag_sr()
-    await uasyncio.sleep_ms(50)
+    loopmon.tick(loop_dur)
+    supervisor.beat(MAIN_LOOP)
+    if ota.feed(time.ticks_ms()):
+      print('OTA update confirmed')
+      publish_status('OTA update confirmed')
+    loopmon.timed('mon_exit_butt', mon_exit_butt)
+    loopmon.timed('mon_prog_butt', mon_prog_butt)
+    loopmon.timed('mon_bell_butt', mon_bell_butt)
+    loopmon.timed('mon_cmd_topic', mon_cmd_topic)
+    loopmon.timed('mon_mag_sr', mon_mag_sr)
+    loopmon.timed('mon_readers', mon_readers)
+    loopmon.timed('mon_garage', mon_garage)
+    memstat.check()
+    await uasyncio.sleep_ms(loop_dur)
 
 # Dip switch modes
 if int(DS01.value()) == 0:
@@ -1112,6 +1340,10 @@ if int(DS04.value()) == 0:
   http_dur = gar_dur
   key_dur = gar_dur
   mqtt_dur = gar_dur
+  garage.travel_dur = gar_travel_dur
+  garage.pulse_dur = gar_dur
+  garage.sensor_present = magnetic_sensor_present
+  garage.init(magnetic_sensor_present and int(magSensor.value()) == 0, time.ticks_ms())
 else:
   print('DS04 OFF')
 
@@ -1125,160 +1357,136 @@ except:
   print('ERROR: Could not connect to WiFi')
 
 if ota_mode == True:
-  perform_OTA()
-
-# Attempt to connect to MQTTbroker
-try:
-  mqtt = MQTTClient(mqtt_clid, mqtt_brok, port=mqtt_port, user=mqtt_user, password=mqtt_pass, keepalive=300)
-  mqtt.set_callback(sub_cb)
-  mqtt.connect()
-  print ('Connected to MQTT broker ' + mqtt_brok + ' as client ' + mqtt_clid)
-  mqtt_online = True
-except:
-   print('ERROR: Could not connect to MQTT Broker')
-   mqtt_online = False
+  start_OTA()
 
-# Attempt to subscribe to MQTT command topic
-if mqtt_online:
+# Attempt to connect to MQTT broker and subscribe to the command and key sync topics
+def connect_mqtt():
+  global mqtt, mqtt_online
+  try:
+    mqtt = MQTTClient(mqtt_clid, mqtt_brok, port=mqtt_port, user=mqtt_user, password=mqtt_pass, keepalive=300)
+    mqtt.set_callback(sub_cb)
+    mqtt.connect()
+    print ('Connected to MQTT broker ' + mqtt_brok + ' as client ' + mqtt_clid)
+    mqtt_online = True
+  except:
+    print('ERROR: Could not connect to MQTT Broker')
+    mqtt_online = False
+    return
   try:
     mqtt.subscribe(mqtt_cmd_top)
     print ('Subscribed to topic ' + mqtt_cmd_top.decode('utf-8'))
   except: 
     print('ERROR: Could not subscribe to MQTT command topic ' + mqtt_cmd_top.decode('utf-8'))
+  try:
+    mqtt.subscribe(mqtt_keys_top)
+    mqtt.subscribe(mqtt_keys_dev_top)
+    print ('Subscribed to key sync topic ' + mqtt_keys_top.decode('utf-8'))
+  except:
+    print('ERROR: Could not subscribe to key sync topic ' + mqtt_keys_top.decode('utf-8'))
 
-web_server = Microdot()
+# Start the keepalive, heartbeat and metrics tasks for the current MQTT connection
+def start_mqtt_tasks():
+  global mqtt_session
+  mqtt_session += 1
+  loopmon.spawn(mqtt_ping(mqtt_session))
+  loopmon.spawn(mqtt_heartbeat(mqtt_session))
+  loopmon.spawn(mqtt_metrics(mqtt_session))
 
-np[0] = np_standby	
-np.write()
+connect_mqtt()
 
-uasyncio.create_task(main_loop())
+web_server = webserver.WebServer()
+
+# Supervisor watches: health checks and recovery of each long-lived part
+
+# True while there is no MQTT connection to watch; a live one is watched through its pings
+def mqtt_idle():
+  return not mqtt_online
+
+# True while no web request handler has been running for long
+def web_healthy():
+  return webserver.handler_age(time.ticks_ms()) < web_handler_deadline
+
+def drop_web_handlers():
+  webserver.cancel_handlers(time.ticks_ms(), web_handler_deadline)
+
+def wifi_healthy():
+  return wifi_ssid == '' or network.WLAN(network.STA_IF).isconnected()
+
+def restart_wifi():
+  loopmon.spawn(wifi_reconnect())
+
+# True while key sync over HTTP is not configured to run
+def key_sync_idle():
+  return key_sync_url == '' or key_sync_interval == 0
+
+def restart_key_sync():
+  if not key_sync_running:
+    loopmon.spawn(key_sync())
+
+# Log and publish what the supervisor recovered from
+def supervisor_report(text):
+  print('Supervisor: ' + text)
+  publish_status('Supervisor: ' + text)
+
+# Feed the hardware watchdog, shortening it to wdt_timeout on the first feed unless an OTA update is on trial
+def feed_wdt():
+  global wdt, wdt_shortened
+  if not wdt_shortened:
+    wdt_shortened = True
+    if not ota.in_trial():
+      try:
+        wdt = machine.WDT(timeout = wdt_timeout)
+      except:
+        print('ERROR: Could not change the watchdog timeout')
+  wdt.feed()
+
+wdt_shortened = False
+
+led.clear(led.BOOT)
+led.post(led.STANDBY, np_standby)
+supervisor.spawn('led', led.task)
+supervisor.spawn('access', consumers.access_task, 0, True)
+supervisor.spawn('feedback', consumers.feedback_task)
+supervisor.spawn('report', consumers.report_task)
+supervisor.spawn('metrics', consumers.metrics_task)
+supervisor.spawn('events', consumers.events_task)
+supervisor.spawn('auth', consumers.auth_task)
+supervisor.spawn('clock', clock.task)
+MAIN_LOOP = supervisor.spawn('main_loop', main_loop, main_loop_deadline, True)
+MQTT_WATCH = supervisor.watch('mqtt', mqtt_deadline, restart_mqtt, False, mqtt_idle)
+supervisor.watch('web', web_handler_deadline, drop_web_handlers, False, web_healthy)
+supervisor.watch('wifi', wifi_deadline, restart_wifi, False, wifi_healthy)
+OTA_WATCH = supervisor.watch('ota', ota_deadline, cancel_OTA, False, ota_idle)
+KEY_SYNC_WATCH = supervisor.watch('key_sync', key_sync_interval * 2000, restart_key_sync, False, key_sync_idle)
+supervisor.report = supervisor_report
+loopmon.spawn(supervisor.task(feed_wdt))
 
 # Create task to incrementally ping MQTT broker to maintain connection
 if mqtt_online:
-  uasyncio.create_task(mqtt_ping())
-  uasyncio.create_task(mqtt_heartbeat())
-
-# WebUI routes
-@web_server.route('/')
-def hello(request):
-  return main_html, 200, {'Content-Type': 'text/html'}
-
-@web_server.route('/config_network')
-def config_network(request):
-  resync_config_network_content()
-  return config_network_html, 200, {'Content-Type': 'text/html'}
-
-@web_server.route('/config_network/update')
-def config_network_update(request):
-  # TODO - Updates
-  resync_config_network_content()
-  return config_network_html, 200, {'Content-Type': 'text/html'}
-
-@web_server.route('/config_mqtt')
-def config_mqtt(request):
-  resync_config_mqtt_content()
-  return config_mqtt_html, 200, {'Content-Type': 'text/html'}
-
-@web_server.route('/config_doorbell')
-def config_doorbell(request):
-  resync_config_doorbell_content()
-  return config_doorbell_html, 200, {'Content-Type': 'text/html'}
-
-@web_server.route('/firmware_update')
-def firmware_update(request):
-  resync_firmware_update_content()
-  return firmware_update_html, 200, {'Content-Type': 'text/html'}
-
-@web_server.route('/unlock')
-def unlock_http(request):
-  print('Unlock command recieved from WebUI')
-  unlock(http_dur)
-  if garage_mode:
-    gar_toggle(gar_dur)
-  return main_html, 200, {'Content-Type': 'text/html'}
-
-@web_server.route('/reset')
-def reset_http(request):
-  print('Reset command recieved from WebUI')
-  machine.reset()
-  return main_html, 200, {'Content-Type': 'text/html'}
-
-@web_server.route('/bell')
-async def bell_http(request):
-  global current
-  print('Bell command recieved from WebUI')
-  uasyncio.create_task(ring_bell(current))
-  return main_html, 200, {'Content-Type': 'text/html'}
-
-@web_server.route('/download/<string:filename>', methods=['GET', 'POST'])
-def dl_file(request, filename):
-  return send_file(str('/' + filename), status_code=200)
-
-@web_server.route('/print_keys')
-def print_keys_http(request):
-  print('Print keys command recieved from WebUI')
-  print_keys()
-  return main_html, 200, {'Content-Type': 'text/html'}
-
-@web_server.route('/purge_keys')
-def purge_keys_http(request):
-  print('Purge keys command recieved from WebUI')
-  purge_keys()
-  return main_html, 200, {'Content-Type': 'text/html'}
-
-@web_server.route('/add_mode')
-def web_add_mode(request):
-  print('Add-key-mode command recieved from WebUI')
-  uasyncio.create_task(key_add_mode())
-  return main_html, 200, {'Content-Type': 'text/html'}
-
-@web_server.route('/add_key/<string:key>', methods=['GET', 'POST'])
-def content(request, key):
-  print('Add key command recieved from WebUI ' + key)
-  add_key(key)
-  return main_html, 200, {'Content-Type': 'text/html'}
-
-@web_server.route('/rem_key/<string:key>', methods=['GET', 'POST'])
-def content(request, key):
-  print('Remove key command recieved from WebUI ' + key)
-  rem_key(key)
-  return main_html, 200, {'Content-Type': 'text/html'}
-
-@web_server.route('/ren_key/<string:key>/<string:name>', methods=['GET', 'POST'])
-def content(request, key, name):
-  print('Rename key command recieved from WebUI  to rename ' + key + ' to ' + name)
-  ren_key(key, name)
-  return main_html, 200, {'Content-Type': 'text/html'}
-
-@web_server.route('/set_bell/<string:tone>', methods=['GET', 'POST'])
-def content(request, tone):
-  global Doorbells
-  global current
-  print('Switching doorbell tone to ' + tone)
-  current = Doorbells[tone]
-  CONFIG_DICT['doorbell'] = tone
-  save_config_to_esp()
-  resync_config_doorbell_content()
-  return config_doorbell_html, 200, {'Content-Type': 'text/html'}
-
-@web_server.route('/config_doorbell/test', methods=['GET', 'POST'])
-def content(request):
-  global current
-  doorbell.stop()
-  print('Testing doorbell: ' + current["title"])
-  uasyncio.create_task(ring_bell(current))
-  return config_doorbell_html, 200, {'Content-Type': 'text/html'}
+  start_mqtt_tasks()
+
+# Report the outcome of an OTA update installed or rolled back at boot
+if ota.boot_result == 'installed':
+  publish_status('OTA update installed, on trial')
+elif ota.boot_result == 'rolled_back':
+  publish_status('OTA update rolled back')
+
+# Report a reset the supervisor let the watchdog make
+if supervisor.load() is not None:
+  print('Reset by supervisor: ' + supervisor.reset_cause)
+  publish_status('Reset by supervisor: ' + supervisor.reset_cause)
+
+# Check in with the key sync server, periodically when it is reachable over HTTP
+if key_sync_url != '':
+  loopmon.spawn(key_sync())
+else:
+  request_key_sync()
 
-@web_server.route('/config_doorbell/stop', methods=['GET', 'POST'])
-def content(request):
-  global current
-  doorbell.stop()
-  return config_doorbell_html, 200, {'Content-Type': 'text/html'}
+# Announce initial garage door state
+if garage_mode:
+  publish_garage()
 
-@web_server.route('/execute_update', methods=['GET', 'POST'])
-def execute_update_http(request):
-  print('OTA update command recieved from WebUI')
-  perform_OTA()
-  return main_html, 200, {'Content-Type': 'text/html'}
+# WebUI pages and HTTP API
+routes.install(web_server)
 
 start_server()
\ No newline at end of file
@@ -0,0 +1,81 @@
+#------------------------------------------
+#
+#  DL32 memory instrumentation
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Records heap high/low water marks, overall and around each instrumented
+# subsystem. Usage:
+#   start = memstat.begin()
+#   ... subsystem work ...
+#   memstat.end('subsystem', start)
+
+import gc
+
+# Proactively run gc.collect() when free heap drops below this (bytes, 0 = disabled)
+collect_threshold = 0
+
+# Overall heap water marks
+low_free = gc.mem_free()
+high_alloc = gc.mem_alloc()
+collections = 0
+
+# Per-subsystem stats: name -> [runs, lowest free heap, highest allocated heap, net heap used by last run]
+STATS = {}
+
+# Update overall water marks and collect if free heap crossed the threshold
+def check(free=None, alloc=None):
+  global low_free, high_alloc, collections
+  if free is None:
+    free = gc.mem_free()
+    alloc = gc.mem_alloc()
+  if free < low_free:
+    low_free = free
+  if alloc > high_alloc:
+    high_alloc = alloc
+  if free < collect_threshold:
+    gc.collect()
+    collections += 1
+
+# Mark the start of an instrumented section, returns free heap to pass to end()
+def begin():
+  return gc.mem_free()
+
+# Mark the end of an instrumented section
+def end(name, start_free):
+  free = gc.mem_free()
+  alloc = gc.mem_alloc()
+  stat = STATS.get(name)
+  if stat is None:
+    stat = STATS[name] = [0, free, alloc, 0]
+  stat[0] += 1
+  if free < stat[1]:
+    stat[1] = free
+  if alloc > stat[2]:
+    stat[2] = alloc
+  stat[3] = start_free - free
+  check(free, alloc)
+
+# Reset all water marks to current heap usage
+def reset():
+  global low_free, high_alloc, collections
+  STATS.clear()
+  low_free = gc.mem_free()
+  high_alloc = gc.mem_alloc()
+  collections = 0
+
+# Return stats as a dictionary for JSON serialisation
+def to_dict():
+  subsystems = {}
+  for name in STATS:
+    stat = STATS[name]
+    subsystems[name] = {'runs': stat[0], 'low_free': stat[1], 'high_alloc': stat[2], 'last_used': stat[3]}
+  return {
+    'free': gc.mem_free(),
+    'alloc': gc.mem_alloc(),
+    'low_free': low_free,
+    'high_alloc': high_alloc,
+    'collections': collections,
+    'subsystems': subsystems
+  }
@@ -0,0 +1,25 @@
+#------------------------------------------
+#
+#  DL32 firmware namespace
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# main.py runs as the top-level script, or is imported as the firmware
+# module of a precompiled release, so other modules cannot import it.
+# routes.py and consumers.py, which hold its web routes and bus consumer
+# tasks, instead reach its functions, tunables and state through a
+# Namespace over its globals(), which main.py hands them. A name is looked
+# up each time it is used, so globals main.py assigns again later, such as
+# the current doorbell tune, are seen as they are at that moment.
+
+# Read-only attribute view of a globals() dictionary
+class Namespace:
+  def __init__(self, names):
+    self._names = names
+
+  def __getattr__(self, name):
+    try:
+      return self._names[name]
+    except KeyError:
+      raise AttributeError(name)
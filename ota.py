@@ -0,0 +1,410 @@
+#------------------------------------------
+#
+#  DL32 over-the-air updates
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Staged, verified and reversible firmware updates.
+#
+# The update source is a base URL serving the release files and an
+# ota.json manifest of them:
+#   {"files": {"<path>": {"sha256": "<hex>", "size": <bytes>,
+#                         "chunks": [["<hex>", <bytes>], ...], "keep": true}}}
+# stage() compares each listed file with the installed one and fetches
+# only those whose SHA-256 differs into ota/, resuming partial downloads
+# with HTTP Range requests, then marks them as pending. Files listed with
+# "keep" are only installed when missing. Device data files (DEVICE_FILES:
+# configuration, keys and rules) are never part of a release, so they are
+# neither published nor overwritten by an update. Large files also list
+# their content-defined chunks: the file is cut after a
+# line whose CRC-32 matches CHUNK_MASK, so an edit only changes the chunks
+# around it. Chunks already present in the installed file are copied from
+# it, and only the missing byte ranges are downloaded. On the next boot, boot.py calls
+# boot(), which moves the staged files into place (keeping the replaced
+# ones in ota/backup) and starts a trial. main.py calls feed() from its
+# main loop; once it has been running for grace_dur the update is kept.
+# A trial boot that resets before that, for example through the watchdog
+# started here with grace_dur, is rolled back on the following boot.
+#
+# Downloads go through httpget over uasyncio streams, so the web server and
+# reader keep running during an update. Waiting for the source to answer,
+# and for each chunk of a file, is limited to timeout ms; a stalled
+# download fails and the next attempt resumes it.
+#
+# Build the manifest for a release on the host with: python ota.py
+# This also writes the ota.sha256 list used by releases before the manifest.
+
+import os, json, hashlib, binascii
+
+STAGE_DIR = 'ota'
+BACKUP_DIR = 'ota/backup'
+PENDING_FILE = 'ota/pending'
+TRIAL_FILE = 'ota/trial'
+MANIFEST_FILE = 'ota.json'
+LIST_FILE = 'ota.sha256'
+
+CHUNK_SIZE = 1024
+# Content-defined chunks for delta updates of files of at least DELTA_MIN_SIZE bytes
+DELTA_MIN_SIZE = 8192
+CHUNK_MIN = 256
+CHUNK_MAX = 4096
+CHUNK_MASK = 31
+# Largest manifest fetched (bytes)
+MANIFEST_MAX_SIZE = 65536
+# Milliseconds a new firmware must keep the main loop running before it is kept
+grace_dur = 120000
+# Milliseconds to wait for the update source to answer or send more data, set by main.py
+timeout = 15000
+
+_trial_start = None
+# What boot() did: 'installed', 'rolled_back' or None
+boot_result = None
+# Bytes downloaded by the last stage()
+fetched = 0
+
+def _exists(path):
+  try:
+    os.stat(path)
+    return True
+  except OSError:
+    return False
+
+def _size(path):
+  try:
+    return os.stat(path)[6]
+  except OSError:
+    return 0
+
+def _remove(path):
+  try:
+    os.remove(path)
+  except OSError:
+    pass
+
+# Create the directories leading up to path
+def _makedirs(path):
+  parts = path.split('/')[:-1]
+  for i in range(len(parts)):
+    directory = '/'.join(parts[:i + 1])
+    if not _exists(directory):
+      os.mkdir(directory)
+
+def _read_json(path):
+  with open(path) as json_file:
+    return json.load(json_file)
+
+def _write_json(path, value):
+  with open(path + '.tmp', 'w') as json_file:
+    json.dump(value, json_file)
+  _remove(path)
+  os.rename(path + '.tmp', path)
+
+# Hex SHA-256 of a file
+def file_hash(path):
+  digest = hashlib.sha256()
+  buf = bytearray(CHUNK_SIZE)
+  with open(path, 'rb') as f:
+    while True:
+      n = f.readinto(buf)
+      if not n:
+        break
+      digest.update(buf[:n] if n < CHUNK_SIZE else buf)
+  return binascii.hexlify(digest.digest()).decode()
+
+# Content-defined chunks of a file as a list of (offset, size, hex digest)
+def chunks(path):
+  result = []
+  offset = 0
+  size = 0
+  digest = hashlib.sha256()
+  with open(path, 'rb') as f:
+    while True:
+      line = f.readline(CHUNK_MAX)
+      if line:
+        digest.update(line)
+        size += len(line)
+      if size > 0 and (not line or size >= CHUNK_MAX or (size >= CHUNK_MIN and binascii.crc32(line) & CHUNK_MASK == 0)):
+        result.append((offset, size, binascii.hexlify(digest.digest()).decode()[:16]))
+        offset += size
+        size = 0
+        digest = hashlib.sha256()
+      if not line:
+        return result
+
+def _check_path(path):
+  if path == '' or path.startswith('/') or '..' in path.split('/'):
+    raise ValueError('invalid path ' + path)
+
+# Send a GET request for url, waiting at most timeout ms for the response headers
+async def _request(url, headers=None):
+  import uasyncio, httpget
+  return await uasyncio.wait_for_ms(httpget.request(url, headers), timeout)
+
+# Copy a response body into the open file f, waiting at most timeout ms for each chunk.
+# Yields to the event loop between chunks and calls feed() so the watchdog stays happy.
+async def _receive(url, response, f, feed):
+  global fetched
+  import uasyncio
+  expected = response.headers.get('content-length')
+  expected = None if expected is None else int(expected)
+  received = 0
+  while True:
+    chunk = await uasyncio.wait_for_ms(response.read(CHUNK_SIZE), timeout)
+    if not chunk:
+      break
+    f.write(chunk)
+    received += len(chunk)
+    fetched += len(chunk)
+    if feed is not None:
+      feed()
+    await uasyncio.sleep_ms(0)
+  if expected is not None and received < expected:
+    # Keep what arrived, the next attempt resumes from there
+    raise OSError('download of ' + url + ' interrupted')
+
+# Check the SHA-256 of a finished .part file and move it to path
+def _finish(part, path, digest):
+  if file_hash(part) != digest:
+    _remove(part)
+    raise ValueError('SHA-256 mismatch for ' + path)
+  _remove(path)
+  os.rename(part, path)
+
+# Download url to path, resuming from a previous partial download, and verify its SHA-256
+async def download(url, path, digest, feed=None):
+  if _exists(path) and file_hash(path) == digest:
+    return
+  part = path + '.part'
+  _makedirs(part)
+  offset = _size(part)
+  headers = {}
+  if offset > 0:
+    headers['Range'] = 'bytes=' + str(offset) + '-'
+  response = await _request(url, headers)
+  try:
+    if response.status == 200:
+      with open(part, 'wb') as f:
+        await _receive(url, response, f, feed)
+    elif response.status == 206:
+      with open(part, 'ab') as f:
+        await _receive(url, response, f, feed)
+    elif response.status != 416:
+      raise OSError('HTTP ' + str(response.status) + ' fetching ' + url)
+  finally:
+    await response.close()
+  _finish(part, path, digest)
+
+# Append bytes start to end (exclusive) of url to the open file f
+async def _fetch_range(url, f, start, end, feed):
+  response = await _request(url, {'Range': 'bytes=' + str(start) + '-' + str(end - 1)})
+  try:
+    if response.status != 206:
+      raise OSError('HTTP ' + str(response.status) + ' fetching range of ' + url)
+    await _receive(url, response, f, feed)
+  finally:
+    await response.close()
+
+# Build path from the chunks of manifest entry that base already has, downloading only the others from url.
+# Like download(), an interrupted build resumes from its .part file.
+async def patch(url, path, entry, base, feed=None):
+  import uasyncio
+  if _exists(path) and file_hash(path) == entry['sha256']:
+    return
+  have = {}
+  for offset, size, digest in chunks(base):
+    have[digest] = offset
+  # Runs of [offset in base or None to download, offset in the new file, length]
+  runs = []
+  pos = 0
+  for digest, size in entry['chunks']:
+    source = have.get(digest)
+    if runs and (source is None) == (runs[-1][0] is None) and (source is None or source == runs[-1][0] + runs[-1][2]):
+      runs[-1][2] += size
+    else:
+      runs.append([source, pos, size])
+    pos += size
+  part = path + '.part'
+  _makedirs(part)
+  done = _size(part)
+  if done > pos:
+    _remove(part)
+    done = 0
+  buf = bytearray(CHUNK_SIZE)
+  with open(base, 'rb') as base_file, open(part, 'ab') as f:
+    for source, start, length in runs:
+      skip = done - start
+      if skip >= length:
+        continue
+      if skip < 0:
+        skip = 0
+      if source is None:
+        await _fetch_range(url, f, start + skip, start + length, feed)
+        continue
+      base_file.seek(source + skip)
+      left = length - skip
+      while left > 0:
+        n = base_file.readinto(buf)
+        if not n:
+          break
+        n = min(n, left)
+        f.write(buf[:n] if n < CHUNK_SIZE else buf)
+        left -= n
+      if feed is not None:
+        feed()
+      await uasyncio.sleep_ms(0)
+  _finish(part, path, entry['sha256'])
+
+# Fetch the manifest from base_url, stage and verify every file that differs from the installed one
+# and mark them pending. Returns the list of staged paths, empty when already up to date.
+async def stage(base_url, feed=None):
+  global fetched
+  import uasyncio, httpget
+  fetched = 0
+  _remove(PENDING_FILE)
+  status, body = await uasyncio.wait_for_ms(httpget.get(base_url + MANIFEST_FILE, MANIFEST_MAX_SIZE), timeout)
+  if status != 200:
+    raise OSError('HTTP ' + str(status) + ' fetching ' + MANIFEST_FILE)
+  files = json.loads(body)['files']
+  names = []
+  for name in files:
+    _check_path(name)
+    entry = files[name]
+    if _exists(name) and (entry.get('keep') or file_hash(name) == entry['sha256']):
+      continue
+    if 'chunks' in entry and _exists(name):
+      await patch(base_url + name, STAGE_DIR + '/' + name, entry, name, feed)
+    else:
+      await download(base_url + name, STAGE_DIR + '/' + name, entry['sha256'], feed)
+    names.append(name)
+  if names:
+    _write_json(PENDING_FILE, names)
+  return names
+
+# Compiled templates are rebuilt from source after templates change, unless the update brought them as .mpy
+def _drop_compiled_templates(names):
+  changed = [name for name in names if name.startswith('templates/')]
+  if not changed:
+    return
+  shipped = [name for name in changed if name.endswith('.mpy')]
+  for filename in os.listdir('templates'):
+    if filename.startswith('__init__.'):
+      continue
+    if filename.endswith('.py') or (filename.endswith('.mpy') and not shipped):
+      _remove('templates/' + filename)
+
+def _move(source, target):
+  _makedirs(target)
+  _remove(target)
+  os.rename(source, target)
+
+# Move pending staged files into place, backing up the files they replace
+def install():
+  names = _read_json(PENDING_FILE)
+  files = list(names)
+  for name in names:
+    staged = STAGE_DIR + '/' + name
+    if not _exists(staged):
+      # Already moved by an install that was interrupted
+      continue
+    if _exists(name):
+      _move(name, BACKUP_DIR + '/' + name)
+    _makedirs(name)
+    os.rename(staged, name)
+  # Source modules would shadow the bytecode replacing them, set them aside with the backups
+  for name in names:
+    shadow = name[:-4] + '.py'
+    if name.endswith('.mpy') and shadow not in names and (_exists(shadow) or _exists(BACKUP_DIR + '/' + shadow)):
+      if _exists(shadow):
+        _move(shadow, BACKUP_DIR + '/' + shadow)
+      files.append(shadow)
+  _drop_compiled_templates(names)
+  _write_json(TRIAL_FILE, {'boots': 0, 'files': files})
+  _remove(PENDING_FILE)
+
+# Put back the files replaced by the update on trial
+def rollback():
+  trial = _read_json(TRIAL_FILE)
+  for name in trial['files']:
+    backup = BACKUP_DIR + '/' + name
+    _remove(name)
+    if _exists(backup):
+      os.rename(backup, name)
+  _drop_compiled_templates(trial['files'])
+  _remove(TRIAL_FILE)
+
+# Keep the update on trial and drop the backups
+def confirm():
+  trial = _read_json(TRIAL_FILE)
+  for name in trial['files']:
+    _remove(BACKUP_DIR + '/' + name)
+  _remove(TRIAL_FILE)
+
+def in_trial():
+  return _exists(TRIAL_FILE)
+
+# Called from boot.py: install a pending update, or roll back a trial that never confirmed
+def boot():
+  global boot_result
+  import machine
+  if _exists(PENDING_FILE):
+    print('OTA: installing staged update')
+    install()
+    boot_result = 'installed'
+  if _exists(TRIAL_FILE):
+    trial = _read_json(TRIAL_FILE)
+    if trial['boots'] > 0:
+      print('OTA: update did not start cleanly, rolling back')
+      rollback()
+      boot_result = 'rolled_back'
+      return
+    trial['boots'] += 1
+    _write_json(TRIAL_FILE, trial)
+    machine.WDT(timeout = grace_dur)
+
+# Called every main loop iteration, confirms an update on trial once it has run for grace_dur.
+# Returns True when the update was confirmed by this call
+def feed(now):
+  global _trial_start
+  import time
+  if _trial_start is None:
+    if not in_trial():
+      _trial_start = False
+      return False
+    _trial_start = now
+  if _trial_start is False or time.ticks_diff(now, _trial_start) < grace_dur:
+    return False
+  confirm()
+  _trial_start = False
+  return True
+
+# Files holding one device's data and secrets (WiFi and MQTT passwords, keys, rules), never part of a release
+DEVICE_FILES = ('dl32.cfg', 'keys.cfg', 'keys.csv', 'keys.rev', 'rules.cfg', 'webrepl_cfg.py', 'supervisor.log')
+
+# Files of a release: firmware modules (source or .mpy) and templates, but not device data files
+# or modules generated from templates on the device
+def release_files():
+  files = [name for name in os.listdir('.') if (name.endswith('.py') or name.endswith('.mpy')) and name not in DEVICE_FILES]
+  for name in os.listdir('templates'):
+    if not name.endswith('.py') or name == '__init__.py':
+      files.append('templates/' + name)
+  return sorted(files)
+
+# Manifest of the release files in the current directory
+def manifest():
+  files = {}
+  for name in release_files():
+    entry = {'sha256': file_hash(name), 'size': _size(name)}
+    if entry['size'] >= DELTA_MIN_SIZE:
+      entry['chunks'] = [[digest, size] for offset, size, digest in chunks(name)]
+    files[name] = entry
+  return {'files': files}
+
+if __name__ == '__main__':
+  release = manifest()
+  _write_json(MANIFEST_FILE, release)
+  with open(LIST_FILE, 'w') as list_file:
+    for name in release['files']:
+      if not release['files'][name].get('keep'):
+        list_file.write(release['files'][name]['sha256'] + '  ' + name + '\n')
+  print('Wrote ' + MANIFEST_FILE + ' and ' + LIST_FILE)
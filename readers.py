@@ -0,0 +1,74 @@
+#------------------------------------------
+#
+#  DL32 Wiegand readers
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Several Wiegand readers on one board, all checked against the same keys
+# and access rules. Reader 0 is the board's own reader. Each reader decodes
+# its own pin pair, so frames from different readers arrive independently,
+# and every event it causes carries its reader number.
+#
+# A reader without a relay of its own opens the main door: the lock relay
+# and door sensor handled by door.py, as with an entry and an exit reader
+# on one door. A reader with its own relay opens a second door that has no
+# sensor: its relay is energized for the unlock duration and then released
+# by poll(). Its optional LED pin, such as the reader's LED control line,
+# is driven high while that door is unlocked.
+
+import time
+
+_relays = []
+_leds = []
+_until = []
+_energized = []
+scans = []
+
+# Register a reader with its relay and LED pins (None for the main door or no LED), returns its number
+def add(relay=None, led=None):
+  _relays.append(relay)
+  _leds.append(led)
+  _until.append(0)
+  _energized.append(False)
+  scans.append(0)
+  if relay is not None:
+    relay.value(0)
+  if led is not None:
+    led.value(0)
+  return len(_relays) - 1
+
+def count():
+  return len(_relays)
+
+# True if the reader opens the main door
+def main_door(reader):
+  return _relays[reader] is None
+
+def scanned(reader):
+  scans[reader] += 1
+
+# Energize the relay of a reader with its own door for dur ms
+def unlock(reader, dur, now):
+  _relays[reader].value(1)
+  if _leds[reader] is not None:
+    _leds[reader].value(1)
+  _until[reader] = time.ticks_add(now, dur)
+  _energized[reader] = True
+
+def relock(reader):
+  _relays[reader].value(0)
+  if _leds[reader] is not None:
+    _leds[reader].value(0)
+  _energized[reader] = False
+
+# Bit mask of readers whose door relay has been energized for its duration
+def poll(now):
+  expired = 0
+  for reader in range(len(_relays)):
+    if _energized[reader] and time.ticks_diff(now, _until[reader]) >= 0:
+      expired |= 1 << reader
+  return expired
+
+def to_dict():
+  return [{'door': 'main' if _relays[reader] is None else 'own', 'relay': _energized[reader], 'scans': scans[reader]} for reader in range(len(_relays))]
@@ -0,0 +1,104 @@
+#------------------------------------------
+#
+#  DL32 remote authorization
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Asks a central service about keys that are not in the local key list, so
+# a site does not have to push its whole directory to every door. A lookup
+# is an HTTP request with the key and reader number:
+#   GET <url>?key=12345&reader=0
+# 200 grants access, optionally naming the key holder with a JSON body
+# such as {"name": "alice"}; 403 or 404 denies it. Any other answer, or no
+# complete answer within timeout ms, is a failure and the key is refused.
+#
+# Answers are kept in a least recently used cache of size entries: grants
+# for grant_ttl ms and denials for deny_ttl ms, so repeat scans are decided
+# locally without waiting on the network. Failures are not cached.
+
+from collections import OrderedDict
+import json, time, uasyncio, httpget
+
+# Tunables, set by main.py
+url = ''
+timeout = 1500
+grant_ttl = 600000
+deny_ttl = 60000
+size = 64
+
+# key -> (holder name, or None if denied, expiry in ticks_ms)
+_cache = OrderedDict()
+
+hits = 0
+misses = 0
+lookups = 0
+answers = 0
+failures = 0
+lookup_ms = 0
+lookup_max_ms = 0
+
+# Cached answer for key: True if granted, False if denied, None if unknown or expired
+def cached(key, now):
+  global hits, misses
+  entry = _cache.get(key)
+  if entry is not None and time.ticks_diff(entry[1], now) <= 0:
+    del _cache[key]
+    entry = None
+  if entry is None:
+    misses += 1
+    return None
+  hits += 1
+  # Move to the most recently used end
+  del _cache[key]
+  _cache[key] = entry
+  return entry[0] is not None
+
+# Holder name of a cached grant, or '' if there is none
+def name(key):
+  entry = _cache.get(key)
+  if entry is None or entry[0] is None:
+    return ''
+  return entry[0]
+
+def store(key, holder, now):
+  if key in _cache:
+    del _cache[key]
+  while len(_cache) >= size:
+    del _cache[next(iter(_cache))]
+  _cache[key] = (holder, time.ticks_add(now, deny_ttl if holder is None else grant_ttl))
+
+def clear():
+  _cache.clear()
+
+# Ask the service about a key and cache its answer: True if granted, False if denied, None on failure
+async def lookup(key, reader=0):
+  global lookups, answers, failures, lookup_ms, lookup_max_ms
+  lookups += 1
+  start = time.ticks_ms()
+  try:
+    status, body = await uasyncio.wait_for_ms(httpget.get(url + ('&' if '?' in url else '?') + 'key=' + key + '&reader=' + str(reader)), timeout)
+  except Exception:
+    failures += 1
+    return None
+  elapsed = time.ticks_diff(time.ticks_ms(), start)
+  answers += 1
+  lookup_ms += elapsed
+  if elapsed > lookup_max_ms:
+    lookup_max_ms = elapsed
+  if status == 200:
+    holder = ''
+    try:
+      holder = str(json.loads(body)['name'])
+    except Exception:
+      pass
+    store(key, holder, time.ticks_ms())
+    return True
+  if status == 403 or status == 404:
+    store(key, None, time.ticks_ms())
+    return False
+  failures += 1
+  return None
+
+def to_dict():
+  return {'cached': len(_cache), 'hits': hits, 'misses': misses, 'lookups': lookups, 'failures': failures, 'lookup_avg_ms': lookup_ms // answers if answers else 0, 'lookup_max_ms': lookup_max_ms}
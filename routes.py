@@ -0,0 +1,274 @@
+#------------------------------------------
+#
+#  DL32 WebUI routes
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# WebUI pages and the HTTP API: configuration, access rules, metrics, live
+# events, file transfer and key management. main.py calls install() with
+# its web server once it has set dl32, the namespace.Namespace over its
+# globals through which the handlers reach the firmware's functions and
+# state.
+
+import json, os, machine, bus, clock, config, consumers, events, files, garage, loopmon, rules
+
+# Firmware namespace, set by main.py
+dl32 = None
+
+# Apply the given fields of a configuration form and show the page again
+def config_form(request, page, names):
+  fields = request.form if request.method == 'POST' else request.args
+  changes = {}
+  for name in names:
+    if fields is not None and name in fields:
+      changes[name] = fields[name]
+  errors = dl32.update_config(changes)
+  if errors:
+    return 'Invalid ' + ', '.join(errors), 400
+  return dl32.get_page(page), 200, {'Content-Type': 'text/html'}
+
+# Register the WebUI pages and HTTP API on web_server
+def install(web_server):
+  @web_server.route('/')
+  def hello(request):
+    return dl32.get_page('main'), 200, {'Content-Type': 'text/html'}
+
+  @web_server.route('/config_network')
+  def config_network(request):
+    return dl32.get_page('config_network'), 200, {'Content-Type': 'text/html'}
+
+  @web_server.route('/config_network/update', methods=['GET', 'POST'])
+  def config_network_update(request):
+    return config_form(request, 'config_network', ('wifi_ssid', 'wifi_pass', 'web_port'))
+
+  @web_server.route('/config_mqtt/update', methods=['GET', 'POST'])
+  def config_mqtt_update(request):
+    return config_form(request, 'config_mqtt', ('mqtt_brok', 'mqtt_port', 'mqtt_clid', 'mqtt_user', 'mqtt_pass', 'mqtt_sta_top', 'mqtt_cmd_top'))
+
+  @web_server.route('/api/config')
+  def config_http(request):
+    return config.to_dict()
+
+  @web_server.route('/api/config', methods=['POST'])
+  def config_update_http(request):
+    if not isinstance(request.json, dict):
+      return {'error': 'invalid configuration'}, 400
+    errors = dl32.update_config(request.json)
+    if errors:
+      return {'error': 'invalid configuration', 'fields': errors}, 400
+    return config.to_dict()
+
+  @web_server.route('/config_mqtt')
+  def config_mqtt(request):
+    return dl32.get_page('config_mqtt'), 200, {'Content-Type': 'text/html'}
+
+  @web_server.route('/config_doorbell')
+  def config_doorbell(request):
+    return dl32.get_page('config_doorbell'), 200, {'Content-Type': 'text/html'}
+
+  @web_server.route('/firmware_update')
+  def firmware_update(request):
+    return dl32.get_page('firmware_update'), 200, {'Content-Type': 'text/html'}
+
+  @web_server.route('/unlock')
+  def unlock_http(request):
+    print('Unlock command recieved from WebUI')
+    bus.emit(bus.UNLOCK, None, bus.SRC_HTTP)
+    return dl32.get_page('main'), 200, {'Content-Type': 'text/html'}
+
+  @web_server.route('/reset')
+  def reset_http(request):
+    print('Reset command recieved from WebUI')
+    machine.reset()
+    return dl32.get_page('main'), 200, {'Content-Type': 'text/html'}
+
+  @web_server.route('/bell')
+  async def bell_http(request):
+    print('Bell command recieved from WebUI')
+    loopmon.spawn(dl32.ring_bell(dl32.current))
+    return dl32.get_page('main'), 200, {'Content-Type': 'text/html'}
+
+  @web_server.route('/metrics')
+  def prometheus_http(request):
+    return dl32.prometheus_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+  @web_server.route('/api/metrics')
+  def metrics_http(request):
+    return dl32.get_metrics()
+
+  @web_server.route('/events')
+  def events_http(request):
+    stream = events.connect()
+    if stream is None:
+      return 'Too many event stream clients', 503
+    stream.push(events.message('door', consumers.door_json(clock.now())))
+    return stream, 200, {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'}
+
+  @web_server.route('/api/garage')
+  def garage_http(request):
+    return garage.to_dict()
+
+  @web_server.route('/api/rules')
+  def rules_http(request):
+    return rules.RULES
+
+  @web_server.route('/api/rules', methods=['POST'])
+  def rules_replace_http(request):
+    try:
+      rules.compile(request.json)
+    except:
+      return {'error': 'invalid rules'}, 400
+    dl32.save_rules_to_esp()
+    dl32.publish_status('Access rules replaced')
+    return rules.RULES
+
+  @web_server.route('/api/rules/group/<string:name>', methods=['POST'])
+  def rules_group_http(request, name):
+    try:
+      rules.set_group(name, request.json)
+    except:
+      return {'error': 'invalid group'}, 400
+    dl32.save_rules_to_esp()
+    dl32.publish_status('Access group ' + name + ' updated')
+    return rules.RULES
+
+  @web_server.route('/api/rules/group/<string:name>', methods=['DELETE'])
+  def rules_group_delete_http(request, name):
+    try:
+      rules.remove_group(name)
+    except:
+      return {'error': 'unknown group or group in use'}, 400
+    dl32.save_rules_to_esp()
+    dl32.publish_status('Access group ' + name + ' removed')
+    return rules.RULES
+
+  @web_server.route('/api/rules/key/<string:key>', methods=['POST'])
+  def rules_key_http(request, key):
+    if key not in dl32.KEYS_DICT:
+      return {'error': 'unknown key'}, 404
+    try:
+      rules.set_key(key, request.json)
+    except:
+      return {'error': 'invalid key rule'}, 400
+    dl32.save_rules_to_esp()
+    dl32.publish_status('Access rule for key ' + key + ' updated')
+    return rules.RULES
+
+  @web_server.route('/api/rules/key/<string:key>', methods=['DELETE'])
+  def rules_key_delete_http(request, key):
+    rules.remove_key(key)
+    dl32.save_rules_to_esp()
+    dl32.publish_status('Access rule for key ' + key + ' removed')
+    return rules.RULES
+
+  @web_server.route('/download/<path:path>', methods=['GET', 'POST'])
+  @web_server.route('/files/<path:path>')
+  def dl_file(request, path):
+    return files.download(request, path) or ('Not found', 404)
+
+  @web_server.route('/files/<path:path>', methods=['PUT', 'POST'])
+  async def upload_file_http(request, path):
+    path = files.clean(path)
+    if path is None or not files.uploadable(path):
+      return {'error': 'file cannot be uploaded'}, 403
+    if not request.content_length:
+      return {'error': 'Content-Length required'}, 411
+    # dl32.cfg is only replaced through update_config(), once its changes are valid
+    size = await files.upload(request, path, path != '/dl32.cfg')
+    if size is None:
+      return {'error': 'upload incomplete'}, 400
+    if path == '/dl32.cfg':
+      try:
+        with open(path + '.part') as json_file:
+          changes = json.load(json_file)
+        errors = dl32.update_config(changes) if isinstance(changes, dict) else {'dl32.cfg': 'invalid'}
+      except:
+        errors = {'dl32.cfg': 'invalid'}
+      os.remove(path + '.part')
+      if errors:
+        return {'path': path, 'size': size, 'error': 'configuration not applied', 'fields': errors}, 400
+    print('File ' + path + ' uploaded from WebUI (' + str(size) + ' bytes)')
+    dl32.publish_status('File ' + path + ' uploaded')
+    if path == '/' + dl32.keys_file:
+      dl32.load_esp_keys()
+      dl32.invalidate_pages(dl32.DEP_KEYS)
+    elif path == '/rules.cfg':
+      dl32.load_esp_rules()
+    return {'path': path, 'size': size}
+
+  @web_server.route('/api/files')
+  def list_files_http(request):
+    path = files.clean(request.args.get('path', '/'))
+    try:
+      start = int(request.args.get('start', 0))
+      count = min(int(request.args.get('count', 20)), 50)
+    except ValueError:
+      return {'error': 'invalid start or count'}, 400
+    if path is None:
+      return {'error': 'invalid path'}, 400
+    try:
+      entries, next_start = files.listing(path, start, count)
+    except OSError:
+      return {'error': 'no such directory'}, 404
+    return {'path': path, 'entries': entries, 'next': next_start}
+
+  @web_server.route('/print_keys')
+  def print_keys_http(request):
+    print('Print keys command recieved from WebUI')
+    dl32.print_keys()
+    return dl32.get_page('main'), 200, {'Content-Type': 'text/html'}
+
+  @web_server.route('/purge_keys')
+  def purge_keys_http(request):
+    print('Purge keys command recieved from WebUI')
+    dl32.purge_keys()
+    return dl32.get_page('main'), 200, {'Content-Type': 'text/html'}
+
+  @web_server.route('/add_mode')
+  def web_add_mode(request):
+    print('Add-key-mode command recieved from WebUI')
+    loopmon.spawn(dl32.key_add_mode())
+    return dl32.get_page('main'), 200, {'Content-Type': 'text/html'}
+
+  @web_server.route('/add_key/<string:key>', methods=['GET', 'POST'])
+  def content(request, key):
+    print('Add key command recieved from WebUI ' + key)
+    dl32.add_key(key)
+    return dl32.get_page('main'), 200, {'Content-Type': 'text/html'}
+
+  @web_server.route('/rem_key/<string:key>', methods=['GET', 'POST'])
+  def content(request, key):
+    print('Remove key command recieved from WebUI ' + key)
+    dl32.rem_key(key)
+    return dl32.get_page('main'), 200, {'Content-Type': 'text/html'}
+
+  @web_server.route('/ren_key/<string:key>/<string:name>', methods=['GET', 'POST'])
+  def content(request, key, name):
+    print('Rename key command recieved from WebUI  to rename ' + key + ' to ' + name)
+    dl32.ren_key(key, name)
+    return dl32.get_page('main'), 200, {'Content-Type': 'text/html'}
+
+  @web_server.route('/set_bell/<string:tone>', methods=['GET', 'POST'])
+  def content(request, tone):
+    print('Switching doorbell tone to ' + tone)
+    dl32.update_config({'doorbell': tone})
+    return dl32.get_page('config_doorbell'), 200, {'Content-Type': 'text/html'}
+
+  @web_server.route('/config_doorbell/test', methods=['GET', 'POST'])
+  def content(request):
+    dl32.doorbell.stop()
+    print('Testing doorbell: ' + dl32.current["title"])
+    loopmon.spawn(dl32.ring_bell(dl32.current))
+    return dl32.get_page('config_doorbell'), 200, {'Content-Type': 'text/html'}
+
+  @web_server.route('/config_doorbell/stop', methods=['GET', 'POST'])
+  def content(request):
+    dl32.doorbell.stop()
+    return dl32.get_page('config_doorbell'), 200, {'Content-Type': 'text/html'}
+
+  @web_server.route('/execute_update', methods=['GET', 'POST'])
+  def execute_update_http(request):
+    print('OTA update command recieved from WebUI')
+    dl32.start_OTA()
+    return dl32.get_page('main'), 200, {'Content-Type': 'text/html'}
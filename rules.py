@@ -0,0 +1,161 @@
+#------------------------------------------
+#
+#  DL32 access rules
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Per-badge schedules, groups and expiry dates. Rules are kept in the JSON
+# form they are stored and edited in:
+#   {"groups": {"staff": [{"days": 31, "start": "08:00", "end": "18:00"}]},
+#    "keys": {"12345": {"group": "staff", "expires": "2025-12-31"}}}
+# days is a weekday bitmask (bit 0 = Monday ... bit 6 = Sunday), windows
+# with end before start run past midnight into the next day. Keys without
+# an entry, or with no group, have access at all times.
+#
+# compile() turns each group into a bitmap with one bit per SLOT_MINS slot
+# of the week, so checking a scan is a dict lookup and a bit test. Window
+# edges between slot boundaries are rounded inward, so a window never
+# grants access outside its times.
+
+from micropython import const
+
+SLOT_MINS = const(5)
+DAY_SLOTS = const(288) # 24 * 60 // SLOT_MINS
+WEEK_SLOTS = const(2016) # 7 * DAY_SLOTS
+
+# check() results
+ALLOW = const(0)
+DENY_SCHEDULE = const(1)
+DENY_EXPIRED = const(2)
+
+# Rules as stored in rules.cfg
+RULES = {'groups': {}, 'keys': {}}
+
+# Compiled rules: group name -> week bitmap, key -> (group bitmap or None, expiry as YYYYMMDD or 0)
+GROUP_MAPS = {}
+KEY_RULES = {}
+
+# Minutes since midnight of a 'HH:MM' string, '24:00' being the end of the day
+def parse_time(text):
+  hh, mm = text.split(':')
+  hh = int(hh)
+  mm = int(mm)
+  if hh < 0 or hh > 24 or mm < 0 or mm > 59 or (hh == 24 and mm):
+    raise ValueError('time out of range: ' + text)
+  return hh * 60 + mm
+
+# Days in each month of a non-leap year
+_MONTH_DAYS = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+# YYYYMMDD integer of a 'YYYY-MM-DD' string, 0 for none
+def parse_date(text):
+  if not text:
+    return 0
+  y, m, d = text.split('-')
+  y = int(y)
+  m = int(m)
+  d = int(d)
+  if y < 2000 or y > 9999 or m < 1 or m > 12 or d < 1:
+    raise ValueError('date out of range: ' + text)
+  leap = y % 4 == 0 and (y % 100 != 0 or y % 400 == 0)
+  if d > _MONTH_DAYS[m - 1] + (1 if m == 2 and leap else 0):
+    raise ValueError('date out of range: ' + text)
+  return y * 10000 + m * 100 + d
+
+# Set bits for the slots wholly within minutes [start, end) of a day in a week bitmap
+def _fill(bitmap, day, start, end):
+  slot = day * DAY_SLOTS + (start + SLOT_MINS - 1) // SLOT_MINS
+  last = day * DAY_SLOTS + end // SLOT_MINS
+  while slot < last:
+    bitmap[slot >> 3] |= 1 << (slot & 7)
+    slot += 1
+
+# Build the week bitmap of a list of windows
+def compile_group(windows):
+  bitmap = bytearray(WEEK_SLOTS // 8)
+  for window in windows:
+    days = window.get('days', 0x7F)
+    start = parse_time(window.get('start', '00:00'))
+    end = parse_time(window.get('end', '24:00'))
+    for day in range(7):
+      if not days & (1 << day):
+        continue
+      if start < end:
+        _fill(bitmap, day, start, end)
+      else:
+        _fill(bitmap, day, start, 1440)
+        _fill(bitmap, (day + 1) % 7, 0, end)
+  return bitmap
+
+# Compile rules into GROUP_MAPS and KEY_RULES, raising ValueError/KeyError on invalid rules
+def compile(rules):
+  global RULES, GROUP_MAPS, KEY_RULES
+  groups = {}
+  for name in rules.get('groups', {}):
+    groups[name] = compile_group(rules['groups'][name])
+  keys = {}
+  for key in rules.get('keys', {}):
+    rule = rules['keys'][key]
+    group = rule.get('group')
+    if group is not None and group not in groups:
+      raise KeyError('unknown group: ' + group)
+    keys[key] = (groups[group] if group is not None else None, parse_date(rule.get('expires')))
+  RULES = {'groups': rules.get('groups', {}), 'keys': rules.get('keys', {})}
+  GROUP_MAPS = groups
+  KEY_RULES = keys
+
+# Check whether key may unlock at the given time.localtime() tuple
+def check(key, now):
+  rule = KEY_RULES.get(key)
+  if rule is None:
+    return ALLOW
+  bitmap, expires = rule
+  if expires and now[0] * 10000 + now[1] * 100 + now[2] > expires:
+    return DENY_EXPIRED
+  if bitmap is None:
+    return ALLOW
+  slot = now[6] * DAY_SLOTS + (now[3] * 60 + now[4]) // SLOT_MINS
+  if bitmap[slot >> 3] & (1 << (slot & 7)):
+    return ALLOW
+  return DENY_SCHEDULE
+
+# Add or replace a group, recompiling all rules
+def set_group(name, windows):
+  groups = dict(RULES['groups'])
+  groups[name] = windows
+  compile({'groups': groups, 'keys': RULES['keys']})
+
+# Remove a group, failing if any key is still assigned to it
+def remove_group(name):
+  groups = dict(RULES['groups'])
+  del groups[name]
+  compile({'groups': groups, 'keys': RULES['keys']})
+
+# Assign a key to a group and/or expiry date
+def set_key(key, rule):
+  keys = dict(RULES['keys'])
+  keys[key] = rule
+  compile({'groups': RULES['groups'], 'keys': keys})
+
+# Remove the rule for a key, giving it unrestricted access
+def remove_key(key):
+  if key in RULES['keys']:
+    keys = dict(RULES['keys'])
+    del keys[key]
+    compile({'groups': RULES['groups'], 'keys': keys})
+
+# Remove the rules of keys missing from present, returns True if any were removed
+def keep_keys(present):
+  keys = {}
+  for key in RULES['keys']:
+    if key in present:
+      keys[key] = RULES['keys'][key]
+  if len(keys) == len(RULES['keys']):
+    return False
+  compile({'groups': RULES['groups'], 'keys': keys})
+  return True
+
+# Remove all key rules, keeping groups
+def clear_keys():
+  compile({'groups': RULES['groups'], 'keys': {}})
@@ -0,0 +1,15 @@
+#------------------------------------------
+#
+#  DL32 host simulator
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Runs the unmodified firmware on Linux with CPython stand-ins for the
+# MicroPython and board modules (machine, neopixel, sdcard, network, esp,
+# umqtt.simple, wiegand, buzzer_music, uasyncio). See sim/device.py.
+#
+#   from sim.device import Device, EXIT_BUTTON, LOCK_RELAY
+#   with Device(keys={'1234': 'Alice'}) as dl32:
+#     dl32.swipe(1234)
+#     dl32.wait_event('pin', LOCK_RELAY, 1)
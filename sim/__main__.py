@@ -0,0 +1,34 @@
+#------------------------------------------
+#
+#  DL32 host simulator - command line entry point
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# python -m sim [--port 8080] [--sd DIR] [--keys FILE] [--verbose]
+
+import argparse, json, time
+
+from sim.device import Device
+
+parser = argparse.ArgumentParser(description='Run DL32 firmware on the host')
+parser.add_argument('--port', type=int, default=8080, help='web server port')
+parser.add_argument('--sd', help='directory to present as the SD card')
+parser.add_argument('--keys', help='JSON keys file to load into flash')
+parser.add_argument('--verbose', action='store_true', help='show firmware output')
+args = parser.parse_args()
+
+keys = None
+if args.keys:
+  with open(args.keys) as keys_file:
+    keys = json.load(keys_file)
+
+device = Device(sd=args.sd, keys=keys, web_port=args.port, quiet=not args.verbose)
+device.boot()
+print('DL32 simulator running at ' + device.url + ' (Ctrl-C to stop)')
+try:
+  while not device._stopped.is_set():
+    time.sleep(0.5)
+except KeyboardInterrupt:
+  pass
+device.stop()
@@ -0,0 +1,116 @@
+#------------------------------------------
+#
+#  DL32 host simulator - virtual board state
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Shared state of the simulated board: virtual pins, the event log and the
+# device event loop that timers, IRQs and scripted timelines run on.
+
+import asyncio, threading, time
+
+_T0 = time.monotonic_ns()
+
+# Firmware event loop, set once uasyncio.run() starts it
+loop = None
+# Set by machine.reset()
+reset_requested = False
+_loop_ready = threading.Event()
+_on_loop_start = []
+
+# Pin number -> machine.Pin
+pins = {}
+
+# (ms since simulator start as float, kind, subject, value) tuples for everything observable on the board
+events = []
+_listeners = []
+
+class Reset(BaseException):
+  pass
+
+# Milliseconds since simulator start
+def now_ms():
+  return (time.monotonic_ns() - _T0) // 1000000
+
+# Microseconds since simulator start
+def now_us():
+  return (time.monotonic_ns() - _T0) // 1000
+
+# Forget all board state ahead of a new boot
+def reset_state():
+  global loop, reset_requested
+  loop = None
+  reset_requested = False
+  _loop_ready.clear()
+  del _on_loop_start[:]
+  pins.clear()
+  del events[:]
+  del _listeners[:]
+
+# Append to the event log and notify listeners
+def log(kind, subject, value=None):
+  event = (now_us() / 1000, kind, subject, value)
+  events.append(event)
+  for listener in list(_listeners):
+    listener(event)
+
+# Call listener(event) for every future event
+def listen(listener):
+  _listeners.append(listener)
+
+def unlisten(listener):
+  if listener in _listeners:
+    _listeners.remove(listener)
+
+# Called by the uasyncio shim once the firmware event loop is running
+def loop_started(running_loop):
+  global loop
+  loop = running_loop
+  loop.set_exception_handler(_exception_handler)
+  for fn in _on_loop_start:
+    fn()
+  del _on_loop_start[:]
+  _loop_ready.set()
+
+# Errors raised while the loop unwinds after machine.reset() are expected, as are
+# web connections still open when the loop stops, which CPython 3.11 logs once cancelled
+def _exception_handler(running_loop, context):
+  if reset_requested or isinstance(context.get('exception'), asyncio.CancelledError):
+    return
+  running_loop.default_exception_handler(context)
+
+# Wait for the firmware event loop to start
+def wait_loop(timeout=None):
+  return _loop_ready.wait(timeout)
+
+# Run fn on the firmware event loop, deferring until it starts if needed
+def on_loop(fn):
+  if loop is None:
+    _on_loop_start.append(fn)
+  else:
+    fn()
+
+# Schedule fn(*args) on the firmware event loop from any thread after delay_ms
+def at(delay_ms, fn, *args):
+  def schedule():
+    loop.call_later(delay_ms / 1000, fn, *args)
+  if loop is None:
+    _on_loop_start.append(schedule)
+  else:
+    loop.call_soon_threadsafe(schedule)
+
+# Play a timeline of (ms offset, pin number, value) steps on input pins
+def script(steps):
+  def schedule():
+    start = loop.time()
+    for delay_ms, pin_id, value in steps:
+      loop.call_at(start + delay_ms / 1000, drive, pin_id, value)
+  if loop is None:
+    _on_loop_start.append(schedule)
+  else:
+    loop.call_soon_threadsafe(schedule)
+
+# Externally drive an input pin to a level, firing any matching IRQ
+def drive(pin_id, value):
+  pins[pin_id]._drive(value)
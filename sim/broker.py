@@ -0,0 +1,114 @@
+#------------------------------------------
+#
+#  DL32 host simulator - loopback MQTT broker
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# In-process broker the simulated umqtt client connects to. Tests publish
+# commands with publish() and read what the firmware sent from messages.
+
+import collections, threading, time
+
+# (server, port) -> Broker
+BROKERS = {}
+
+# Broker registered for a server address and port, or None
+def find(server, port):
+  return BROKERS.get((server, int(port)))
+
+# Whether an MQTT topic filter matches a topic
+def matches(pattern, topic):
+  pattern_parts = pattern.split('/')
+  topic_parts = topic.split('/')
+  for i in range(len(pattern_parts)):
+    if pattern_parts[i] == '#':
+      return True
+    if i >= len(topic_parts) or (pattern_parts[i] != '+' and pattern_parts[i] != topic_parts[i]):
+      return False
+  return len(pattern_parts) == len(topic_parts)
+
+class Broker:
+  def __init__(self, server='127.0.0.1', port=1883):
+    self.address = (server, int(port))
+    self.online = True
+    self.clients = {}
+    self.retained = {}
+    # (topic filter, fn(topic, payload)) for in-process subscribers such as sim.keyserver
+    self.handlers = []
+    # (time.monotonic(), topic, payload) of every message published through the broker
+    self.messages = []
+    self._cond = threading.Condition()
+    BROKERS[self.address] = self
+
+  def close(self):
+    if BROKERS.get(self.address) is self:
+      del BROKERS[self.address]
+
+  def attach(self, client, clean_session=True):
+    with self._cond:
+      entry = self.clients.get(client)
+      if entry is None or clean_session:
+        entry = self.clients[client] = (collections.deque(), [])
+      return entry[0]
+
+  def detach(self, client):
+    with self._cond:
+      self.clients.pop(client, None)
+
+  def subscribe(self, client, topic):
+    topic = _str(topic)
+    with self._cond:
+      queue, topics = self.clients[client]
+      topics.append(topic)
+      for retained_topic in self.retained:
+        if matches(topic, retained_topic):
+          queue.append((retained_topic.encode(), self.retained[retained_topic]))
+
+  def publish(self, topic, msg, retain=False, sender=None):
+    topic = _str(topic)
+    if isinstance(msg, str):
+      msg = msg.encode()
+    with self._cond:
+      self.messages.append((time.monotonic(), topic, msg))
+      if retain:
+        self.retained[topic] = msg
+      for client in self.clients:
+        queue, topics = self.clients[client]
+        for pattern in topics:
+          if matches(pattern, topic):
+            queue.append((topic.encode(), msg))
+            break
+      self._cond.notify_all()
+    for pattern, fn in list(self.handlers):
+      if matches(pattern, topic):
+        fn(topic, msg)
+
+  # Call fn(topic, payload) from the publishing thread for every message matching a topic filter
+  def handle(self, pattern, fn):
+    self.handlers.append((pattern, fn))
+
+  # Block until a message is published or timeout seconds pass
+  def wait(self, timeout):
+    with self._cond:
+      self._cond.wait(timeout)
+
+  # Wait for a message on topic (optionally with payload) published after index, returns (index, time, payload)
+  def expect(self, topic, payload=None, after=0, timeout=5):
+    deadline = time.monotonic() + timeout
+    with self._cond:
+      while True:
+        for i in range(after, len(self.messages)):
+          stamp, msg_topic, msg = self.messages[i]
+          if msg_topic == topic and (payload is None or msg == _bytes(payload)):
+            return i, stamp, msg
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          raise TimeoutError('no message on ' + topic)
+        self._cond.wait(remaining)
+
+def _str(value):
+  return value.decode() if isinstance(value, bytes) else value
+
+def _bytes(value):
+  return value.encode() if isinstance(value, str) else value
@@ -0,0 +1,327 @@
+#------------------------------------------
+#
+#  DL32 host simulator - simulated device
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Boots boot.py and main.py unmodified on CPython, in a background thread,
+# against the stand-in modules in sim/mpy. Requires microdot 1.x
+# (pip install "microdot<2") for the web server.
+
+import builtins, compileall, concurrent.futures, gc, importlib.machinery, importlib.util, json, marshal, os, shutil, socket, sys, tempfile, threading, time, traceback, tracemalloc
+
+from sim import board, vfs
+from sim.broker import Broker
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MPY_PATH = os.path.join(REPO_ROOT, 'sim', 'mpy')
+
+# Board revision 3.0 pin numbers, as assigned in main.py
+BUZZER = 14
+BUZZER2 = 3
+NEOPIXEL = 11
+LOCK_RELAY = 1
+PROG_BUTTON = 6
+EXIT_BUTTON = 21
+BELL_BUTTON = 17
+MAG_SENSOR = 15
+WIEGAND_0 = 16
+WIEGAND_1 = 18
+DIP_SWITCHES = (33, 37, 5, 10)
+GARAGE_RELAYS = (2, 4, 12, 13, 8, 9)
+
+# Simulated heap size reported through gc.mem_free()/gc.mem_alloc()
+heap_size = 2 * 1024 * 1024
+
+_T0 = time.monotonic_ns()
+
+# ticks_ms() counts from reset, as on the device
+def reset_clock():
+  global _T0
+  _T0 = time.monotonic_ns()
+
+def _ticks_ms():
+  return (time.monotonic_ns() - _T0) // 1000000
+
+def _ticks_us():
+  return (time.monotonic_ns() - _T0) // 1000
+
+def _ticks_diff(a, b):
+  return a - b
+
+def _ticks_add(a, b):
+  return a + b
+
+_localtime = time.localtime
+
+# MicroPython's 8-field localtime() for firmware callers, CPython's struct_time for everyone else
+def _mp_localtime(secs=None):
+  result = _localtime(secs)
+  if sys._getframe(1).f_code.co_filename.startswith(vfs.flash_root or '\0'):
+    return tuple(result)[:8]
+  return result
+
+def _mem_alloc():
+  if tracemalloc.is_tracing():
+    return tracemalloc.get_traced_memory()[0]
+  return 0
+
+def _mem_free():
+  return heap_size - _mem_alloc()
+
+# Add the MicroPython-only names the firmware expects to the running interpreter
+def install_runtime():
+  if MPY_PATH not in sys.path:
+    sys.path.insert(0, MPY_PATH)
+  builtins.const = lambda value: value
+  time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+  time.sleep_us = lambda us: time.sleep(us / 1000000)
+  time.ticks_ms = _ticks_ms
+  time.ticks_us = _ticks_us
+  time.ticks_cpu = _ticks_us
+  time.ticks_diff = _ticks_diff
+  time.ticks_add = _ticks_add
+  time.localtime = _mp_localtime
+  gc.mem_alloc = _mem_alloc
+  gc.mem_free = _mem_free
+
+# Flash directories of every device booted in this process
+_flash_paths = set()
+
+# Files copied from the repository into a fresh virtual flash
+def firmware_files():
+  return [name for name in os.listdir(REPO_ROOT) if name.endswith('.py') or name.endswith('.cfg')]
+
+# tools/build.py, for the firmware module name and main.py stub of a release
+def _build_tool():
+  spec = importlib.util.spec_from_file_location('dl32_build', os.path.join(REPO_ROOT, 'tools', 'build.py'))
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
+
+# Loads firmware modules from the flash, from their bytecode when it is precompiled, silencing their
+# print() on a quiet device. The namespace of the firmware module a main.py stub imports becomes the device's.
+class _FlashLoader(importlib.machinery.SourceFileLoader):
+  def __init__(self, name, path, device):
+    super().__init__(name, path)
+    self.device = device
+
+  def exec_module(self, module):
+    if self.device.quiet:
+      module.print = lambda *args, **kwargs: None
+    if self.name == self.device._app_module:
+      self.device.ns = module.__dict__
+    super().exec_module(module)
+
+class _FlashFinder:
+  def __init__(self, device):
+    self.device = device
+
+  def find_spec(self, name, path=None, target=None):
+    source = os.path.join(self.device.flash, name + '.py')
+    if path is not None or not os.path.isfile(source):
+      return None
+    return importlib.util.spec_from_file_location(name, source, loader=_FlashLoader(name, source, self.device))
+
+class Device:
+  # flash: directory to use as flash (default: fresh copy of the firmware in a temp dir)
+  # sd: directory to use as SD card (default: no card)
+  # config: dl32.cfg overrides; keys: keys.cfg contents
+  # pins: {pin number: level} preset before boot, e.g. {DIP_SWITCHES[3]: 0} for garage mode
+  # broker: loopback MQTT broker to connect to (default: a new one at the configured address)
+  # track_memory: report Python allocations through gc.mem_alloc() (slower)
+  # quiet: silence firmware print() output
+  # precompiled: lay the flash out as a tools/build.py release, main.py moved to its firmware module and
+  #   replaced by the stub importing it, and compile it to bytecode before boot (CPython .pyc files
+  #   standing in for .mpy)
+  def __init__(self, flash=None, sd=None, config=None, keys=None, web_port=8080, pins=None, broker=None, track_memory=False, quiet=True, precompiled=False):
+    self._tmp = None
+    if flash is None:
+      self._tmp = tempfile.mkdtemp(prefix='dl32-flash-')
+      flash = self._tmp
+      for name in firmware_files():
+        shutil.copy(os.path.join(REPO_ROOT, name), flash)
+      shutil.copytree(os.path.join(REPO_ROOT, 'templates'), os.path.join(flash, 'templates'))
+    self.flash = os.path.abspath(flash)
+    self.sd = sd
+    self.web_port = web_port
+    self.track_memory = track_memory
+    self.quiet = quiet
+    self.precompiled = precompiled
+    self.pins = {MAG_SENSOR: 0}
+    if pins:
+      self.pins.update(pins)
+    cfg_path = os.path.join(self.flash, 'dl32.cfg')
+    with open(cfg_path) as cfg_file:
+      self.config = json.load(cfg_file)
+    self.config['web_port'] = str(web_port)
+    # Keep the clock off the network unless a test names an NTP server
+    self.config['ntp_server'] = ''
+    if config:
+      self.config.update(config)
+    with open(cfg_path, 'w') as cfg_file:
+      json.dump(self.config, cfg_file)
+    if keys is not None:
+      with open(os.path.join(self.flash, 'keys.cfg'), 'w') as keys_file:
+        json.dump(keys, keys_file)
+    self.broker = broker
+    if self.broker is None:
+      self.broker = Broker(self.config['mqtt_brok'], self.config['mqtt_port'])
+    self.ns = None
+    # Firmware module of a precompiled flash, imported by its main.py stub
+    self._app_module = None
+    self.error = None
+    self.was_reset = False
+    self._thread = None
+    self._stopped = threading.Event()
+
+  # Start the firmware and wait until its web server accepts connections
+  def boot(self, timeout=20):
+    install_runtime()
+    import uasyncio
+    uasyncio.reset_state()
+    board.reset_state()
+    vfs.install(self.flash, self.sd)
+    os.chdir(self.flash)
+    # Forget firmware modules and import paths of earlier devices too, their state must not leak into this boot
+    _flash_paths.add(self.flash)
+    for path in _flash_paths:
+      if path in sys.path:
+        sys.path.remove(path)
+    sys.path.insert(0, self.flash)
+    for name in list(sys.modules):
+      path = getattr(sys.modules[name], '__file__', None) or ''
+      if any(path.startswith(flash) for flash in _flash_paths) or name == 'templates' or name.startswith('templates.'):
+        del sys.modules[name]
+    import machine, network
+    machine.reset_state()
+    network.reset_state()
+    for pin_id in self.pins:
+      machine.Pin(pin_id)._value = self.pins[pin_id]
+    if self.track_memory and not tracemalloc.is_tracing():
+      tracemalloc.start()
+    if self.precompiled:
+      self._make_release()
+      compileall.compile_dir(self.flash, quiet=1)
+    reset_clock()
+    self._stopped.clear()
+    self._thread = threading.Thread(target=self._run, name='dl32', daemon=True)
+    self._thread.start()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+      if self._stopped.is_set():
+        raise RuntimeError('firmware stopped during boot') from self.error
+      if board.loop is not None:
+        try:
+          socket.create_connection(('127.0.0.1', self.web_port), timeout=0.5).close()
+          return self
+        except OSError:
+          pass
+      time.sleep(0.05)
+    raise TimeoutError('firmware did not start web server')
+
+  # Move main.py to the firmware module and write the release stub in its place, once per flash
+  def _make_release(self):
+    build = _build_tool()
+    self._app_module = build.APP_MODULE
+    main_path = os.path.join(self.flash, 'main.py')
+    with open(main_path) as main_file:
+      if main_file.read() == build.MAIN_STUB:
+        return
+    os.replace(main_path, os.path.join(self.flash, build.APP_MODULE + '.py'))
+    with open(main_path, 'w') as main_file:
+      main_file.write(build.MAIN_STUB)
+
+  def _run(self):
+    self.ns = {'__name__': '__main__'}
+    if self.quiet:
+      self.ns['print'] = lambda *args, **kwargs: None
+    # With precompiled, the stub's import runs the firmware as a module, with only its own imports as globals
+    finder = _FlashFinder(self)
+    sys.meta_path.insert(0, finder)
+    try:
+      for name in ('boot.py', 'main.py'):
+        path = os.path.join(self.flash, name)
+        if self.precompiled:
+          with open(importlib.util.cache_from_source(path), 'rb') as cached:
+            code = marshal.loads(cached.read()[16:])
+        else:
+          with open(name) as source:
+            code = compile(source.read(), path, 'exec')
+        exec(code, self.ns)
+    except BaseException as e:
+      # Unwinding from machine.reset() surfaces as Reset or as asyncio.run() failing
+      if not board.reset_requested:
+        self.error = e
+        traceback.print_exc()
+    finally:
+      sys.meta_path.remove(finder)
+      self.was_reset = board.reset_requested
+      self._stopped.set()
+
+  # Run fn(*args) on the firmware event loop and return its result
+  def call(self, fn, *args, timeout=10):
+    future = concurrent.futures.Future()
+    def run():
+      try:
+        future.set_result(fn(*args))
+      except BaseException as e:
+        future.set_exception(e)
+    board.loop.call_soon_threadsafe(run)
+    return future.result(timeout)
+
+  # Present a card to the Wiegand reader, or to the reader on another D0/D1 pin pair
+  def swipe(self, card, facility=0, pins=(WIEGAND_0, WIEGAND_1)):
+    import wiegand
+    board.script(wiegand.pulses(pins[0], pins[1], card, facility))
+
+  # Hold a (pulled-up, active low) button for ms milliseconds
+  def press(self, pin_id, ms=100):
+    board.script([(0, pin_id, 0), (ms, pin_id, 1)])
+
+  # Drive an input pin from outside the firmware
+  def set_pin(self, pin_id, value, delay_ms=0):
+    board.at(delay_ms, board.drive, pin_id, value)
+
+  # Current level of any pin
+  def pin(self, pin_id):
+    return board.pins[pin_id].value()
+
+  # Wait for a board event matching kind/subject/value after the given event index, returns (index, event)
+  def wait_event(self, kind, subject=None, value=None, after=0, timeout=5):
+    deadline = time.monotonic() + timeout
+    while True:
+      for i in range(after, len(board.events)):
+        event = board.events[i]
+        if event[1] == kind and (subject is None or event[2] == subject) and (value is None or event[3] == value):
+          return i, event
+      if time.monotonic() > deadline:
+        raise TimeoutError('no ' + kind + ' event')
+      time.sleep(0.0005)
+
+  @property
+  def url(self):
+    return 'http://127.0.0.1:' + str(self.web_port)
+
+  # Shut down the web server and wait for the firmware thread to finish
+  def stop(self, timeout=10):
+    if self._thread is None:
+      return
+    if not self._stopped.is_set():
+      try:
+        self.call(self.ns['web_server'].shutdown)
+      except Exception:
+        pass
+      self._stopped.wait(timeout)
+    self._thread = None
+    self.broker.close()
+    if self._tmp is not None:
+      os.chdir(REPO_ROOT)
+      shutil.rmtree(self._tmp, ignore_errors=True)
+
+  def __enter__(self):
+    return self.boot()
+
+  def __exit__(self, *args):
+    self.stop()
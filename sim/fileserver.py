@@ -0,0 +1,86 @@
+#------------------------------------------
+#
+#  DL32 host simulator - update file server
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Static HTTP server for a directory with single-range Range request
+# support, to stand in for an OTA update source. Counts bytes served, and
+# can cut a response short to simulate a dropped download, or stop sending
+# it for a while to simulate a stalled one.
+
+import http.server, os, threading, urllib.parse
+
+class FileServer:
+  def __init__(self, root, port=0):
+    self.root = os.path.abspath(root)
+    self.bytes_sent = 0
+    # (path, Range header or None) of every GET
+    self.requests = []
+    # (path, n): close the connection after n body bytes of the next response for path
+    self.drop = None
+    # (path, n): hold the connection open after n body bytes of the next response for path
+    self.stall = None
+    self._closed = threading.Event()
+    server = self
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+      def do_GET(self):
+        path = urllib.parse.unquote(urllib.parse.urlparse(self.path).path).lstrip('/')
+        full = os.path.abspath(os.path.join(server.root, path))
+        server.requests.append((path, self.headers.get('Range')))
+        if not full.startswith(server.root + os.sep) or not os.path.isfile(full):
+          self.send_error(404)
+          return
+        with open(full, 'rb') as f:
+          data = f.read()
+        start, end, status = 0, len(data), 200
+        byte_range = self.headers.get('Range')
+        if byte_range and byte_range.startswith('bytes='):
+          first, _, last = byte_range[6:].partition('-')
+          start = int(first) if first else max(0, len(data) - int(last))
+          end = int(last) + 1 if first and last else len(data)
+          if start >= len(data):
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */' + str(len(data)))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+          end = min(end, len(data))
+          status = 206
+        body = data[start:end]
+        self.send_response(status)
+        if status == 206:
+          self.send_header('Content-Range', 'bytes ' + str(start) + '-' + str(end - 1) + '/' + str(len(data)))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if server.drop is not None and server.drop[0] == path:
+          body = body[:server.drop[1]]
+          server.drop = None
+          self.close_connection = True
+        stall = server.stall is not None and server.stall[0] == path
+        if stall:
+          body = body[:server.stall[1]]
+          server.stall = None
+          self.close_connection = True
+        server.bytes_sent += len(body)
+        self.wfile.write(body)
+        if stall:
+          self.wfile.flush()
+          server._closed.wait(10)
+
+      def log_message(self, *args):
+        pass
+
+    self._httpd = http.server.ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+  @property
+  def url(self):
+    return 'http://127.0.0.1:' + str(self._httpd.server_address[1]) + '/'
+
+  def close(self):
+    self._closed.set()
+    self._httpd.shutdown()
+    self._httpd.server_close()
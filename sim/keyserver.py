@@ -0,0 +1,154 @@
+#------------------------------------------
+#
+#  DL32 host simulator - key sync server stand-in
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Central key list server speaking the keysync.py protocol. Every update()
+# is one revision; it is published as a retained delta on the fleet topic.
+# Devices that fall behind ask on <topic>/req and get the net changes since
+# their revision on <topic>/dev/<client id>, or fetch them over HTTP from
+# GET /keys?since=<rev>. Bytes sent are counted per transport.
+#
+# It also answers remote authorization lookups (remoteauth.py) for single
+# keys over HTTP at GET /auth?key=<key>, after auth_delay seconds standing
+# in for the network and directory, and counts them in auth_requests.
+
+import http.server, json, threading, time, urllib.parse
+
+class KeyServer:
+  # keys: initial key list (revision 1), broker: sim.broker.Broker to serve over MQTT,
+  # http_port: serve over HTTP too, history: revisions kept for deltas before falling back to snapshots
+  def __init__(self, keys=None, broker=None, topic='dl32/keys', http_port=None, history=1000):
+    self.keys = dict(keys or {})
+    self.rev = 1
+    self.topic = topic
+    self.history = history
+    # (rev, key, name or None if removed) for every change
+    self.log = []
+    self.bytes_sent = {'mqtt': 0, 'http': 0}
+    self.auth_delay = 0
+    self.auth_requests = 0
+    self._lock = threading.Lock()
+    self.broker = broker
+    if broker is not None:
+      broker.handle(topic + '/req', self._on_request)
+    self._httpd = None
+    if http_port is not None:
+      self._serve_http(http_port)
+
+  @property
+  def url(self):
+    return 'http://127.0.0.1:' + str(self._httpd.server_address[1]) + '/keys'
+
+  @property
+  def auth_url(self):
+    return 'http://127.0.0.1:' + str(self._httpd.server_address[1]) + '/auth'
+
+  # Apply changes as one revision: changes maps key -> name, or None to remove
+  def update(self, changes):
+    with self._lock:
+      self.rev += 1
+      for key in changes:
+        name = changes[key]
+        if name is None:
+          self.keys.pop(key, None)
+        else:
+          self.keys[key] = name
+        self.log.append((self.rev, key, name))
+      self._trim()
+      payload = json.dumps(self.delta(self.rev - 1))
+    self._publish(self.topic, payload, retain=True)
+    return self.rev
+
+  def _trim(self):
+    oldest = self.rev - self.history
+    while self.log and self.log[0][0] <= oldest:
+      self.log.pop(0)
+
+  # Delta from revision since to the current one, or a snapshot if since is too old or unknown
+  def delta(self, since):
+    if since == self.rev:
+      return {'from': since, 'rev': self.rev}
+    if since <= 0 or since > self.rev or since < self.rev - self.history:
+      return {'rev': self.rev, 'full': True, 'set': dict(self.keys)}
+    changes = {}
+    for rev, key, name in self.log:
+      if rev > since:
+        changes[key] = name
+    delta = {'from': since, 'rev': self.rev}
+    updated = {key: changes[key] for key in changes if changes[key] is not None}
+    removed = [key for key in changes if changes[key] is None]
+    if updated:
+      delta['set'] = updated
+    if removed:
+      delta['del'] = removed
+    return delta
+
+  def _publish(self, topic, payload, retain=False):
+    if self.broker is None:
+      return
+    self.bytes_sent['mqtt'] += len(payload)
+    self.broker.publish(topic, payload, retain)
+
+  def _on_request(self, topic, msg):
+    try:
+      request = json.loads(msg)
+      client, since = request['client'], int(request['rev'])
+    except (ValueError, KeyError, TypeError):
+      return
+    with self._lock:
+      payload = json.dumps(self.delta(since))
+    self._publish(self.topic + '/dev/' + client, payload)
+
+  def _serve_http(self, port):
+    server = self
+    class Handler(http.server.BaseHTTPRequestHandler):
+      def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path == '/auth':
+          self._auth(urllib.parse.parse_qs(url.query).get('key', [''])[0])
+          return
+        if url.path != '/keys':
+          self.send_error(404)
+          return
+        try:
+          since = int(urllib.parse.parse_qs(url.query).get('since', ['0'])[0])
+        except ValueError:
+          self.send_error(400)
+          return
+        with server._lock:
+          body = json.dumps(server.delta(since)).encode()
+        server.bytes_sent['http'] += len(body)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def _auth(self, key):
+        time.sleep(server.auth_delay)
+        with server._lock:
+          server.auth_requests += 1
+          name = server.keys.get(key)
+        if name is None:
+          self.send_error(404)
+          return
+        body = json.dumps({'name': name}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, *args):
+        pass
+    self._httpd = http.server.ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+  def close(self):
+    if self._httpd is not None:
+      self._httpd.shutdown()
+      self._httpd.server_close()
+      self._httpd = None
@@ -0,0 +1,68 @@
+#------------------------------------------
+#
+#  DL32 host simulator - buzzer_music module stand-in
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Same song format and tick()/stop() interface as james1236/buzzer_music.
+# Notes are played on a machine.PWM per pin so tones show up in the board
+# event log.
+
+from machine import PWM
+
+NOTES = {'C': 0, 'C#': 1, 'D': 2, 'D#': 3, 'E': 4, 'F': 5, 'F#': 6, 'G': 7, 'G#': 8, 'A': 9, 'A#': 10, 'B': 11}
+
+def note_freq(note):
+  name, octave = note[:-1], int(note[-1])
+  return int(440 * 2 ** ((NOTES[name] - 9) / 12 + octave - 4))
+
+class music:
+  def __init__(self, songString='0 D4 8 0', looping=True, tempo=3, duty=2512, pin=None, pins=None):
+    self.tempo = tempo
+    self.duty = duty
+    self.looping = looping
+    self.pins = pins if pins is not None else [pin]
+    self.pwms = [PWM(p) for p in self.pins if p is not None]
+    self.notes = []
+    self.end = 0
+    for entry in songString.split(';'):
+      parts = entry.split()
+      if len(parts) < 3:
+        continue
+      start, length = float(parts[0]), float(parts[2])
+      self.notes.append((start, start + length, note_freq(parts[1])))
+      self.end = max(self.end, start + length)
+    self.notes.sort()
+    self.position = 0
+    self.playing = None
+
+  def tick(self):
+    if self.position > self.end:
+      self.stop()
+      return False
+    freq = None
+    for start, stop, note in self.notes:
+      if start > self.position:
+        break
+      if self.position < stop:
+        freq = note
+    if freq != self.playing:
+      self.playing = freq
+      for pwm in self.pwms:
+        if freq is None:
+          pwm.duty(0)
+        else:
+          pwm.freq(freq)
+          pwm.duty(self.duty // 64)
+    self.position += 1
+    return True
+
+  def stop(self):
+    if self.playing is not None:
+      for pwm in self.pwms:
+        pwm.duty(0)
+    self.playing = None
+
+  def restart(self):
+    self.position = 0
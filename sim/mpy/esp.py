@@ -0,0 +1,12 @@
+#------------------------------------------
+#
+#  DL32 host simulator - esp module stand-in
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+def osdebug(level):
+  pass
+
+def flash_size():
+  return 4 * 1024 * 1024
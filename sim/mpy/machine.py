@@ -0,0 +1,192 @@
+#------------------------------------------
+#
+#  DL32 host simulator - machine module stand-in
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+import time
+from sim import board
+
+class Pin:
+  IN = 1
+  OUT = 3
+  PULL_UP = 1
+  PULL_DOWN = 2
+  IRQ_FALLING = 2
+  IRQ_RISING = 1
+
+  def __init__(self, id, mode=IN, pull=None, value=None):
+    self.id = id
+    self.mode = mode
+    self.pull = pull
+    self._value = 1 if pull == Pin.PULL_UP else 0
+    self._irqs = []
+    existing = board.pins.get(id)
+    if existing is not None:
+      # Share level and IRQs with earlier instances of the same pin
+      self._value = existing._value
+      self._irqs = existing._irqs
+    board.pins[id] = self
+    if value is not None:
+      self.value(value)
+
+  def value(self, value=None):
+    if value is None:
+      return self._value
+    value = 1 if value else 0
+    if value != self._value:
+      self._value = value
+      board.log('pin', self.id, value)
+
+  def on(self):
+    self.value(1)
+
+  def off(self):
+    self.value(0)
+
+  def __call__(self, value=None):
+    return self.value(value)
+
+  def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING):
+    self._irqs.append((trigger, handler))
+
+  # Level change from outside the firmware (button, sensor, reader)
+  def _drive(self, value):
+    old = self._value
+    self.value(value)
+    if value == old:
+      return
+    edge = Pin.IRQ_RISING if value else Pin.IRQ_FALLING
+    for trigger, handler in self._irqs:
+      if trigger & edge:
+        handler(self)
+
+  def __repr__(self):
+    return 'Pin(' + str(self.id) + ')'
+
+class Timer:
+  ONE_SHOT = 0
+  PERIODIC = 1
+
+  def __init__(self, id=-1, **kwargs):
+    self._handle = None
+    if kwargs:
+      self.init(**kwargs)
+
+  def init(self, mode=PERIODIC, period=-1, callback=None, freq=None):
+    self.deinit()
+    if freq is not None:
+      period = 1000 // freq
+    self._active = True
+    def fire():
+      if not self._active:
+        return
+      callback(self)
+      if mode == Timer.PERIODIC and self._active:
+        self._handle = board.loop.call_later(period / 1000, fire)
+    def start():
+      self._handle = board.loop.call_later(period / 1000, fire)
+    board.on_loop(start)
+
+  def deinit(self):
+    self._active = False
+    if self._handle is not None:
+      self._handle.cancel()
+      self._handle = None
+
+class PWM:
+  def __init__(self, pin, freq=0, duty=0):
+    self.pin = pin
+    self._freq = freq
+    self._duty = duty
+
+  def freq(self, value=None):
+    if value is None:
+      return self._freq
+    self._freq = value
+    board.log('pwm_freq', self.pin.id, value)
+
+  def duty(self, value=None):
+    if value is None:
+      return self._duty
+    self._duty = value
+    board.log('pwm_duty', self.pin.id, value)
+
+  def duty_u16(self, value=None):
+    if value is None:
+      return self._duty * 64
+    self.duty(value // 64)
+
+  def deinit(self):
+    self.duty(0)
+
+class SPI:
+  def __init__(self, id, **kwargs):
+    self.id = id
+
+class WDT:
+  # There is one hardware watchdog: creating another WDT reconfigures it
+  _timeout = None
+  _last_feed = 0
+
+  def __init__(self, id=0, timeout=5000):
+    first = WDT._timeout is None
+    WDT._timeout = timeout
+    WDT._last_feed = board.now_ms()
+    board.log('wdt', 'start', timeout)
+    if first:
+      def check():
+        if board.reset_requested:
+          return
+        if board.now_ms() - WDT._last_feed > WDT._timeout:
+          board.log('wdt', 'expired', WDT._timeout)
+          reset()
+        else:
+          board.loop.call_later(0.1, check)
+      board.on_loop(lambda: board.loop.call_later(0.1, check))
+
+  @property
+  def timeout(self):
+    return WDT._timeout
+
+  def feed(self):
+    WDT._last_feed = board.now_ms()
+
+class RTC:
+  # Time last set, the host clock keeps running unchanged
+  _datetime = None
+
+  # (year, month, day, weekday, hours, minutes, seconds, subseconds)
+  def datetime(self, value=None):
+    if value is None:
+      if RTC._datetime is not None:
+        return RTC._datetime
+      t = time.gmtime()
+      return (t[0], t[1], t[2], t[6], t[3], t[4], t[5], 0)
+    RTC._datetime = tuple(value)
+    board.log('rtc', 'set', RTC._datetime)
+
+# Forget the watchdog and RTC ahead of a new boot
+def reset_state():
+  WDT._timeout = None
+  RTC._datetime = None
+
+def reset():
+  board.reset_requested = True
+  board.log('machine', 'reset')
+  if board.loop is not None:
+    board.loop.stop()
+  raise board.Reset()
+
+def soft_reset():
+  reset()
+
+def freq(value=None):
+  return 240000000
+
+def unique_id():
+  return b'\xd1\x32\x00\x00\x00\x01'
+
+def idle():
+  pass
@@ -0,0 +1,28 @@
+#------------------------------------------
+#
+#  DL32 host simulator - micropython module stand-in
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+from sim import board
+
+def const(value):
+  return value
+
+def native(fn):
+  return fn
+
+viper = native
+
+def alloc_emergency_exception_buf(size):
+  pass
+
+def opt_level(level=None):
+  return 0
+
+def mem_info(verbose=False):
+  pass
+
+def schedule(fn, arg):
+  board.loop.call_soon_threadsafe(fn, arg)
@@ -0,0 +1,31 @@
+#------------------------------------------
+#
+#  DL32 host simulator - neopixel module stand-in
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+from sim import board
+
+class NeoPixel:
+  def __init__(self, pin, n, bpp=3, timing=1):
+    self.pin = pin
+    self.n = n
+    self.buf = [(0, 0, 0)] * n
+    self.writes = 0
+
+  def __setitem__(self, index, value):
+    self.buf[index] = tuple(value)
+
+  def __getitem__(self, index):
+    return self.buf[index]
+
+  def __len__(self):
+    return self.n
+
+  def fill(self, value):
+    self.buf = [tuple(value)] * self.n
+
+  def write(self):
+    self.writes += 1
+    board.log('neopixel', self.pin.id, tuple(self.buf))
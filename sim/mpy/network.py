@@ -0,0 +1,55 @@
+#------------------------------------------
+#
+#  DL32 host simulator - network module stand-in
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+from sim import board
+
+STA_IF = 0
+AP_IF = 1
+
+# Address reported by ifconfig() once connected
+ip_address = '127.0.0.1'
+
+# As on the board, there is one WLAN object per interface
+_interfaces = {}
+
+class WLAN:
+  def __new__(cls, interface=STA_IF):
+    wlan = _interfaces.get(interface)
+    if wlan is None:
+      wlan = _interfaces[interface] = super().__new__(cls)
+      wlan.interface = interface
+      wlan._active = False
+      wlan._connected = False
+      wlan.ssid = None
+    return wlan
+
+  def active(self, value=None):
+    if value is None:
+      return self._active
+    self._active = value
+
+  def connect(self, ssid=None, password=None):
+    self.ssid = ssid
+    self._connected = True
+    board.log('wifi', 'connect', ssid)
+
+  def disconnect(self):
+    self._connected = False
+    board.log('wifi', 'disconnect', self.ssid)
+
+  def isconnected(self):
+    return self._connected
+
+  def ifconfig(self, config=None):
+    return (ip_address, '255.255.255.0', '127.0.0.1', '127.0.0.1')
+
+  def status(self, param=None):
+    return 1010 if self._connected else 1000
+
+# Forget interface state ahead of a new boot
+def reset_state():
+  _interfaces.clear()
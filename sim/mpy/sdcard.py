@@ -0,0 +1,17 @@
+#------------------------------------------
+#
+#  DL32 host simulator - sdcard module stand-in
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# The card is a host directory, set through sim.vfs.sd_root. With no
+# directory set the card is absent and construction fails like a missing card.
+
+from sim import vfs
+
+class SDCard:
+  def __init__(self, spi, cs, baudrate=1320000):
+    if vfs.sd_root is None:
+      raise OSError('no SD card')
+    self.root = vfs.sd_root
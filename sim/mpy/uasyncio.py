@@ -0,0 +1,80 @@
+#------------------------------------------
+#
+#  DL32 host simulator - uasyncio module stand-in
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# CPython asyncio with the uasyncio extras the firmware relies on. Like
+# uasyncio, tasks may be created before the event loop starts; they are
+# scheduled once run() starts it.
+
+import asyncio as _asyncio
+from asyncio import *
+from sim import board
+
+_pending = []
+_tasks = set()
+
+def _keep(task):
+  _tasks.add(task)
+  task.add_done_callback(_tasks.discard)
+  return task
+
+def create_task(coro):
+  try:
+    running_loop = _asyncio.get_running_loop()
+  except RuntimeError:
+    _pending.append(coro)
+    return None
+  return _keep(running_loop.create_task(coro))
+
+# Event that clears when a waiter wakes, and may be set from callbacks and other threads
+class ThreadSafeFlag:
+  def __init__(self):
+    self._event = _asyncio.Event()
+
+  def set(self):
+    try:
+      _asyncio.get_running_loop()
+    except RuntimeError:
+      if board.loop is not None:
+        board.loop.call_soon_threadsafe(self._event.set)
+        return
+    self._event.set()
+
+  def clear(self):
+    self._event.clear()
+
+  async def wait(self):
+    await self._event.wait()
+    self._event.clear()
+
+def sleep_ms(ms):
+  return _asyncio.sleep(ms / 1000)
+
+def wait_for_ms(aw, timeout):
+  return _asyncio.wait_for(aw, timeout / 1000)
+
+def run(main):
+  async def boot():
+    running_loop = _asyncio.get_running_loop()
+    for coro in _pending:
+      _keep(running_loop.create_task(coro))
+    del _pending[:]
+    board.loop_started(running_loop)
+    return await main
+  return _asyncio.run(boot())
+
+def get_event_loop():
+  try:
+    return _asyncio.get_running_loop()
+  except RuntimeError:
+    return _asyncio.new_event_loop()
+
+# Drop tasks queued before the loop started, ahead of a new boot
+def reset_state():
+  for coro in _pending:
+    coro.close()
+  del _pending[:]
+  _tasks.clear()
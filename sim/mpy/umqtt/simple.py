@@ -0,0 +1,71 @@
+#------------------------------------------
+#
+#  DL32 host simulator - umqtt.simple stand-in
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Same interface as micropython-lib umqtt.simple, connected to an in-process
+# sim.broker.Broker registered for the server address and port.
+
+from sim import broker
+
+class MQTTException(Exception):
+  pass
+
+class MQTTClient:
+  def __init__(self, client_id, server, port=0, user=None, password=None, keepalive=0, ssl=False, ssl_params={}):
+    self.client_id = client_id
+    self.server = server
+    self.port = int(port) if port else 1883
+    self.user = user
+    self.pswd = password
+    self.keepalive = keepalive
+    self.cb = None
+    self.broker = None
+    self.queue = None
+
+  def set_callback(self, f):
+    self.cb = f
+
+  def connect(self, clean_session=True):
+    self.broker = broker.find(self.server, self.port)
+    if self.broker is None:
+      raise OSError('connection refused')
+    self.queue = self.broker.attach(self, clean_session)
+    return 0
+
+  def disconnect(self):
+    if self.broker is not None:
+      self.broker.detach(self)
+    self.broker = None
+
+  def _check(self):
+    if self.broker is None or not self.broker.online:
+      raise OSError('not connected')
+
+  def ping(self):
+    self._check()
+
+  def publish(self, topic, msg, retain=False, qos=0):
+    self._check()
+    self.broker.publish(topic, msg, retain, sender=self)
+
+  def subscribe(self, topic, qos=0):
+    self._check()
+    self.broker.subscribe(self, topic)
+
+  # Deliver at most one pending message to the callback
+  def check_msg(self):
+    self._check()
+    if self.queue:
+      topic, msg = self.queue.popleft()
+      self.cb(topic, msg)
+
+  def wait_msg(self):
+    self._check()
+    while not self.queue:
+      self.broker.wait(0.1)
+      self._check()
+    topic, msg = self.queue.popleft()
+    self.cb(topic, msg)
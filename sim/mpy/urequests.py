@@ -0,0 +1,65 @@
+#------------------------------------------
+#
+#  DL32 host simulator - urequests module stand-in
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Subset of micropython-lib urequests on top of urllib. As on the device,
+# raw is the open response stream and content reads it to the end.
+
+import json as _json
+import urllib.error, urllib.request
+
+class Response:
+  def __init__(self, status_code, raw, headers):
+    self.status_code = status_code
+    self.raw = raw
+    self.headers = headers
+    self._content = None
+
+  @property
+  def content(self):
+    if self._content is None:
+      self._content = self.raw.read()
+      self.raw.close()
+    return self._content
+
+  @property
+  def text(self):
+    return self.content.decode('utf-8')
+
+  def json(self):
+    return _json.loads(self.content)
+
+  def close(self):
+    self.raw.close()
+
+def request(method, url, data=None, json=None, headers={}, stream=None, timeout=10):
+  headers = dict(headers)
+  if json is not None:
+    data = _json.dumps(json)
+    headers['Content-Type'] = 'application/json'
+  if isinstance(data, str):
+    data = data.encode()
+  req = urllib.request.Request(url, data=data, headers=headers, method=method)
+  try:
+    response = urllib.request.urlopen(req, timeout=timeout)
+  except urllib.error.HTTPError as e:
+    return Response(e.code, e, dict(e.headers))
+  return Response(response.status, response, dict(response.headers))
+
+def get(url, **kwargs):
+  return request('GET', url, **kwargs)
+
+def post(url, **kwargs):
+  return request('POST', url, **kwargs)
+
+def put(url, **kwargs):
+  return request('PUT', url, **kwargs)
+
+def delete(url, **kwargs):
+  return request('DELETE', url, **kwargs)
+
+def head(url, **kwargs):
+  return request('HEAD', url, **kwargs)
@@ -0,0 +1,12 @@
+#------------------------------------------
+#
+#  DL32 host simulator - webrepl module stand-in
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+def start(port=8266, password=None):
+  pass
+
+def stop():
+  pass
@@ -0,0 +1,95 @@
+#------------------------------------------
+#
+#  DL32 host simulator - wiegand module stand-in
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Same interface and decoding as pjz/micropython-wiegand: bits are clocked
+# in by falling-edge IRQs on the D0/D1 pins and a periodic timer hands a
+# completed 26-bit frame to the callback once the line has been idle for
+# 25 ms. Frames are injected by driving the pins, see pulses(). Every
+# completed frame is logged as a ('wiegand', bit count, raw bits) event.
+
+from machine import Pin, Timer
+from sim import board
+import time
+
+CARD_MASK = 0b11111111111111110
+FACILITY_MASK = 0b1111111100000000000000000
+WIEGAND_LENGTH = 26
+
+class Wiegand:
+  def __init__(self, pin0, pin1, callback, timer_id=-1):
+    self.pin0 = Pin(pin0, Pin.IN)
+    self.pin1 = Pin(pin1, Pin.IN)
+    self.pin0._value = 1
+    self.pin1._value = 1
+    self.callback = callback
+    self.last_card = None
+    self.next_card = 0
+    self._bits = 0
+    self.pin0.irq(trigger=Pin.IRQ_FALLING, handler=self._on_pin0)
+    self.pin1.irq(trigger=Pin.IRQ_FALLING, handler=self._on_pin1)
+    self.last_bit_read = None
+    self.timer = Timer(timer_id)
+    self.timer.init(period=50, mode=Timer.PERIODIC, callback=self._cardcheck)
+    self.cards_read = 0
+
+  def _on_pin0(self, newstate):
+    self._on_pin(0, newstate)
+
+  def _on_pin1(self, newstate):
+    self._on_pin(1, newstate)
+
+  def _on_pin(self, is_one, newstate):
+    # No debounce: injected edges are clean, and ones delivered late by a busy
+    # loop can land within the same millisecond without being spurious
+    self.last_bit_read = time.ticks_ms()
+    self.next_card <<= 1
+    if is_one:
+      self.next_card |= 1
+    self._bits += 1
+
+  def get_card(self):
+    if self.last_card is None:
+      return None
+    return (self.last_card & CARD_MASK) >> 1
+
+  def get_facility_code(self):
+    if self.last_card is None:
+      return None
+    return (self.last_card & FACILITY_MASK) >> 17
+
+  def _cardcheck(self, t):
+    if self.last_bit_read is None:
+      return
+    now = time.ticks_ms()
+    if time.ticks_diff(now, self.last_bit_read) > 25:
+      board.log('wiegand', self._bits, self.next_card)
+      if self._bits == WIEGAND_LENGTH:
+        self.cards_read += 1
+        self.last_card = self.next_card
+        self.callback(self.get_card(), self.get_facility_code(), self.cards_read)
+      self.last_bit_read = None
+      self.next_card = 0
+      self._bits = 0
+
+# Bits of a 26-bit Wiegand frame (even parity, facility, card, odd parity), MSB first
+def frame(card, facility=0):
+  data = ((facility & 0xFF) << 16) | (card & 0xFFFF)
+  bits = [(data >> (23 - i)) & 1 for i in range(24)]
+  even = sum(bits[:12]) % 2
+  odd = 1 - sum(bits[12:]) % 2
+  return [even] + bits + [odd]
+
+# (ms offset, pin number, level) timeline clocking a frame out on D0/D1 pins
+def pulses(pin0, pin1, card, facility=0, start_ms=0, interval_ms=2):
+  steps = []
+  t = start_ms
+  for bit in frame(card, facility):
+    pin = pin1 if bit else pin0
+    steps.append((t, pin, 0))
+    steps.append((t + 0.05, pin, 1))
+    t += interval_ms
+  return steps
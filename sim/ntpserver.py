@@ -0,0 +1,61 @@
+#------------------------------------------
+#
+#  DL32 host simulator - NTP server stand-in
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Answers SNTP requests (clock.py) on a local UDP port with the host time
+# plus offset seconds, after delay seconds standing in for the network.
+# While silent is set, requests are counted but not answered. Point a
+# device at it with config={'ntp_server': server.address}.
+
+import socket, struct, threading, time
+
+# Seconds from 1900 (NTP) to 1970
+NTP_1970 = 2208988800
+
+class NtpServer:
+  def __init__(self, offset=0, delay=0, port=0):
+    self.offset = offset
+    self.delay = delay
+    self.silent = False
+    self.requests = 0
+    self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self._sock.bind(('127.0.0.1', port))
+    self._sock.settimeout(0.2)
+    self._closed = False
+    threading.Thread(target=self._serve, daemon=True).start()
+
+  @property
+  def address(self):
+    return '127.0.0.1:' + str(self._sock.getsockname()[1])
+
+  # NTP seconds and 32-bit fraction of the simulated time
+  def _now(self):
+    now = time.time() + self.offset + NTP_1970
+    return int(now), int((now % 1) * 4294967296)
+
+  def _serve(self):
+    while not self._closed:
+      try:
+        request, addr = self._sock.recvfrom(512)
+      except socket.timeout:
+        continue
+      except OSError:
+        return
+      self.requests += 1
+      if self.silent or len(request) < 48:
+        continue
+      time.sleep(self.delay)
+      seconds, fraction = self._now()
+      # Leap indicator 0, version 3, server mode; stratum 1; the client's transmit time as originate time
+      reply = struct.pack('!BBbb11I', 0x1C, 1, 0, -20, 0, 0, 0, seconds, fraction, *struct.unpack('!II', request[40:48]), seconds, fraction, seconds, fraction)
+      try:
+        self._sock.sendto(reply, addr)
+      except OSError:
+        pass
+
+  def close(self):
+    self._closed = True
+    self._sock.close()
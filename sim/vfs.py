@@ -0,0 +1,78 @@
+#------------------------------------------
+#
+#  DL32 host simulator - virtual flash and SD card filesystem
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Firmware paths are relative to the flash root, which becomes the working
+# directory, or absolute (/main.py, /sd/keys.cfg). Absolute paths whose first
+# component does not exist on the host are redirected into the flash root.
+# os.mount() of a simulated SD card links <flash root>/sd to sd_root.
+
+import builtins, os
+
+flash_root = None
+sd_root = None
+
+_open = builtins.open
+_originals = {}
+
+# Map a firmware path to a host path
+def host_path(path):
+  if isinstance(path, str) and path.startswith('/') and flash_root is not None and not path.startswith(flash_root):
+    top = '/' + path.lstrip('/').split('/')[0]
+    if top == '/' or not os.path.lexists(top):
+      return flash_root + path
+  return path
+
+def _wrap(name):
+  original = _originals[name] = getattr(os, name)
+  def wrapper(path, *args, **kwargs):
+    return original(host_path(path), *args, **kwargs)
+  setattr(os, name, wrapper)
+
+def _open_wrapper(file, *args, **kwargs):
+  return _open(host_path(file), *args, **kwargs)
+
+def _rename(src, dst):
+  return _originals['rename'](host_path(src), host_path(dst))
+
+def _ilistdir(path='.'):
+  for entry in os.scandir(host_path(path)):
+    if entry.is_dir():
+      yield (entry.name, 0x4000, 0, 0)
+    else:
+      yield (entry.name, 0x8000, 0, entry.stat().st_size)
+
+def _mount(device, mount_point):
+  link = flash_root + '/' + mount_point.strip('/')
+  if os.path.lexists(link):
+    os.unlink(link)
+  os.symlink(device.root, link)
+
+def _umount(mount_point):
+  link = flash_root + '/' + mount_point.strip('/')
+  if os.path.islink(link):
+    os.unlink(link)
+
+def _statvfs(path):
+  st = _originals['statvfs'](host_path(path))
+  return (st.f_bsize, st.f_frsize, st.f_blocks, st.f_bfree, st.f_bavail, st.f_files, st.f_ffree, st.f_favail, st.f_flag, st.f_namemax)
+
+# Redirect file access into flash_root and provide os.mount()/os.umount()
+def install(flash, sd=None):
+  global flash_root, sd_root
+  flash_root = os.path.abspath(flash)
+  sd_root = os.path.abspath(sd) if sd is not None else None
+  if _originals:
+    return
+  for name in ('stat', 'listdir', 'remove', 'mkdir', 'rmdir', 'statvfs'):
+    _wrap(name)
+  _originals['rename'] = os.rename
+  os.rename = _rename
+  os.ilistdir = _ilistdir
+  os.statvfs = _statvfs
+  os.mount = _mount
+  os.umount = _umount
+  builtins.open = _open_wrapper
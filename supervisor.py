@@ -0,0 +1,179 @@
+#------------------------------------------
+#
+#  DL32 task supervisor
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Watches the long-lived parts of the firmware and restarts each one on its
+# own when it stalls, instead of waiting for the hardware watchdog to reset
+# the whole board.
+#
+# A watch has a deadline in ms. It stays healthy while it beats within that
+# deadline: by calling beat(), or by its probe() function returning True
+# when the supervisor checks it. Tasks started with spawn() belong to the
+# supervisor. They are also restarted when they end or raise, and they may
+# have no deadline (0) if only that is watched. When a watch stalls, the
+# supervisor records the cause and calls its restart function, or cancels
+# and starts again a task it owns. Time the event loop was blocked is not
+# counted against any watch, because nothing could run then.
+#
+# The hardware watchdog is fed only while every critical watch is healthy.
+# A critical watch that would need more than max_restarts restarts within
+# restart_window ms is given up on. Its cause is saved to LOG_FILE
+# and the watchdog is no longer fed, so it resets the board. load() reads
+# that cause back on the next boot.
+
+import os, time, uasyncio, loopmon
+
+LOG_FILE = 'supervisor.log'
+
+# Tunables
+check_ms = 1000
+max_restarts = 3
+restart_window = 60000
+
+# Per watch: name, deadline, last beat, restart function, probe, critical flag,
+# owned task factory and task, why an owned task ended, restarts in the current window
+# and when it began, total restarts
+_names = []
+_deadlines = []
+_beats = []
+_restarts = []
+_probes = []
+_critical = []
+_factories = []
+_tasks = []
+_ended = []
+_failures = []
+_window = []
+restarts = []
+
+# Called with a message for every recovery
+report = None
+
+cause = None
+reset_cause = None
+given_up = False
+fed = 0
+
+# Watch something that beats or is probed, returns its id
+def watch(name, deadline, restart, critical=False, probe=None):
+  _names.append(name)
+  _deadlines.append(deadline)
+  _beats.append(time.ticks_ms())
+  _restarts.append(restart)
+  _probes.append(probe)
+  _critical.append(critical)
+  _factories.append(None)
+  _tasks.append(None)
+  _ended.append(None)
+  _failures.append(0)
+  _window.append(0)
+  restarts.append(0)
+  return len(_names) - 1
+
+# Run factory() as a task owned by the supervisor once it starts, returns its id
+def spawn(name, factory, deadline=0, critical=False):
+  i = watch(name, deadline, None, critical)
+  _factories[i] = factory
+  return i
+
+def beat(i):
+  _beats[i] = time.ticks_ms()
+
+async def _run(i, coro):
+  try:
+    await coro
+    _ended[i] = 'ended'
+  except Exception as e:
+    _ended[i] = 'failed: ' + repr(e)
+
+def _start(i):
+  _ended[i] = None
+  _tasks[i] = loopmon.spawn(_run(i, _factories[i]()))
+
+def _recover(i, text, now):
+  global cause
+  cause = text
+  if not _failures[i]:
+    _window[i] = now
+  _failures[i] += 1
+  restarts[i] += 1
+  _beats[i] = now
+  if report is not None:
+    report(text)
+  if _factories[i] is None:
+    _restarts[i]()
+    return
+  if _ended[i] is None:
+    _tasks[i].cancel()
+  _start(i)
+
+# Save the cause of a reset the supervisor is about to let happen
+def _give_up(text):
+  global given_up
+  given_up = True
+  if report is not None:
+    report(text + ', resetting')
+  try:
+    with open(LOG_FILE, 'w') as f:
+      f.write(text)
+  except OSError:
+    pass
+
+# Cause of a reset by the supervisor before this boot, or None
+def load():
+  global reset_cause
+  try:
+    with open(LOG_FILE) as f:
+      reset_cause = f.read()
+    os.remove(LOG_FILE)
+  except OSError:
+    reset_cause = None
+  return reset_cause
+
+# Check every watch each check_ms, feeding the hardware watchdog through feed() while the critical ones are healthy
+async def task(feed):
+  global fed
+  now = time.ticks_ms()
+  for i in range(len(_names)):
+    _beats[i] = now
+    if _factories[i] is not None:
+      _start(i)
+  last = now
+  while True:
+    await uasyncio.sleep_ms(check_ms)
+    now = time.ticks_ms()
+    late = time.ticks_diff(now, last) - check_ms
+    last = now
+    healthy = True
+    for i in range(len(_names)):
+      if late > 0:
+        _beats[i] = time.ticks_add(_beats[i], late)
+      if _probes[i] is not None and _probes[i]():
+        _beats[i] = now
+      if _ended[i] is not None:
+        text = _names[i] + ' ' + _ended[i]
+      elif _deadlines[i] and time.ticks_diff(now, _beats[i]) > _deadlines[i]:
+        text = _names[i] + ' stalled for ' + str(time.ticks_diff(now, _beats[i])) + ' ms'
+      else:
+        continue
+      if _failures[i] and time.ticks_diff(now, _window[i]) > restart_window:
+        _failures[i] = 0
+      if _critical[i] and _failures[i] >= max_restarts:
+        healthy = False
+        if not given_up:
+          _give_up(text)
+        continue
+      _recover(i, text, now)
+    if healthy:
+      feed()
+      fed += 1
+
+def to_dict():
+  watches = {}
+  now = time.ticks_ms()
+  for i in range(len(_names)):
+    watches[_names[i]] = {'restarts': restarts[i], 'beat_ms': time.ticks_diff(now, _beats[i]), 'critical': _critical[i]}
+  return {'watches': watches, 'fed': fed, 'cause': cause, 'reset_cause': reset_cause, 'given_up': given_up}
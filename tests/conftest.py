@@ -0,0 +1,29 @@
+#------------------------------------------
+#
+#  DL32 tests
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Firmware modules are imported with the host simulator's MicroPython
+# stand-ins installed; tests that need a whole device boot one with
+# sim.device.Device. Run with: python -m pytest tests
+
+import os, socket, sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+  sys.path.insert(0, REPO_ROOT)
+
+from sim.device import install_runtime
+
+install_runtime()
+
+
+# Unused local TCP port for a simulated web server
+def free_port():
+  sock = socket.socket()
+  sock.bind(('127.0.0.1', 0))
+  port = sock.getsockname()[1]
+  sock.close()
+  return port
@@ -0,0 +1,45 @@
+#------------------------------------------
+#
+#  DL32 tests - configuration upload
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+import json, os, urllib.error, urllib.request
+from conftest import free_port
+from sim.device import Device
+
+# PUT body to /files/dl32.cfg, returns the status code and the flash dl32.cfg after it
+def upload_config(device, body):
+  request = urllib.request.Request(device.url + '/files/dl32.cfg', data=body, method='PUT')
+  try:
+    with urllib.request.urlopen(request, timeout=10) as response:
+      status = response.status
+  except urllib.error.HTTPError as e:
+    status = e.code
+  with open(os.path.join(device.flash, 'dl32.cfg')) as cfg_file:
+    return status, json.load(cfg_file)
+
+def test_invalid_upload_leaves_config():
+  device = Device(web_port=free_port()).boot()
+  try:
+    with open(os.path.join(device.flash, 'dl32.cfg')) as cfg_file:
+      before = json.load(cfg_file)
+    assert upload_config(device, b'{"doorbell": ') == (400, before)
+    assert upload_config(device, b'{"doorbell": "no such tune"}') == (400, before)
+    assert upload_config(device, b'["doorbell"]') == (400, before)
+    assert not os.path.exists(os.path.join(device.flash, 'dl32.cfg.part'))
+  finally:
+    device.stop()
+
+def test_partial_upload_keeps_other_settings():
+  device = Device(config={'doorbell': 'kids'}, web_port=free_port()).boot()
+  try:
+    status, saved = upload_config(device, b'{"doorbell": "mking"}')
+    assert status == 200
+    assert saved['doorbell'] == 'mking'
+    assert saved['wifi_ssid'] == device.config['wifi_ssid']
+    assert saved['mqtt_brok'] == device.config['mqtt_brok']
+    assert device.ns['CONFIG_DICT']['doorbell'] == 'mking'
+  finally:
+    device.stop()
@@ -0,0 +1,43 @@
+#------------------------------------------
+#
+#  DL32 tests - key store files
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+import keystore
+
+def write(tmp_path, text):
+  path = tmp_path / 'keys.cfg'
+  path.write_text(text)
+  return str(path)
+
+def test_json_round_trip(tmp_path):
+  path = str(tmp_path / 'keys.cfg')
+  keys = {'12345': 'alice "a"', '23456': 'bob\n'}
+  keystore.save(path, keys)
+  loaded = {}
+  assert keystore.load(path, loaded) == 2
+  assert loaded == keys
+
+def test_non_string_names_are_converted(tmp_path):
+  path = write(tmp_path, '{"1": 12345, "2": "bob", "3": null, "4": true, "5": -1.5e3}')
+  keys = {}
+  keystore.load(path, keys)
+  assert keys == {'1': '12345', '2': 'bob', '3': '', '4': 'true', '5': '-1.5e3'}
+  assert keystore.skipped == 0
+
+def test_nested_names_are_skipped(tmp_path):
+  path = write(tmp_path, '{"1": {"name": "x}", "n": [1, {}]}, "2": "bob", "3": [], "4": "carol"}')
+  keys = {}
+  assert keystore.load(path, keys) == 2
+  assert keys == {'2': 'bob', '4': 'carol'}
+  assert keystore.skipped == 2
+
+def test_invalid_value_fails(tmp_path):
+  path = write(tmp_path, '{"1": bob}')
+  try:
+    keystore.load(path, {})
+  except ValueError:
+    return
+  assert False, 'bare word accepted as a name'
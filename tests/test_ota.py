@@ -0,0 +1,49 @@
+#------------------------------------------
+#
+#  DL32 tests - OTA downloads
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+import os, shutil, subprocess, sys
+import pytest, uasyncio
+import ota
+from conftest import REPO_ROOT
+from sim.device import firmware_files
+from sim.fileserver import FileServer
+
+# Release directory holding the firmware with led.py changed, and its manifest
+def make_release(path):
+  for name in firmware_files():
+    shutil.copy(os.path.join(REPO_ROOT, name), path)
+  shutil.copytree(os.path.join(REPO_ROOT, 'templates'), os.path.join(path, 'templates'), ignore=shutil.ignore_patterns('__pycache__'))
+  with open(os.path.join(path, 'led.py'), 'a') as f:
+    f.write('\n# changed\n' + '#' * 4000 + '\n')
+  subprocess.run([sys.executable, 'ota.py'], cwd=path, check=True, capture_output=True)
+
+# Installed firmware in path, made the working directory
+def make_device(path, monkeypatch):
+  for name in firmware_files():
+    shutil.copy(os.path.join(REPO_ROOT, name), path)
+  shutil.copytree(os.path.join(REPO_ROOT, 'templates'), os.path.join(path, 'templates'), ignore=shutil.ignore_patterns('__pycache__'))
+  monkeypatch.chdir(path)
+
+def test_stalled_download_times_out_and_resumes(tmp_path, monkeypatch):
+  release = tmp_path / 'release'
+  release.mkdir()
+  make_release(release)
+  device = tmp_path / 'device'
+  device.mkdir()
+  make_device(device, monkeypatch)
+  monkeypatch.setattr(ota, 'timeout', 300)
+  server = FileServer(str(release))
+  try:
+    server.stall = ('led.py', 1000)
+    with pytest.raises(uasyncio.TimeoutError):
+      uasyncio.run(ota.stage(server.url))
+    assert os.path.getsize('ota/led.py.part') == 1000
+    assert uasyncio.run(ota.stage(server.url)) == ['led.py']
+    assert server.requests[-1] == ('led.py', 'bytes=1000-')
+    assert ota.file_hash('ota/led.py') == ota.file_hash(str(release / 'led.py'))
+  finally:
+    server.close()
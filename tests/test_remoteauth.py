@@ -0,0 +1,42 @@
+#------------------------------------------
+#
+#  DL32 tests - remote authorization
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+import time
+from conftest import free_port
+from sim.device import Device
+from sim.keyserver import KeyServer
+
+# Wait until fn() is true or timeout seconds pass
+def wait_for(fn, timeout=10):
+  deadline = time.monotonic() + timeout
+  while not fn():
+    if time.monotonic() > deadline:
+      return False
+    time.sleep(0.02)
+  return True
+
+def test_full_lookup_queue_denies_as_unavailable():
+  server = KeyServer({}, http_port=free_port())
+  server.auth_delay = 2
+  device = Device(keys={}, config={'auth_url': server.auth_url}, web_port=free_port()).boot()
+  try:
+    device.ns['remoteauth'].timeout = 10000
+    bus = device.ns['bus']
+    counters = device.ns['counters']
+    # One lookup in flight and four queued fill the queue, the sixth scan finds it full
+    for card in range(10001, 10007):
+      device.swipe(card)
+      # Let each Wiegand frame end before the next starts
+      time.sleep(0.15)
+    assert wait_for(lambda: counters.counts[counters.SCAN_UNAVAILABLE] == 1)
+    # Every scan gets a result: the queued ones are denied once the service answers
+    assert wait_for(lambda: bus.emitted[bus.KEY_DENIED] == 6)
+    assert counters.counts[counters.SCAN_UNAUTHORIZED] == 5
+    assert server.auth_requests == 5
+  finally:
+    device.stop()
+    server.close()
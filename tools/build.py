@@ -0,0 +1,153 @@
+#------------------------------------------
+#
+#  DL32 release build
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Builds a release tree in which every module is precompiled to .mpy
+# bytecode, so the device loads bytecode instead of compiling source on
+# each boot. MicroPython always runs main.py as source, so the firmware
+# in main.py is compiled as the module app.mpy and main.py becomes a one
+# line stub importing it. boot.py stays source for the same reason and is
+# kept small. The WebUI templates are compiled by tpl.py first and their
+# render modules precompiled too. The tree gets its own ota.json, so it
+# can be published as an OTA update source as is.
+#
+# With --freeze, the modules, tunes and templates are instead written with
+# a manifest to <out>/frozen, for a custom firmware image that keeps them
+# in flash rather than in the heap, built in the MicroPython ESP32 port
+# with: make BOARD=<board> FROZEN_MANIFEST=<out>/frozen/manifest.py
+# The filesystem tree then only holds main.py, boot.py and template
+# sources; configuration, keys and rules belong to each device and are
+# never released. Modules on the filesystem take precedence over frozen
+# ones, so frozen firmware can still be updated over the air.
+#
+# Requires mpy-cross matching the MicroPython version of the firmware,
+# e.g. pip install mpy-cross==1.22.2, or an mpy-cross executable on PATH.
+#
+#   python tools/build.py [--out DIR] [--freeze] [--march ARCH]
+
+import argparse, os, shutil, subprocess, sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Not compiled: run as scripts by MicroPython, or device specific
+SOURCE_FILES = ('boot.py', 'webrepl_cfg.py')
+APP_MODULE = 'app'
+MAIN_STUB = '# Firmware is precompiled into ' + APP_MODULE + '.mpy by tools/build.py\nimport ' + APP_MODULE + '\n'
+
+# Command line to run mpy-cross
+def mpy_cross_command():
+  path = shutil.which('mpy-cross')
+  if path is not None:
+    return [path]
+  try:
+    import mpy_cross
+  except ImportError:
+    sys.exit('mpy-cross not found, install it with: pip install mpy-cross==<MicroPython version>')
+  return [mpy_cross.mpy_cross]
+
+def mpy_compile(command, source, target, name, march):
+  args = command + ['-o', target, '-s', name]
+  if march:
+    args.append('-march=' + march)
+  subprocess.run(args + [source], check=True)
+
+# Firmware modules in the repository root, as (module name, source path)
+def firmware_modules():
+  modules = []
+  for name in sorted(os.listdir(REPO_ROOT)):
+    if name.endswith('.py') and name not in SOURCE_FILES:
+      module = APP_MODULE if name == 'main.py' else name[:-3]
+      modules.append((module, os.path.join(REPO_ROOT, name)))
+  return modules
+
+# Compile the templates in a copy of templates/, returns the copy
+def compile_templates(work_dir):
+  templates_dir = os.path.join(work_dir, 'templates')
+  shutil.copytree(os.path.join(REPO_ROOT, 'templates'), templates_dir, ignore=shutil.ignore_patterns('__pycache__', '*.py'))
+  shutil.copy(os.path.join(REPO_ROOT, 'templates', '__init__.py'), templates_dir)
+  sys.path.insert(0, REPO_ROOT)
+  import tpl
+  cwd = os.getcwd()
+  os.chdir(work_dir)
+  try:
+    tpl.compile_all()
+  finally:
+    os.chdir(cwd)
+  return templates_dir
+
+def write(path, text):
+  with open(path, 'w') as out_file:
+    out_file.write(text)
+
+def build(out, freeze, march):
+  command = mpy_cross_command()
+  if os.path.exists(out):
+    shutil.rmtree(out)
+  work_dir = os.path.join(out, 'frozen' if freeze else '.work')
+  os.makedirs(work_dir)
+  templates_src = compile_templates(work_dir)
+  os.makedirs(os.path.join(out, 'templates'))
+  sizes = []
+  for module, source in firmware_modules():
+    target = os.path.join(out, module + '.mpy')
+    mpy_compile(command, source, target, module + '.py', march)
+    sizes.append((module, os.path.getsize(source), os.path.getsize(target)))
+    if freeze:
+      shutil.copy(source, os.path.join(work_dir, module + '.py'))
+      os.remove(target)
+  for name in sorted(os.listdir(templates_src)):
+    source = os.path.join(templates_src, name)
+    if name.endswith('.py'):
+      module = 'templates/' + name[:-3]
+      target = os.path.join(out, module + '.mpy')
+      mpy_compile(command, source, target, module + '.py', march)
+      sizes.append((module, os.path.getsize(source), os.path.getsize(target)))
+      if freeze:
+        os.remove(target)
+    else:
+      shutil.copy(source, os.path.join(out, 'templates', name))
+  # Configuration, keys and rules belong to each device and are not released
+  shutil.copy(os.path.join(REPO_ROOT, 'boot.py'), out)
+  write(os.path.join(out, 'main.py'), MAIN_STUB)
+  if freeze:
+    lines = ['# Generated by tools/build.py - DL32 firmware modules to freeze', 'include("$(PORT_DIR)/boards/manifest.py")']
+    for module, source in firmware_modules():
+      lines.append('module("' + module + '.py", base_path="' + work_dir + '")')
+    lines.append('package("templates", base_path="' + work_dir + '")')
+    write(os.path.join(work_dir, 'manifest.py'), '\n'.join(lines) + '\n')
+  else:
+    shutil.rmtree(work_dir)
+  # Make the tree an OTA update source
+  sys.path.insert(0, REPO_ROOT)
+  import ota
+  cwd = os.getcwd()
+  os.chdir(out)
+  try:
+    ota._write_json(ota.MANIFEST_FILE, ota.manifest())
+  finally:
+    os.chdir(cwd)
+  return sizes
+
+def main():
+  parser = argparse.ArgumentParser(description='Build a precompiled DL32 release tree')
+  parser.add_argument('--out', default=os.path.join(REPO_ROOT, 'dist'), help='output directory (default: dist/, replaced)')
+  parser.add_argument('--freeze', action='store_true', help='write the modules for freezing into a custom firmware image instead')
+  parser.add_argument('--march', default='xtensawin', help='mpy-cross native code architecture (default: xtensawin, for ESP32-S3)')
+  args = parser.parse_args()
+  out = os.path.abspath(args.out)
+  sizes = build(out, args.freeze, args.march)
+  total_source = total_mpy = 0
+  for module, source_size, mpy_size in sizes:
+    print('{:<28} {:>8} {:>8}'.format(module, source_size, mpy_size))
+    total_source += source_size
+    total_mpy += mpy_size
+  print('{:<28} {:>8} {:>8}'.format('total (source, .mpy bytes)', total_source, total_mpy))
+  print('Release written to ' + out)
+  if args.freeze:
+    print('Frozen modules and manifest written to ' + os.path.join(out, 'frozen'))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,160 @@
+#------------------------------------------
+#
+#  DL32 WebUI template compiler
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Templates live in templates/<name>.html and are compiled once into
+# templates/<name>.py, a module with a render(v) generator that yields the
+# static markup as byte constants and the dynamic values taken from context
+# dict v. Compiled modules are built on first load if missing, or ahead of
+# time by running this file with CPython: python tpl.py
+#
+# Template syntax:
+#   {{name}}                    HTML-escaped value
+#   {{!name}}                   Raw value (str, bytes or iterable of chunks)
+#   {% include file %}          Inline another file from templates/ at compile time
+#   {% if name %} {% else %}    Conditional block, closed by {% end %}
+#   {% if not name %}
+#   {% for a, b in name %}      Loop block, closed by {% end %}
+
+import os
+
+TEMPLATE_DIR = 'templates'
+
+# Render functions of loaded templates, keyed by template name
+_loaded = {}
+
+# Escape a dynamic value for inclusion in HTML
+def esc(value):
+  if not isinstance(value, str):
+    value = str(value)
+  return value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;').replace("'", '&#39;').encode()
+
+# Yield a raw value as byte chunks
+def raw(value):
+  if isinstance(value, bytes):
+    yield value
+  elif isinstance(value, str):
+    yield value.encode()
+  else:
+    for chunk in value:
+      yield from raw(chunk)
+
+# Read template source, expanding includes
+def _read(filename):
+  with open(TEMPLATE_DIR + '/' + filename) as template_file:
+    src = template_file.read()
+  out = ''
+  pos = 0
+  while True:
+    start = src.find('{% include ', pos)
+    if start < 0:
+      return out + src[pos:]
+    end = src.find('%}', start)
+    out += src[pos:start] + _read(src[start + 11:end].strip())
+    pos = end + 2
+
+# Strip leading indentation from every line but the first of a static chunk
+def _minify(text):
+  lines = text.split('\n')
+  for i in range(1, len(lines)):
+    lines[i] = lines[i].lstrip()
+  return '\n'.join(lines)
+
+# Python expression for a template variable
+def _ref(name, scope):
+  if name in scope:
+    return name
+  return 'v[' + repr(name) + ']'
+
+# Compile template source into Python module source
+def _compile(src):
+  code = ['# Generated by tpl.py - do not edit', 'from tpl import esc, raw', '', 'def render(v):']
+  indent = '  '
+  scope = []
+  blocks = []
+  pos = 0
+  while pos < len(src):
+    var = src.find('{{', pos)
+    tag = src.find('{%', pos)
+    if var < 0 and tag < 0:
+      start = len(src)
+    elif var < 0 or (tag >= 0 and tag < var):
+      start = tag
+    else:
+      start = var
+    if start > pos:
+      code.append(indent + 'yield ' + repr(_minify(src[pos:start]).encode()))
+    if start == len(src):
+      break
+    if start == var:
+      end = src.find('}}', start)
+      expr = src[start + 2:end].strip()
+      if expr.startswith('!'):
+        code.append(indent + 'yield from raw(' + _ref(expr[1:].strip(), scope) + ')')
+      else:
+        code.append(indent + 'yield esc(' + _ref(expr, scope) + ')')
+    else:
+      end = src.find('%}', start)
+      words = src[start + 2:end].split()
+      if words[0] == 'if':
+        if words[1] == 'not':
+          code.append(indent + 'if not ' + _ref(words[2], scope) + ':')
+        else:
+          code.append(indent + 'if ' + _ref(words[1], scope) + ':')
+        blocks.append(0)
+        indent += '  '
+      elif words[0] == 'else':
+        if code[-1].endswith(':'):
+          code.append(indent + 'pass')
+        code.append(indent[:-2] + 'else:')
+      elif words[0] == 'for':
+        targets = [t.strip() for t in ' '.join(words[1:words.index('in')]).split(',')]
+        code.append(indent + 'for ' + ', '.join(targets) + ' in ' + _ref(words[-1], scope) + ':')
+        scope.extend(targets)
+        blocks.append(len(targets))
+        indent += '  '
+      elif words[0] == 'end':
+        if code[-1].endswith(':'):
+          code.append(indent + 'pass')
+        for i in range(blocks.pop()):
+          scope.pop()
+        indent = indent[:-2]
+      else:
+        raise ValueError('Unknown template tag: ' + words[0])
+    pos = end + 2
+  return '\n'.join(code) + '\n'
+
+# Compile templates/<name>.html into templates/<name>.py
+def compile_template(name):
+  src = _compile(_read(name + '.html'))
+  with open(TEMPLATE_DIR + '/' + name + '.py', 'w') as module_file:
+    module_file.write(src)
+
+# Compile every page template
+def compile_all():
+  for filename in os.listdir(TEMPLATE_DIR):
+    if filename.endswith('.html'):
+      print('Compiling template ' + filename)
+      compile_template(filename[:-5])
+
+# Return render function of a template, compiling it on first load if needed
+def load(name):
+  render_fn = _loaded.get(name)
+  if render_fn is None:
+    try:
+      module = __import__(TEMPLATE_DIR + '.' + name, None, None, ['render'])
+    except ImportError:
+      compile_template(name)
+      module = __import__(TEMPLATE_DIR + '.' + name, None, None, ['render'])
+    render_fn = _loaded[name] = module.render
+  return render_fn
+
+# Render template to a generator of byte chunks
+def render(name, v):
+  return load(name)(v)
+
+if __name__ == '__main__':
+  compile_all()
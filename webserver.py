@@ -0,0 +1,274 @@
+#------------------------------------------
+#
+#  DL32 web server connection handling
+#  https://github.com/Mark-Roly/DL32_mpy
+#
+#------------------------------------------
+
+# Microdot with persistent connections and bounded concurrency. Microdot
+# answers one request per connection with HTTP/1.0 and closes it, so each
+# page load pays for a TCP handshake per request, and every client that
+# connects gets a task and its buffers, however many arrive at once.
+#
+# Here a connection serves requests until the client closes it, asks to
+# close, stays idle for keepalive_timeout ms or has made keepalive_max
+# requests. Responses with a known length keep the connection open; other
+# streamed responses are sent chunked to HTTP/1.1 clients and end the
+# connection for HTTP/1.0 clients. At most max_conns connections are
+# served at once, each with its own preallocated buffer that the response
+# head and body are gathered into, so a response goes out in as few
+# socket writes as possible. Bodies that can readinto(), such as files,
+# are read straight into it. Up to max_waiting further connections queue
+# for a free slot for queue_timeout ms, and connections stop being kept
+# alive while any are queued. Connections beyond that, or still queued
+# after queue_timeout, are refused with 503. A client that does not send
+# a complete request head within read_timeout ms is disconnected. Request
+# bodies up to max_upload bytes are accepted; bodies larger than
+# Request.max_body_length are left for the route to stream. handler_age()
+# reports how long the oldest running route handler has taken, and
+# cancel_handlers() drops the connections of handlers that are stuck.
+
+from microdot_asyncio import Microdot, Request, Response
+import time, uasyncio
+
+# Tunables, set before the server starts
+max_conns = 4
+max_waiting = 4
+queue_timeout = 5000
+read_timeout = 5000
+keepalive_timeout = 5000
+keepalive_max = 100
+buffer_size = 1024
+max_upload = 262144
+
+# Statistics
+accepted = 0
+rejected = 0
+timeouts = 0
+cancelled = 0
+requests = 0
+reused = 0
+active = 0
+waiting = 0
+peak = 0
+
+# Per connection slot buffers, free slots, and a flag raised when one is released
+_buffers = []
+_free = []
+# Per connection slot: serving task, and ticks_ms its route handler started or None
+_tasks = []
+_started = []
+_released = None
+
+REJECT = b'HTTP/1.0 503 Service Unavailable\r\nRetry-After: 1\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+
+# Wait for a free connection slot, returns its index or None if refused
+async def _acquire():
+  global waiting
+  if _free and not waiting:
+    return _free.pop()
+  if waiting >= max_waiting:
+    return None
+  waiting += 1
+  deadline = time.ticks_add(time.ticks_ms(), queue_timeout)
+  try:
+    while not _free:
+      remaining = time.ticks_diff(deadline, time.ticks_ms())
+      if remaining <= 0:
+        return None
+      _released.clear()
+      try:
+        await uasyncio.wait_for_ms(_released.wait(), remaining)
+      except uasyncio.TimeoutError:
+        return None
+    return _free.pop()
+  finally:
+    waiting -= 1
+
+def _release(slot):
+  _free.append(slot)
+  _released.set()
+
+# True if the client asked for the connection to stay open
+def _wants_keepalive(req):
+  connection = req.headers.get('Connection', '').lower()
+  if req.http_version == '1.0':
+    return connection == 'keep-alive'
+  return connection != 'close'
+
+# Append data to the connection buffer, writing the buffer out when it is full
+async def _put(writer, buf, n, data):
+  size = len(data)
+  if n + size > len(buf):
+    if n:
+      await writer.awrite(buf[:n])
+      n = 0
+    if size > len(buf):
+      await writer.awrite(data)
+      return 0
+  buf[n:n + size] = data
+  return n + size
+
+# Write a response through the connection buffer, returns whether the connection can stay open
+async def _write(res, writer, buf, version, keep):
+  res.complete()
+  chunked = False
+  if 'Content-Length' not in res.headers and not res.is_head:
+    if keep and version == '1.1':
+      chunked = True
+      res.headers['Transfer-Encoding'] = 'chunked'
+    else:
+      keep = False
+  res.headers['Connection'] = 'keep-alive' if keep else 'close'
+  reason = res.reason if res.reason is not None else ('OK' if res.status_code == 200 else 'N/A')
+  n = await _put(writer, buf, 0, ('HTTP/' + version + ' ' + str(res.status_code) + ' ' + reason + '\r\n').encode())
+  for header, value in res.headers.items():
+    values = value if isinstance(value, list) else [value]
+    for value in values:
+      n = await _put(writer, buf, n, (header + ': ' + str(value) + '\r\n').encode())
+  n = await _put(writer, buf, n, b'\r\n')
+  if res.is_head:
+    if hasattr(res.body, 'close'):
+      res.body.close()
+  elif hasattr(res.body, 'readinto') and not chunked:
+    # Read file bodies straight into the connection buffer
+    try:
+      while True:
+        if n == len(buf):
+          await writer.awrite(buf)
+          n = 0
+        size = res.body.readinto(buf[n:])
+        if not size:
+          break
+        n += size
+    finally:
+      res.body.close()
+  else:
+    # Live bodies, such as event streams, are written out piece by piece
+    live = getattr(res.body, 'live', False)
+    try:
+      async for body in res.body_iter():
+        if isinstance(body, str):
+          body = body.encode()
+        if not body:
+          continue
+        if chunked:
+          n = await _put(writer, buf, n, ('%x\r\n' % len(body)).encode())
+          n = await _put(writer, buf, n, body)
+          n = await _put(writer, buf, n, b'\r\n')
+        else:
+          n = await _put(writer, buf, n, body)
+        if live:
+          await writer.awrite(buf[:n])
+          n = 0
+    finally:
+      if hasattr(res.body, 'close'):
+        res.body.close()
+    if chunked:
+      n = await _put(writer, buf, n, b'0\r\n\r\n')
+  if n:
+    await writer.awrite(buf[:n])
+  return keep
+
+async def _close(writer):
+  try:
+    await writer.aclose()
+  except OSError:
+    pass
+
+class WebServer(Microdot):
+  async def start_server(self, host='0.0.0.0', port=5000, debug=False, ssl=None):
+    global _released
+    _released = uasyncio.Event()
+    Request.max_content_length = max_upload
+    # Allocated once; the server may be started again on another port
+    if not _buffers:
+      for slot in range(max_conns):
+        _buffers.append(memoryview(bytearray(buffer_size)))
+        _tasks.append(None)
+        _started.append(None)
+        _free.append(slot)
+    await super().start_server(host, port, debug, ssl)
+
+  async def handle_request(self, reader, writer):
+    global accepted, rejected, active, peak
+    slot = await _acquire()
+    if slot is None:
+      rejected += 1
+      try:
+        await writer.awrite(REJECT)
+      except OSError:
+        pass
+      await _close(writer)
+      return
+    accepted += 1
+    active += 1
+    if active > peak:
+      peak = active
+    _tasks[slot] = uasyncio.current_task()
+    try:
+      await self._serve(reader, writer, slot)
+    except Exception:
+      pass
+    finally:
+      _tasks[slot] = None
+      _started[slot] = None
+      active -= 1
+      _release(slot)
+      await _close(writer)
+
+  # Serve requests on a connection until it is to be closed
+  async def _serve(self, reader, writer, slot):
+    global requests, reused, timeouts
+    buf = _buffers[slot]
+    peer = writer.get_extra_info('peername')
+    served = 0
+    while True:
+      try:
+        req = await uasyncio.wait_for_ms(Request.create(self, reader, writer, peer), keepalive_timeout if served else read_timeout)
+      except uasyncio.TimeoutError:
+        if not served:
+          timeouts += 1
+        return
+      except Exception:
+        # Malformed request, answered 400 below
+        req = None
+      else:
+        if req is None and served:
+          return
+      _started[slot] = time.ticks_ms()
+      res = await self.dispatch_request(req)
+      _started[slot] = None
+      if res == Response.already_handled:
+        return
+      served += 1
+      requests += 1
+      if served > 1:
+        reused += 1
+      # The connection can only be reused once the whole request body has been read
+      keep = req is not None and _wants_keepalive(req) and req.content_length <= Request.max_body_length and served < keepalive_max and not waiting
+      if not await _write(res, writer, buf, '1.1' if req is not None and req.http_version == '1.1' else '1.0', keep):
+        return
+
+# Milliseconds the longest running route handler has been running, 0 if none
+def handler_age(now):
+  age = 0
+  for started in _started:
+    if started is not None and time.ticks_diff(now, started) > age:
+      age = time.ticks_diff(now, started)
+  return age
+
+# Drop the connections whose route handler has been running for at least age ms, returns how many
+def cancel_handlers(now, age):
+  global cancelled
+  count = 0
+  for slot in range(len(_started)):
+    if _started[slot] is not None and time.ticks_diff(now, _started[slot]) >= age:
+      _started[slot] = None
+      _tasks[slot].cancel()
+      count += 1
+  cancelled += count
+  return count
+
+def to_dict():
+  return {'active': active, 'waiting': waiting, 'peak': peak, 'accepted': accepted, 'rejected': rejected, 'timeouts': timeouts, 'cancelled': cancelled, 'requests': requests, 'reused': reused}